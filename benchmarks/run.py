@@ -0,0 +1,276 @@
+"""Benchmarks for the calculator's hot paths and a full app rerun.
+
+    python benchmarks/run.py                    # compare with baseline.json
+    python benchmarks/run.py --save             # record a new baseline
+    python benchmarks/run.py --rows 10000000    # batch scoring up to 10^7 rows
+    python benchmarks/run.py --only 'batch_*'
+
+Each case runs until it has taken about ``--min-time`` seconds (at least once)
+and its median time per call is compared with the baseline. A case slower
+than its baseline by more than the baseline's threshold is a regression, and
+the run exits with status 1. Baselines only mean something on the machine
+that recorded them; the file notes which one that was.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from carbon_footprint import options  # noqa: E402
+from carbon_footprint.factors import CATEGORIES  # noqa: E402
+from carbon_footprint.ingest import DEFAULT_CHUNKSIZE  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+APP = os.path.join(ROOT, "temp.py")
+# Allowed slowdown over the baseline, as a fraction
+DEFAULT_THRESHOLD = 0.25
+# Figures and app reruns depend on Plotly and Streamlit internals, and vary more
+LOOSE_THRESHOLD = 0.5
+DEFAULT_ROWS = 10 ** 6
+
+# ``setup()`` returns the function to time; ``rows`` is set for throughput cases
+Case = namedtuple("Case", "name setup threshold rows", defaults=(DEFAULT_THRESHOLD, None))
+
+COMMUTE = {
+    "distance": 14.0,
+    "transport_category": "Both Private and Public",
+    "vehicle_type": "Four Wheeler",
+    "vehicle_category": "sedan",
+    "fuel_type": "petrol",
+    "engine_cc": 1500,
+    "people_count": 2,
+    "public_mode": "Bus",
+    "public_fuel_type": "diesel",
+    "private_trips": 2,
+    "total_trips": 4,
+}
+
+
+def survey(n, seed=0):
+    """A synthetic commute survey of ``n`` rows, with a few rejected ones."""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+
+    def pick(values):
+        return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)]
+
+    vehicle_type = pick(list(options.VEHICLE_TYPES))
+    return pd.DataFrame({
+        "distance": rng.uniform(1, 40, n).round(1),
+        "days_per_week": rng.integers(3, 6, n),
+        "weeks_per_month": 4,
+        "transport_category": pick(CATEGORIES),
+        "vehicle_type": vehicle_type,
+        "vehicle_category": np.where(
+            vehicle_type == "Two Wheeler",
+            pick(options.TWO_WHEELER_CATEGORIES),
+            np.where(vehicle_type == "Four Wheeler", pick(options.CAR_TYPES), ""),
+        ),
+        "fuel_type": pick(["petrol", "diesel", "cng", "electric"]),
+        "engine_cc": rng.integers(100, 2500, n),
+        "people_count": rng.integers(1, 3, n),
+        "public_mode": pick(list(options.PUBLIC_MODES)),
+        "taxi_type": pick(options.TAXI_TYPES),
+        "public_fuel_type": pick(options.FUEL_OPTIONS["bus"]),
+        "public_people_count": 1,
+        "private_trips": 2,
+        "total_trips": 4,
+    })
+
+
+def calculate_case():
+    from carbon_footprint.calculator import calculate
+
+    return lambda: calculate(**COMMUTE)
+
+
+def alternatives_case():
+    from carbon_footprint.factors import FUELS
+    from carbon_footprint.factorsets import active
+    from carbon_footprint.recommend import KINDS
+    from carbon_footprint.session import commute_alternatives
+
+    # What the app's Commute.set computes when a commute's distance, vehicle or fuel changes
+    table = active().table
+    return lambda: commute_alternatives(560.0, KINDS.index("Four Wheeler"), FUELS.index("petrol"), 1, table)
+
+
+def recommendations_case():
+    from carbon_footprint.recommend import recommendations
+
+    return lambda: recommendations(61.6, 560.0, "Four Wheeler", 1, "petrol")
+
+
+def gauge_case():
+    from carbon_footprint import charts
+
+    return lambda: charts.gauge(61.6)
+
+
+def comparison_chart_case():
+    from carbon_footprint import calculator, charts
+
+    emissions = calculator.calculate(**COMMUTE)["comparison"]
+    return lambda: charts.comparison(emissions)
+
+
+def app_case():
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(APP, default_timeout=60).run()
+
+    def rerun():
+        # Calculate reruns the whole script and builds every result
+        [button for button in app.button if button.label == "Calculate Carbon Footprint"][0].click().run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+
+    return rerun
+
+
+def batch_case(rows):
+    def setup():
+        from carbon_footprint.ingest import score_chunk
+
+        # Scored a chunk at a time, as process_file does
+        chunk = survey(min(rows, DEFAULT_CHUNKSIZE))
+        chunks, rest = divmod(rows, len(chunk))
+        last = chunk.iloc[:rest]
+        score_chunk(chunk)
+
+        def run():
+            for _ in range(chunks):
+                score_chunk(chunk)
+            if rest:
+                score_chunk(last)
+
+        return run
+
+    return setup
+
+
+def cases(max_rows):
+    yield Case("calculate", calculate_case)
+    yield Case("alternatives", alternatives_case)
+    yield Case("recommendations", recommendations_case)
+    yield Case("gauge_figure", gauge_case, LOOSE_THRESHOLD)
+    yield Case("comparison_figure", comparison_chart_case, LOOSE_THRESHOLD)
+    yield Case("app_rerun", app_case, LOOSE_THRESHOLD)
+    rows = 1000
+    while rows <= max_rows:
+        yield Case(f"batch_{rows:.0e}".replace("+0", ""), batch_case(rows), rows=rows)
+        rows *= 10
+
+
+def measure(function, min_time):
+    """Seconds per call of ``function``, called until ``min_time`` has passed."""
+    times = []
+    while sum(times) < min_time:
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def machine():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(selected, min_time):
+    results = {}
+    for case in selected:
+        try:
+            function = case.setup()
+        except ImportError as exc:
+            print(f"{case.name:<20} skipped: {exc}")
+            continue
+        function()
+        times = measure(function, min_time)
+        result = {"median_s": statistics.median(times), "min_s": min(times), "runs": len(times), "threshold": case.threshold}
+        if case.rows:
+            result["rows_per_s"] = case.rows / result["median_s"]
+        results[case.name] = result
+    return results
+
+
+def _format(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("µs", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3g} {unit}"
+    return f"{seconds / 1e-9:.3g} ns"
+
+
+def compare(results, baseline):
+    """Print ``results`` against ``baseline``; returns the names of regressed cases."""
+    regressed = []
+    for name, result in results.items():
+        line = f"{name:<20} {_format(result['median_s']):>10}"
+        if "rows_per_s" in result:
+            line += f" {result['rows_per_s']:>12,.0f} rows/s"
+        base = baseline.get(name)
+        if base:
+            change = result["median_s"] / base["median_s"] - 1
+            line += f"  {change:+.1%} vs baseline"
+            if change > base.get("threshold", DEFAULT_THRESHOLD):
+                line += "  REGRESSION"
+                regressed.append(name)
+        print(line)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", metavar="PATTERN", action="append", help="run cases matching these glob patterns")
+    parser.add_argument("--rows", type=float, default=DEFAULT_ROWS, help="largest batch size (default 10^6)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to spend per case")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file (default benchmarks/baseline.json)")
+    parser.add_argument("--save", action="store_true", help="record the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    selected = [
+        case for case in cases(int(args.rows))
+        if not args.only or any(fnmatch.fnmatch(case.name, pattern) for pattern in args.only)
+    ]
+    results = run(selected, args.min_time)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            recorded = json.load(file)
+        baseline = recorded["results"]
+        if recorded.get("machine") != machine():
+            print(f"Baseline was recorded on another machine: {recorded.get('machine')}", file=sys.stderr)
+    regressed = compare(results, {} if args.save else baseline)
+
+    if args.save:
+        # Cases not run this time keep their old baseline
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump({"machine": machine(), "results": baseline}, file, indent=2)
+            file.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    if regressed:
+        print(f"{len(regressed)} regression(s): {', '.join(regressed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Memory held per app session, for many concurrent sessions.
+
+    python benchmarks/sessions.py                  # 500 sessions
+    python benchmarks/sessions.py --sessions 2000 --max-kib 2
+
+Each simulated session holds what the app keeps in ``st.session_state`` for
+a calculated commute, with random inputs, and shows its results once:
+labels, comparison and recommendation texts, which are dropped again as
+after a rerun. One session in ``--bulk-every`` has also scored a survey with
+the bulk upload. The memory still allocated afterwards, divided by the
+number of sessions, is what each session costs. The factor table is shared
+by every session and reported on its own. The run exits with status 1 when a
+session costs more than ``--max-kib``.
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from carbon_footprint import options  # noqa: E402
+from carbon_footprint.engine import emission_factor  # noqa: E402
+from carbon_footprint.factorsets import active  # noqa: E402
+from carbon_footprint.session import Commute, score_survey  # noqa: E402
+from run import survey  # noqa: E402
+
+DEFAULT_SESSIONS = 500
+# Budget per session, in KiB
+DEFAULT_MAX_KIB = 4
+DEFAULT_BULK_EVERY = 10
+# Rows of the survey each bulk upload scores
+BULK_ROWS = 5000
+
+
+def commute(rng, factor_set):
+    """Inputs of ``Commute.set`` for a random commute, as the app's form gives them."""
+    table = factor_set.table
+    inputs = {
+        "distance": round(rng.uniform(1, 40), 1),
+        "days_per_week": rng.randint(3, 6),
+        "weeks_per_month": 4,
+        "factor_set": factor_set,
+    }
+    if rng.random() < 0.3:
+        mode = rng.choice(list(options.PUBLIC_MODES))
+        if mode == "Bus":
+            fuel = rng.choice(options.FUEL_OPTIONS["bus"])
+            factor, name = emission_factor("bus", "", fuel, table=table), f"Bus ({fuel})"
+        elif mode == "Taxi":
+            car, fuel = rng.choice(options.TAXI_TYPES), rng.choice(options.FUEL_OPTIONS["taxi"])
+            factor, name = emission_factor("taxi", car, fuel, table=table), f"Taxi - {car.title()} ({fuel})"
+        else:
+            fuel, factor, name = None, emission_factor("metro", table=table), "Metro"
+        return dict(inputs, emission_factor=factor, vehicle_type="Public Transport", vehicle_name=name, people_count=1, fuel_type=fuel)
+    vehicle_type = rng.choice(["Two Wheeler", "Four Wheeler"])
+    key = options.VEHICLE_TYPES[vehicle_type]
+    if key == "two_wheeler":
+        category = rng.choice(options.TWO_WHEELER_CATEGORIES)
+    else:
+        category = rng.choice([car for car in options.CAR_TYPES if car != "hybrid"])
+    fuel = rng.choice(options.FUEL_OPTIONS[key])
+    engine_cc = rng.randrange(*options.ENGINE_CC[key][:2])
+    return dict(
+        inputs,
+        emission_factor=emission_factor(key, category, fuel, engine_cc, table=table),
+        vehicle_type=vehicle_type,
+        vehicle_name=f"{category.title()} ({fuel}, {engine_cc}cc)",
+        people_count=rng.randint(1, options.MAX_PEOPLE[key]),
+        fuel_type=fuel,
+    )
+
+
+def show(results):
+    """What the app renders from a session's results; nothing of it is kept."""
+    return (
+        results.rating(),
+        results.factor_set.label,
+        tuple(results.comparison().items()),
+        results.recommendations(),
+    )
+
+
+def measure(sessions, seed=0, bulk_every=DEFAULT_BULK_EVERY):
+    """Bytes allocated per session for ``sessions`` live sessions."""
+    factor_set = active()
+    rng = random.Random(seed)
+    inputs = [commute(rng, factor_set) for _ in range(sessions)]
+    with tempfile.TemporaryDirectory() as directory:
+        upload = os.path.join(directory, "survey.csv")
+        survey(BULK_ROWS, seed).to_csv(upload, index=False)
+        # Warm up imports and caches so they aren't counted
+        warm = Commute()
+        warm.set(**inputs[0])
+        show(warm)
+        del warm
+        score_survey(upload)
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            state = []
+            for i, item in enumerate(inputs):
+                results = Commute()
+                results.set(**item)
+                show(results)
+                bulk_results = score_survey(upload) if bulk_every and i % bulk_every == 0 else None
+                state.append({"calculated": True, "bulk_results": bulk_results, "results": results})
+            gc.collect()
+            allocated = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+    return allocated / sessions, factor_set
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS, help="concurrent sessions (default: %(default)s)")
+    parser.add_argument("--max-kib", type=float, default=DEFAULT_MAX_KIB, help="budget per session in KiB (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random commutes")
+    parser.add_argument(
+        "--bulk-every", type=int, default=DEFAULT_BULK_EVERY,
+        help="one session in this many has scored a survey (default: %(default)s, 0 for none)",
+    )
+    args = parser.parse_args(argv)
+
+    per_session, factor_set = measure(args.sessions, args.seed, args.bulk_every)
+    print(f"{args.sessions} sessions: {per_session / 1024:.2f} KiB per session, {per_session * args.sessions / 2 ** 20:.2f} MiB in all")
+    print(f"Shared factor table: {factor_set.table.nbytes / 1024:.1f} KiB, mapped once per process")
+    if per_session > args.max_kib * 1024:
+        print(f"Over the budget of {args.max_kib:g} KiB per session", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+"""Transport carbon footprint calculations, usable without the Streamlit app."""
+from carbon_footprint.calculator import calculate
+from carbon_footprint.engine import blend, emission_factor, encode, factors, monthly_km, score
+from carbon_footprint.factors import CATEGORIES, EMISSION_FACTORS, FUELS, SIZES, VEHICLES
+
+__all__ = [
+    "CATEGORIES",
+    "EMISSION_FACTORS",
+    "FUELS",
+    "SIZES",
+    "VEHICLES",
+    "blend",
+    "calculate",
+    "emission_factor",
+    "encode",
+    "factors",
+    "monthly_km",
+    "score",
+]
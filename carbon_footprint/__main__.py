@@ -0,0 +1,5 @@
+import sys
+
+from carbon_footprint.cli import main
+
+sys.exit(main())
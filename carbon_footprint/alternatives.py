@@ -0,0 +1,114 @@
+"""Alternative transport options the app compares a commute against.
+
+Every alternative costs a fixed amount per km under a factor table, so
+``comparison_index`` works those out once per table, sorted from the
+cleanest. Scoring a commute is then one multiplication by its monthly km,
+and ``rank`` places the commute among the options compared.
+"""
+import functools
+
+import numpy as np
+
+from carbon_footprint.factors import FUEL_CODES, SIZE_CODES
+from carbon_footprint.factorsets import resolve
+from carbon_footprint.table import BASE, BUS, FOUR_WHEELER, METRO, MIN, TWO_WHEELER, UPLIFT
+
+ALTERNATIVES = (
+    "Bus (Diesel)",
+    "Bus (CNG)",
+    "Bus (Electric)",
+    "Metro",
+    "Car Pooling (4 people)",
+    "Electric Car",
+    "Electric Scooter",
+)
+
+ELECTRIC = FUEL_CODES["electric"]
+
+
+class ComparisonIndex:
+    """The alternatives' per-km factors under one factor table, from the cleanest.
+
+    An alternative's monthly kg CO₂e is ``km * factor * scale``: the
+    products of the app's formulas, taken in the same order, so results are
+    the same to the last bit. Car pooling's division by 4 is folded into its
+    ``scale``, which is exact. ``labels``, ``factor``, ``scale`` and
+    ``per_km`` are sorted by ``per_km``; ``positions`` has the position of
+    each of ``ALTERNATIVES`` in that order.
+    """
+
+    __slots__ = ("labels", "factor", "scale", "per_km", "positions")
+
+    def __init__(self, factors):
+        factor = np.array([factors[label][0] for label in ALTERNATIVES], dtype=np.float64)
+        scale = np.array([factors[label][1] for label in ALTERNATIVES], dtype=np.float64)
+        order = np.argsort(factor * scale, kind="stable")
+        self.labels = tuple(ALTERNATIVES[i] for i in order)
+        self.factor = factor[order]
+        self.scale = scale[order]
+        self.per_km = self.factor * self.scale
+        self.positions = np.argsort(order)
+        for name in ("factor", "scale", "per_km", "positions"):
+            getattr(self, name).setflags(write=False)
+
+    def values(self, km):
+        """Monthly kg CO₂e of every alternative, along a last axis in ``labels`` order."""
+        return np.asarray(km, dtype=np.float64)[..., np.newaxis] * self.factor * self.scale
+
+
+@functools.lru_cache(maxsize=8)
+def _index(table):
+    bus = table.params[BUS, 0, :, BASE]
+    sedan = table.params[FOUR_WHEELER, SIZE_CODES["sedan"]]
+    scooter = table.params[TWO_WHEELER, SIZE_CODES["Scooter"]]
+    return ComparisonIndex({
+        "Bus (Diesel)": (bus[FUEL_CODES["diesel"]], 1.0),
+        "Bus (CNG)": (bus[FUEL_CODES["cng"]], 1.0),
+        "Bus (Electric)": (bus[ELECTRIC], 1.0),
+        "Metro": (table.params[METRO, 0, 0, BASE], 1.0),
+        "Car Pooling (4 people)": (sedan[FUEL_CODES["petrol"], BASE], sedan[FUEL_CODES["petrol"], UPLIFT] / 4),
+        "Electric Car": (sedan[ELECTRIC, BASE], sedan[ELECTRIC, UPLIFT]),
+        "Electric Scooter": (scooter[ELECTRIC, MIN], 1.0),
+    })
+
+
+def comparison_index(table=None):
+    """The ``ComparisonIndex`` of ``table``, built once per table."""
+    return _index(resolve(table))
+
+
+def alternatives(km, vehicle, fuel, people_count, private_only, table=None):
+    """Monthly kg CO₂e of each alternative for arrays of commutes.
+
+    ``private_only`` marks rows whose emissions come from the private vehicle
+    alone; as in the app, car pooling, the electric car and the electric
+    scooter are left out (NaN) when they match what the commuter already does.
+    """
+    index = comparison_index(table)
+    values = index.values(km)
+    own_car = private_only & (vehicle == FOUR_WHEELER)
+    left_out = {
+        "Car Pooling (4 people)": own_car & (people_count >= 3),
+        "Electric Car": own_car & (fuel == ELECTRIC),
+        "Electric Scooter": private_only & (vehicle == TWO_WHEELER) & (fuel == ELECTRIC),
+    }
+    result = {}
+    for label, position in zip(ALTERNATIVES, index.positions.tolist()):
+        column = values[..., position]
+        result[label] = np.where(left_out[label], np.nan, column) if label in left_out else column
+    return result
+
+
+def rank(emissions_kg, values):
+    """Where a commute ranks among the options compared with it.
+
+    ``values`` holds the alternatives' emissions along its last axis, NaN
+    for those left out. Returns ``(n, m)``: the commute is the nth cleanest
+    of m options, itself included; options with the same emissions as the
+    commute don't count as cleaner.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    emissions_kg = np.asarray(emissions_kg, dtype=np.float64)[..., np.newaxis]
+    cleaner = np.count_nonzero(values < emissions_kg, axis=-1)
+    compared = np.count_nonzero(~np.isnan(values), axis=-1)
+    return cleaner + 1, compared + 1
@@ -0,0 +1,212 @@
+"""Single-commute calculation for scripts, workers and the command line.
+
+``calculate`` takes the same inputs as the app's form and returns plain
+Python data, so it can be serialized to JSON directly. Nothing here imports
+Streamlit, Plotly or pandas; use ``carbon_footprint.charts`` for figures.
+"""
+import math
+
+import numpy as np
+
+from carbon_footprint import instrument, options
+from carbon_footprint.alternatives import alternatives
+from carbon_footprint.engine import PUBLIC, monthly_km, private_only, score, split_commute
+from carbon_footprint.factorsets import active
+from carbon_footprint.recommend import evaluate, messages, profile_rule_columns, rating
+from carbon_footprint.validate import LABEL_COLUMNS, encode_inputs
+
+
+def _title(car_type):
+    return car_type.replace('_', ' ').title()
+
+
+def _private_name(vehicle_type, vehicle_category, fuel_type, engine_cc):
+    if vehicle_type == "Two Wheeler":
+        return f"{vehicle_category} ({fuel_type}, {engine_cc:g}cc)"
+    if vehicle_type == "Three Wheeler":
+        return f"Three Wheeler ({fuel_type}, {engine_cc:g}cc)"
+    return f"{_title(vehicle_category)} ({fuel_type}, {engine_cc:g}cc)"
+
+
+def _public_name(public_mode, taxi_type, public_fuel_type):
+    if public_mode == "Taxi":
+        return f"Taxi - {_title(taxi_type)} ({public_fuel_type})"
+    if public_mode == "Bus":
+        return f"Bus ({public_fuel_type})"
+    return "Metro"
+
+
+# Defaults shown by the app's widgets. None means the default depends on
+# another input and is filled in by with_defaults.
+DEFAULTS = {
+    "distance": 10.0,
+    "days_per_week": 5,
+    "weeks_per_month": 4,
+    "transport_category": "Private Transport",
+    "vehicle_type": "Two Wheeler",
+    "vehicle_category": None,
+    "fuel_type": None,
+    "engine_cc": None,
+    "people_count": 1,
+    "public_mode": "Taxi",
+    "taxi_type": None,
+    "public_fuel_type": None,
+    "public_people_count": 1,
+    "private_trips": 2,
+    "total_trips": 4,
+}
+
+
+def with_defaults(inputs):
+    """Every input in ``DEFAULTS``, filling in those left out or None.
+
+    Raises ValueError for names ``calculate`` doesn't take and for labels
+    that aren't text.
+    """
+    for name, value in inputs.items():
+        if name not in DEFAULTS:
+            raise ValueError(f"Unknown input {name!r}")
+        if name in LABEL_COLUMNS and value is not None and not isinstance(value, str):
+            raise ValueError(f"{name} must be text, not {type(value).__name__}")
+    row = dict(DEFAULTS)
+    row.update((name, value) for name, value in inputs.items() if value is not None)
+
+    vehicle_key = options.VEHICLE_TYPES.get(row["vehicle_type"])
+    if row["vehicle_category"] is None:
+        row["vehicle_category"] = options.CAR_TYPES[0] if vehicle_key == "four_wheeler" else options.TWO_WHEELER_CATEGORIES[0]
+    if row["fuel_type"] is None and vehicle_key is not None:
+        row["fuel_type"] = options.FUEL_OPTIONS[vehicle_key][0]
+    if row["engine_cc"] is None and vehicle_key is not None:
+        row["engine_cc"] = options.ENGINE_CC[vehicle_key][2]
+    if row["taxi_type"] is None:
+        row["taxi_type"] = options.TAXI_TYPES[0]
+    if row["public_fuel_type"] is None:
+        row["public_fuel_type"] = options.FUEL_OPTIONS["bus" if row["public_mode"] == "Bus" else "taxi"][0]
+    return row
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _columns(rows):
+    """Input columns for ``encode_inputs``, with labels factorized as they're read."""
+    columns = {}
+    for name in DEFAULTS:
+        if name in LABEL_COLUMNS:
+            uniques = {}
+            inverse = np.fromiter(
+                (uniques.setdefault("" if row[name] is None else str(row[name]).strip(), len(uniques)) for row in rows),
+                dtype=np.intp,
+                count=len(rows),
+            )
+            columns[name] = list(uniques), inverse
+        else:
+            columns[name] = np.fromiter((_number(row[name]) for row in rows), dtype=np.float64, count=len(rows))
+    return columns
+
+
+def _encode(inputs):
+    rows = []
+    errors = []
+    for item in inputs:
+        try:
+            rows.append(with_defaults(item))
+            errors.append("")
+        except (TypeError, ValueError) as exc:
+            rows.append(with_defaults({}))
+            errors.append(str(exc))
+    profiles, rejected = encode_inputs(_columns(rows), len(rows))
+    return rows, profiles, [error or rejected[i] for i, error in enumerate(errors)]
+
+
+def encode_commutes(inputs):
+    """Engine profiles for a list of ``calculate`` argument dicts.
+
+    Returns ``(profiles, errors)`` with an error message, or "", per item.
+    """
+    _, profiles, errors = _encode(inputs)
+    return profiles, errors
+
+
+def calculate_many(inputs, factor_set=None):
+    """Calculate a list of commutes in one vectorized pass.
+
+    Each item is a dict of ``calculate`` arguments. Returns one result per
+    item, in order; items the app would not accept give ``{"error": message}``
+    instead of raising. ``factor_set`` defaults to the active one.
+    """
+    factor_set = factor_set or active()
+    table = factor_set.table
+    with instrument.stage("validate"):
+        rows, profiles, errors = _encode(inputs)
+    with instrument.stage("score"):
+        km = monthly_km(profiles["distance"], profiles["days_per_week"], profiles["weeks_per_month"])
+        totals = score(profiles, table)
+    category = profiles["category"]
+    split = split_commute(category, profiles["private_ratio"])
+    private = private_only(category, profiles["private_ratio"])
+    with instrument.stage("alternatives"):
+        options_emissions = alternatives(km, profiles["vehicle"], profiles["fuel"], profiles["people_count"], private, table)
+    with instrument.stage("recommendations"):
+        advice = evaluate(profile_rule_columns(profiles, totals, km, table))
+
+    results = []
+    for i, row in enumerate(rows):
+        if errors[i]:
+            results.append({"error": errors[i]})
+            continue
+        total_monthly_km = float(km[i])
+        total_emissions = float(totals[i])
+
+        # Describe what produced the emissions the way the app labels it
+        if category[i] == PUBLIC:
+            vehicle_type = "Public Transport"
+            vehicle_name = _public_name(row["public_mode"], row["taxi_type"], row["public_fuel_type"])
+            if profiles["public_people"][i] > 1:
+                vehicle_name += f" with {profiles['public_people'][i]} people"
+        elif split[i]:
+            vehicle_type = "Combined Transport"
+            private_ratio = float(profiles["private_ratio"][i])
+            vehicle_name = (
+                f"{_private_name(row['vehicle_type'], row['vehicle_category'], row['fuel_type'], profiles['engine_cc'][i])} ({private_ratio*100:.0f}%) & "
+                f"{_public_name(row['public_mode'], row['taxi_type'], row['public_fuel_type'])} ({(1 - private_ratio)*100:.0f}%)"
+            )
+        else:
+            vehicle_type = row["vehicle_type"]
+            vehicle_name = _private_name(row["vehicle_type"], row["vehicle_category"], row["fuel_type"], profiles["engine_cc"][i])
+            if profiles["people_count"][i] > 1:
+                vehicle_name += f" with {profiles['people_count'][i]} people"
+
+        comparison = {vehicle_name: total_emissions}
+        for label, values in options_emissions.items():
+            if not math.isnan(values[i]):
+                comparison[label] = float(values[i])
+
+        results.append({
+            "monthly_km": total_monthly_km,
+            "emissions_kg": total_emissions,
+            "rating": rating(total_emissions),
+            "vehicle_type": vehicle_type,
+            "vehicle_name": vehicle_name,
+            "comparison": comparison,
+            "recommendations": messages(advice, i),
+            "factor_version": factor_set.label,
+        })
+    return results
+
+
+def calculate(**inputs):
+    """Monthly footprint, comparison options and recommendations for one commute.
+
+    Keyword arguments match the app's inputs and the bulk survey columns (see
+    ``DEFAULTS``); those left out take the default the app's widget would
+    show. Raises ValueError for inputs the app would not accept.
+    """
+    result = calculate_many([inputs])[0]
+    if "error" in result:
+        raise ValueError(result["error"])
+    return result
@@ -0,0 +1,77 @@
+"""Plotly figures for the results view.
+
+Plotly and pandas are imported when a figure is first built, so importing
+this module (or the rest of the package) stays cheap for headless use.
+"""
+from carbon_footprint import instrument
+
+AVERAGE_EMISSIONS = 200  # Example average emissions for commuting per person per month
+
+
+def emissions_color(total_kg):
+    if total_kg > 100:
+        return "red"
+    if total_kg > 50:
+        return "orange"
+    return "green"
+
+
+def gauge(total_kg, average=AVERAGE_EMISSIONS):
+    """Gauge of monthly emissions against the average commuter."""
+    import plotly.graph_objects as go
+
+    return go.Figure(go.Indicator(
+        mode = "gauge+number",
+        value = total_kg,
+        domain = {'x': [0, 1], 'y': [0, 1]},
+        title = {'text': "Monthly CO₂ Emissions (kg)"},
+        gauge = {
+            'axis': {'range': [None, 300], 'tickwidth': 1},
+            'bar': {'color': emissions_color(total_kg)},
+            'steps': [
+                {'range': [0, 50], 'color': "lightgreen"},
+                {'range': [50, 100], 'color': "yellow"},
+                {'range': [100, 300], 'color': "salmon"}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': average
+            }
+        }
+    ))
+
+
+def comparison(emissions_data):
+    """Horizontal bar chart of monthly emissions per transport option."""
+    import pandas as pd
+    import plotly.express as px
+
+    with instrument.stage("comparison_dataframe"):
+        # Create dataframe for plotting
+        df = pd.DataFrame({
+            'Transport Mode': list(emissions_data.keys()),
+            'Monthly CO₂ Emissions (kg)': list(emissions_data.values())
+        })
+
+        # Sort by emissions for better visualization
+        df = df.sort_values('Monthly CO₂ Emissions (kg)')
+
+    fig = px.bar(
+        df,
+        y='Transport Mode',
+        x='Monthly CO₂ Emissions (kg)',
+        orientation='h',
+        color='Monthly CO₂ Emissions (kg)',
+        color_continuous_scale='RdYlGn_r'
+    )
+    fig.update_layout(height=400, width=800)
+    return fig
+
+
+def save(fig, path):
+    """Write a figure as HTML, or as a static image for other extensions (needs kaleido)."""
+    if str(path).lower().endswith((".html", ".htm")):
+        fig.write_html(path)
+    else:
+        fig.write_image(path)
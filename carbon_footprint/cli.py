@@ -0,0 +1,333 @@
+"""Command line interface: ``python -m carbon_footprint``."""
+import argparse
+import json
+import os
+import sys
+
+from carbon_footprint import options
+from carbon_footprint.factors import VEHICLES
+from carbon_footprint.history import parse_month
+from carbon_footprint.validate import SURVEY_COLUMNS
+
+# calc options, as (survey column, type, help)
+CALC_ARGUMENTS = (
+    ("distance", float, "daily one-way distance in km (default: 10)"),
+    ("days_per_week", int, "commuting days per week (default: 5)"),
+    ("weeks_per_month", int, "commuting weeks per month (default: 4)"),
+    ("transport_category", str, "one of: " + ", ".join(options.TRANSPORT_CATEGORIES)),
+    ("vehicle_type", str, "private vehicle, one of: " + ", ".join(options.VEHICLE_TYPES)),
+    ("vehicle_category", str, "Scooter/Motorcycle, or the car type for four wheelers"),
+    ("fuel_type", str, "private vehicle fuel"),
+    ("engine_cc", int, "private vehicle engine size"),
+    ("people_count", int, "people sharing the private vehicle"),
+    ("public_mode", str, "one of: " + ", ".join(options.PUBLIC_MODES)),
+    ("taxi_type", str, "one of: " + ", ".join(options.TAXI_TYPES)),
+    ("public_fuel_type", str, "taxi or bus fuel"),
+    ("public_people_count", int, "people sharing the taxi"),
+    ("private_trips", int, "daily trips by private transport, for combined commutes"),
+    ("total_trips", int, "total daily trips, for combined commutes"),
+)
+
+
+def calc(args):
+    from carbon_footprint.calculator import calculate
+
+    inputs = {name: getattr(args, name) for name, _, _ in CALC_ARGUMENTS if getattr(args, name) is not None}
+    try:
+        result = calculate(**inputs)
+    except ValueError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 2
+    json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+
+    # Plotting is only loaded when a chart was asked for
+    if args.gauge or args.comparison:
+        from carbon_footprint import charts
+
+        if args.gauge:
+            charts.save(charts.gauge(result["emissions_kg"]), args.gauge)
+        if args.comparison:
+            charts.save(charts.comparison(result["comparison"]), args.comparison)
+    return 0
+
+
+def optimize(args):
+    from carbon_footprint.scenarios import optimize
+
+    inputs = {name: getattr(args, name) for name, _, _ in CALC_ARGUMENTS if getattr(args, name) is not None}
+    try:
+        result = optimize(
+            inputs,
+            max_public_legs=args.max_public_legs,
+            no_new_vehicle=args.no_new_vehicle,
+            max_rideshare=args.max_rideshare,
+            exclude=args.exclude,
+        )
+    except ValueError as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 2
+    json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    return 0
+
+
+def batch(args):
+    from carbon_footprint.ingest import process_file
+
+    kwargs = {"chunksize": args.chunksize} if args.chunksize else {}
+    keep = list(args.keep)
+    store = None
+    if args.history:
+        from carbon_footprint.history import HistoryStore
+
+        if not args.user_column:
+            print("error: --history needs --user-column", file=sys.stderr)
+            return 2
+        if args.user_column not in keep:
+            keep.append(args.user_column)
+        store = HistoryStore(args.history)
+        kwargs["on_chunk"] = lambda result: store.append(
+            result[args.user_column].to_numpy(), result["emissions_kg"].to_numpy(), result["monthly_km"].to_numpy(), args.month
+        )
+    resolver = None
+    if args.resolve_distances or args.routes or args.distance_cache or args.circuity is not None:
+        from carbon_footprint.distances import DEFAULT_CIRCUITY, DistanceResolver
+
+        resolver = kwargs["distances"] = DistanceResolver(
+            args.routes,
+            circuity=DEFAULT_CIRCUITY if args.circuity is None else args.circuity,
+            cache=args.distance_cache,
+        )
+    try:
+        summary = process_file(
+            args.input,
+            args.output,
+            keep=keep,
+            input_format=args.input_format,
+            output_format=args.output_format,
+            draws=args.draws,
+            seed=args.seed,
+            workers=args.workers,
+            **kwargs,
+        )
+    finally:
+        if store is not None:
+            store.close()
+        if resolver is not None:
+            resolver.close()
+    print(f"Scored {summary['rows']} rows ({summary['rejected']} rejected) into {args.output}", file=sys.stderr)
+    if "fleet" in summary:
+        bands = ", ".join(f"{name[:-3].upper()} {value:.1f}" for name, value in summary["fleet"].items())
+        print(f"Total monthly kg CO2e: {bands}", file=sys.stderr)
+    return 0
+
+
+def fleet(args):
+    from carbon_footprint.fleet import save, summarize_file
+
+    summary = summarize_file(
+        args.input,
+        by=args.by,
+        id_column=args.id_column,
+        top=args.top,
+        chunksize=args.chunksize,
+        input_format=args.input_format,
+        workers=args.workers,
+    )
+    if args.output:
+        save(summary, args.output)
+    else:
+        json.dump(summary.to_dict(), sys.stdout, indent=2, ensure_ascii=False)
+        print()
+    return 0
+
+
+def trips(args):
+    from carbon_footprint.trips import process_trips
+
+    summary = process_trips(
+        args.input,
+        args.output,
+        trip_column=args.trip_column,
+        chunksize=args.chunksize,
+        input_format=args.input_format,
+        output_format=args.output_format,
+    )
+    print(f"Scored {summary['trips']} trips of {summary['legs']} legs ({summary['rejected']} rejected) into {args.output}", file=sys.stderr)
+    return 0
+
+
+def reports(args):
+    from carbon_footprint.reports import build_reports
+
+    summary = build_reports(
+        args.input,
+        args.output,
+        id_column=args.id_column,
+        formats=args.format or ("html", "csv"),
+        images=args.images,
+        chunksize=args.chunksize,
+        input_format=args.input_format,
+        workers=args.workers,
+        restart=args.restart,
+    )
+    print(f"Wrote {summary['reports']} reports for {summary['rows']} rows ({summary['rejected']} rejected) into {args.output}", file=sys.stderr)
+    return 0
+
+
+def history(args):
+    from carbon_footprint.history import HistoryStore
+
+    with HistoryStore(args.database) as store:
+        result = {
+            "trend": store.trend(args.user, args.months),
+            "projection": store.projection(args.user),
+        }
+    json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    return 0
+
+
+def serve(args):
+    from carbon_footprint.service import run
+
+    print(f"Serving on http://{args.host}:{args.port}", file=sys.stderr)
+    run(args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m carbon_footprint", description="Transport carbon footprint calculator")
+    parser.add_argument("--factors", metavar="PATH", help="emission factor set file (default: $CARBON_FACTORS, else the bundled set)")
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="time each stage of batch jobs and log them as JSON lines (to $CARBON_PROFILE_LOG, else stderr)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_calc = commands.add_parser(
+        "calc",
+        help="calculate the footprint of one commute",
+        description="Calculate the monthly footprint of one commute and print it as JSON. Options left out take the app's defaults.",
+    )
+    for name, type_, help_ in CALC_ARGUMENTS:
+        parser_calc.add_argument("--" + name.replace("_", "-"), dest=name, type=type_, help=help_)
+    parser_calc.add_argument("--gauge", metavar="PATH", help="also save the emissions gauge (.html, or an image format with kaleido)")
+    parser_calc.add_argument("--comparison", metavar="PATH", help="also save the comparison bar chart")
+    parser_calc.set_defaults(handler=calc)
+
+    parser_optimize = commands.add_parser(
+        "optimize",
+        help="find the lowest-emission alternative to one commute",
+        description="Search every vehicle, fuel, engine size, rideshare and trip split the app offers for the lowest-emission way to make the same commute.",
+    )
+    for name, type_, help_ in CALC_ARGUMENTS:
+        parser_optimize.add_argument("--" + name.replace("_", "-"), dest=name, type=type_, help=help_)
+    parser_optimize.add_argument("--max-public-legs", type=int, choices=[0, 1], help="0 to stay off public transport")
+    parser_optimize.add_argument("--no-new-vehicle", action="store_true", help="only use the current private vehicle, if any")
+    parser_optimize.add_argument("--max-rideshare", type=int, metavar="PEOPLE", help="most people sharing a vehicle")
+    parser_optimize.add_argument("--exclude", action="append", default=[], choices=VEHICLES, help="leave out a vehicle class such as metro; repeatable")
+    parser_optimize.set_defaults(handler=optimize)
+
+    parser_batch = commands.add_parser(
+        "batch",
+        help="score a CSV or Parquet commute survey",
+        description="Score a commute survey chunk by chunk. Survey columns: " + ", ".join(SURVEY_COLUMNS),
+    )
+    parser_batch.add_argument("input", help="survey file (.csv or .parquet)")
+    parser_batch.add_argument("output", help="results file (.csv or .parquet)")
+    parser_batch.add_argument("--chunksize", type=int, help="rows per chunk (default: 100000)")
+    parser_batch.add_argument("--keep", action="append", default=[], metavar="COLUMN", help="copy a survey column such as an employee id into the results; repeatable")
+    parser_batch.add_argument("--input-format", choices=["csv", "parquet"], help="override the input format")
+    parser_batch.add_argument("--output-format", choices=["csv", "parquet"], help="override the output format")
+    parser_batch.add_argument("--draws", type=int, default=0, help="Monte Carlo draws per row for P5/P50/P95 columns and fleet totals (default: off)")
+    parser_batch.add_argument("--seed", type=int, default=0, help="random seed for --draws (default: %(default)s)")
+    parser_batch.add_argument("--workers", type=int, default=1, help="processes for --draws, 0 for all cores (default: %(default)s)")
+    parser_batch.add_argument("--history", metavar="DATABASE", help="also record each accepted row's footprint in this history database")
+    parser_batch.add_argument("--user-column", metavar="COLUMN", help="survey column identifying the user, for --history")
+    parser_batch.add_argument("--month", metavar="YYYY-MM", type=parse_month, help="month to record the footprints under (default: this month)")
+    parser_batch.add_argument("--resolve-distances", action="store_true", help="score rows with home_lat, home_lon, work_lat and work_lon on the distance between them")
+    parser_batch.add_argument("--circuity", type=float, metavar="FACTOR", help="road km per straight-line km for resolved distances (default: 1.3)")
+    parser_batch.add_argument("--routes", metavar="GRAPH", help="route resolved distances through this road graph file of edges (.csv or .parquet)")
+    parser_batch.add_argument("--distance-cache", metavar="DATABASE", help="keep resolved distances in this cache database across runs")
+    parser_batch.set_defaults(handler=batch)
+
+    parser_fleet = commands.add_parser(
+        "fleet",
+        help="summarize a whole fleet's emissions",
+        description="Stream a survey (or a batch results file) and print totals, percentiles, per-group rollups and the top emitters as JSON.",
+    )
+    parser_fleet.add_argument("input", help="survey or results file (.csv or .parquet)")
+    parser_fleet.add_argument("--by", action="append", default=[], metavar="COLUMN", help="group on a column such as site, department or vehicle_type; repeatable")
+    parser_fleet.add_argument("--id-column", metavar="COLUMN", help="column identifying commuters in the top emitters list (default: row number)")
+    parser_fleet.add_argument("--top", type=int, default=10, help="how many top emitters to list (default: %(default)s)")
+    parser_fleet.add_argument("--chunksize", type=int, help="rows per chunk (default: 100000)")
+    parser_fleet.add_argument("--input-format", choices=["csv", "parquet"], help="override the input format")
+    parser_fleet.add_argument("--workers", type=int, default=1, help="processes summarizing chunks, 0 for all cores (default: %(default)s)")
+    parser_fleet.add_argument("--output", metavar="PATH", help="write the summary to this JSON file instead, e.g. for the app's company comparison")
+    parser_fleet.set_defaults(handler=fleet)
+
+    parser_trips = commands.add_parser(
+        "trips",
+        help="score multi-leg trips from a legs file",
+        description="Score trips made of any number of legs. The input has one row per leg with mode, size, fuel, engine_cc, km and people columns, and the legs of each trip on consecutive rows.",
+    )
+    parser_trips.add_argument("input", help="legs file (.csv or .parquet)")
+    parser_trips.add_argument("output", help="results file with one row per trip (.csv or .parquet)")
+    parser_trips.add_argument("--trip-column", default="trip_id", metavar="COLUMN", help="column identifying each leg's trip (default: %(default)s)")
+    parser_trips.add_argument("--chunksize", type=int, help="legs per chunk (default: 100000)")
+    parser_trips.add_argument("--input-format", choices=["csv", "parquet"], help="override the input format")
+    parser_trips.add_argument("--output-format", choices=["csv", "parquet"], help="override the output format")
+    parser_trips.set_defaults(handler=trips)
+
+    parser_reports = commands.add_parser(
+        "reports",
+        help="write a report per employee into a zip archive",
+        description="Write an HTML and CSV report for every row of a survey into a zip archive, with a summary.csv of all rows. An interrupted run resumes where it stopped.",
+    )
+    parser_reports.add_argument("input", help="survey file (.csv or .parquet)")
+    parser_reports.add_argument("output", help="zip archive to write")
+    parser_reports.add_argument("--id-column", default="employee_id", metavar="COLUMN", help="column naming each employee's folder (default: %(default)s, else the row number)")
+    parser_reports.add_argument("--format", action="append", choices=["html", "csv"], help="report formats; repeatable (default: both)")
+    parser_reports.add_argument("--images", choices=["svg", "png", "none"], default="svg", help="chart images: inline SVG, PNG files (needs kaleido) or none (default: %(default)s)")
+    parser_reports.add_argument("--chunksize", type=int, default=1000, help="rows per chunk (default: %(default)s)")
+    parser_reports.add_argument("--input-format", choices=["csv", "parquet"], help="override the input format")
+    parser_reports.add_argument("--workers", type=int, default=1, help="processes rendering chunks, 0 for all cores (default: %(default)s)")
+    parser_reports.add_argument("--restart", action="store_true", help="start over instead of resuming an unfinished run")
+    parser_reports.set_defaults(handler=reports)
+
+    parser_history = commands.add_parser(
+        "history",
+        help="show recorded footprints and the yearly projection",
+        description="Print the monthly trend and yearly projection of a history database as JSON, for one user or the whole fleet.",
+    )
+    parser_history.add_argument("database", help="history database file")
+    parser_history.add_argument("--user", help="user to report on (default: the whole fleet)")
+    parser_history.add_argument("--months", type=int, help="only the most recent months")
+    parser_history.set_defaults(handler=history)
+
+    parser_serve = commands.add_parser(
+        "serve",
+        help="run the local JSON HTTP scoring service",
+        description="Serve POST /calculate, POST /calculate/batch and GET /health. Requests arriving together are scored in one batch.",
+    )
+    parser_serve.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    parser_serve.add_argument("--port", type=int, default=8000, help="port to listen on (default: %(default)s)")
+    parser_serve.add_argument("--max-batch-size", type=int, default=256, help="most requests scored together (default: %(default)s)")
+    parser_serve.add_argument("--max-wait-ms", type=float, default=2.0, help="longest a request waits for others to join its batch (default: %(default)s)")
+    parser_serve.set_defaults(handler=serve)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.factors:
+        from carbon_footprint.factorsets import use
+
+        use(args.factors)
+    if args.profile:
+        from carbon_footprint import instrument
+
+        instrument.enable(log=os.environ.get("CARBON_PROFILE_LOG") or "-")
+    return args.handler(args)
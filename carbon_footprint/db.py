@@ -0,0 +1,85 @@
+"""Pooled connections to local SQLite databases.
+
+Connections run in WAL mode, so reads carry on while another connection
+writes, and they are shared between threads. Streamlit runs each session in
+its own thread, so a pool per database serves all of them without opening a
+connection per rerun.
+"""
+import contextlib
+import queue
+import sqlite3
+import threading
+
+DEFAULT_POOL_SIZE = 4
+BUSY_TIMEOUT = 30.0  # seconds
+
+
+class ConnectionPool:
+    """Up to ``size`` connections to the database at ``path``.
+
+    ``schema`` is a SQL script run once when the pool opens. Connections are
+    in autocommit mode; use ``transaction`` to group writes.
+    """
+
+    def __init__(self, path, schema=None, size=DEFAULT_POOL_SIZE, timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.opened = 0
+        with self.connection() as db:
+            if schema:
+                db.executescript(schema)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection, waiting for one if all are in use."""
+        try:
+            db = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                grow = self.opened < self.size
+                if grow:
+                    self.opened += 1
+            if not grow:
+                db = self.idle.get(timeout=self.timeout)
+            else:
+                try:
+                    db = self._open()
+                except BaseException:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            self.idle.put(db)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Borrow a connection inside a write transaction, committed on success."""
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def close(self):
+        """Close the idle connections."""
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,386 @@
+"""Commute distances from home and work coordinates.
+
+``DistanceResolver`` turns arrays of home and work latitude and longitude
+into one-way road km, for surveys that have coordinates instead of a typed
+distance. By default that is the great-circle (haversine) distance times a
+road circuity factor; with a ``RoutingGraph`` loaded from a local file, it
+is the shortest path through the graph. Nothing needs a network connection.
+
+Coordinates are rounded to ``precision`` decimals first, and every distinct
+pair is resolved once per batch. With a ``cache`` path, results are also
+kept in an SQLite database keyed by the rounded pair, so a pair is resolved
+once across the fleet and across runs; beyond ``max_entries`` pairs, the
+least recently used are evicted.
+
+``fill_distances`` puts resolved distances into a survey chunk, which is how
+``ingest.process_file`` uses a resolver.
+"""
+import hashlib
+import heapq
+import math
+import os
+import time
+
+import numpy as np
+
+from carbon_footprint import instrument
+from carbon_footprint.db import ConnectionPool
+
+EARTH_RADIUS_KM = 6371.0088
+# Road km per straight-line km; see ``circuity`` for distance bands
+DEFAULT_CIRCUITY = 1.3
+# 4 decimals of a degree is about 11 m
+DEFAULT_PRECISION = 4
+DEFAULT_MAX_ENTRIES = 1_000_000
+COORDINATE_COLUMNS = ("home_lat", "home_lon", "work_lat", "work_lon")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS distances (
+    method TEXT NOT NULL,
+    home_lat INTEGER NOT NULL,
+    home_lon INTEGER NOT NULL,
+    work_lat INTEGER NOT NULL,
+    work_lon INTEGER NOT NULL,
+    km REAL,
+    used INTEGER NOT NULL,
+    PRIMARY KEY (method, home_lat, home_lon, work_lat, work_lon)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS distances_used ON distances (used);
+"""
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle km between arrays of points in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def circuity(straight_km, factors=DEFAULT_CIRCUITY):
+    """Road km for straight-line km.
+
+    ``factors`` is one factor, or ``(up_to_km, factor)`` bands in increasing
+    order, the last of which covers every longer distance; short trips
+    usually wind more than long ones.
+    """
+    straight_km = np.asarray(straight_km, dtype=np.float64)
+    if np.ndim(factors) == 0:
+        return straight_km * factors
+    limits = np.array([limit for limit, _ in factors[:-1]], dtype=np.float64)
+    values = np.array([factor for _, factor in factors], dtype=np.float64)
+    return straight_km * values[np.searchsorted(limits, straight_km)]
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _projected(lat, lon, lat0):
+    """Equirectangular km around latitude ``lat0``, for finding nearby nodes."""
+    return np.stack([
+        EARTH_RADIUS_KM * np.radians(lon) * math.cos(math.radians(lat0)),
+        EARTH_RADIUS_KM * np.radians(lat),
+    ], axis=-1)
+
+
+class RoutingGraph:
+    """A road graph for shortest-path commute distances.
+
+    ``load`` reads it from a CSV or Parquet file of edges with ``from_lat``,
+    ``from_lon``, ``to_lat``, ``to_lon`` and optionally ``km`` (the
+    straight line between the ends if left out) and ``oneway`` (edges go
+    both ways unless it is true). Edges sharing an end's exact coordinates
+    meet at one node. Commutes start and end at the nodes nearest their
+    home and work, plus the straight-line legs to them times the circuity.
+    """
+
+    def __init__(self, from_lat, from_lon, to_lat, to_lon, km=None, oneway=None, digest=None):
+        ends = np.concatenate([
+            np.stack([from_lat, from_lon], axis=-1),
+            np.stack([to_lat, to_lon], axis=-1),
+        ]).astype(np.float64)
+        self.nodes, inverse = np.unique(ends, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        edges = len(ends) // 2
+        source, target = inverse[:edges], inverse[edges:]
+        if km is None:
+            km = haversine(from_lat, from_lon, to_lat, to_lon)
+        km = np.asarray(km, dtype=np.float64)
+        if np.isnan(km).any() or (km < 0).any():
+            raise ValueError("Edge km must be non-negative numbers")
+        two_way = np.ones(edges, dtype=bool) if oneway is None else ~np.asarray(oneway, dtype=bool)
+        # Commutes are routed from work back to each home, so the graph is
+        # stored with its edges reversed
+        starts = np.concatenate([target, source[two_way]])
+        ends = np.concatenate([source, target[two_way]])
+        weights = np.concatenate([km, km[two_way]])
+        order = np.argsort(starts, kind="stable")
+        self._indptr = np.searchsorted(starts[order], np.arange(len(self.nodes) + 1)).tolist()
+        self._indices = ends[order].tolist()
+        self._weights = weights[order].tolist()
+        self.digest = digest
+
+        self._lat0 = float(self.nodes[:, 0].mean()) if len(self.nodes) else 0.0
+        xy = _projected(self.nodes[:, 0], self.nodes[:, 1], self._lat0)
+        extent = np.ptp(xy, axis=0) if len(xy) else np.zeros(2)
+        # About four nodes per grid cell, and no smaller than 50 m
+        self._cell = max(math.sqrt(max(extent[0] * extent[1], 1e-9) * 4 / max(len(xy), 1)), 0.05)
+        self._origin = xy.min(axis=0) if len(xy) else np.zeros(2)
+        cells = self._cells(xy)
+        self._order = np.argsort(cells, kind="stable")
+        self._sorted_cells = cells[self._order]
+        self._xy = xy
+
+    @classmethod
+    def load(cls, path, format=None):
+        import pandas as pd
+
+        from carbon_footprint.ingest import _format, _parquet
+
+        if _format(path, format) == "parquet":
+            _parquet()
+            edges = pd.read_parquet(path)
+        else:
+            edges = pd.read_csv(path)
+        missing = [name for name in ("from_lat", "from_lon", "to_lat", "to_lon") if name not in edges]
+        if missing:
+            raise ValueError(f"Routing graph has no column {missing[0]!r}")
+        oneway = None
+        if "oneway" in edges:
+            oneway = edges["oneway"].map(lambda value: str(value).strip().lower() in ("1", "true", "yes")).to_numpy()
+        return cls(
+            edges["from_lat"].to_numpy(),
+            edges["from_lon"].to_numpy(),
+            edges["to_lat"].to_numpy(),
+            edges["to_lon"].to_numpy(),
+            edges["km"].to_numpy() if "km" in edges else None,
+            oneway,
+            digest=_file_digest(path),
+        )
+
+    def _cells(self, xy):
+        ix = np.floor((xy[:, 0] - self._origin[0]) / self._cell).astype(np.int64)
+        iy = np.floor((xy[:, 1] - self._origin[1]) / self._cell).astype(np.int64)
+        return ix * (1 << 32) + iy
+
+    def nearest(self, lat, lon):
+        """Index and straight-line km of the node nearest each point."""
+        xy = _projected(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), self._lat0)
+        best = np.full(len(xy), -1, dtype=np.intp)
+        best_d2 = np.full(len(xy), np.inf)
+        # Candidates from the point's grid cell and the eight around it
+        cells = self._cells(xy)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbour = cells + dx * (1 << 32) + dy
+                lo = np.searchsorted(self._sorted_cells, neighbour, "left")
+                hi = np.searchsorted(self._sorted_cells, neighbour, "right")
+                counts = hi - lo
+                if not counts.any():
+                    continue
+                points = np.repeat(np.arange(len(xy)), counts)
+                offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                candidates = self._order[np.repeat(lo, counts) + offsets]
+                d2 = ((self._xy[candidates] - xy[points]) ** 2).sum(axis=1)
+                first = np.lexsort((d2, points))
+                points, candidates, d2 = points[first], candidates[first], d2[first]
+                keep = np.r_[True, points[1:] != points[:-1]]
+                points, candidates, d2 = points[keep], candidates[keep], d2[keep]
+                closer = d2 < best_d2[points]
+                best[points[closer]] = candidates[closer]
+                best_d2[points[closer]] = d2[closer]
+        # A node found further away than one cell might not be the nearest
+        unsure = np.flatnonzero(best_d2 > self._cell ** 2)
+        block = max(1, 4_000_000 // max(len(self._xy), 1))
+        for start in range(0, len(unsure), block):
+            rows = unsure[start:start + block]
+            d2 = ((xy[rows, np.newaxis, :] - self._xy[np.newaxis]) ** 2).sum(axis=2)
+            best[rows] = d2.argmin(axis=1)
+        km = haversine(lat, lon, self.nodes[best, 0], self.nodes[best, 1])
+        return best, km
+
+    def _from(self, source, targets):
+        """Path km from node ``source`` back to each of ``targets``."""
+        indptr, indices, weights = self._indptr, self._indices, self._weights
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        remaining = set(targets)
+        found = {}
+        while heap and remaining:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = d
+            for k in range(indptr[node], indptr[node + 1]):
+                nxt = indices[k]
+                nd = d + weights[k]
+                if nd < dist.get(nxt, math.inf):
+                    dist[nxt] = nd
+                    heapq.heappush(heap, (nd, nxt))
+        return found
+
+    def route(self, home_lat, home_lon, work_lat, work_lon, factors=DEFAULT_CIRCUITY):
+        """One-way road km for arrays of commutes; NaN where home can't reach work."""
+        home, home_km = self.nearest(home_lat, home_lon)
+        work, work_km = self.nearest(work_lat, work_lon)
+        path = np.full(len(home), np.nan)
+        # Workplaces are far fewer than homes, so search once from each
+        for node in np.unique(work).tolist():
+            rows = np.flatnonzero(work == node)
+            found = self._from(node, np.unique(home[rows]).tolist())
+            path[rows] = [found.get(h, np.nan) for h in home[rows].tolist()]
+        return circuity(home_km, factors) + path + circuity(work_km, factors)
+
+
+class RouteCache:
+    """Resolved distances in the SQLite database at ``path``, least recently used evicted first."""
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.pool = ConnectionPool(path, SCHEMA, size=1)
+        self.max_entries = max_entries
+
+    def close(self):
+        self.pool.close()
+
+    def lookup(self, method, keys):
+        """km for ``keys`` (rows of rounded coordinates) and which were cached."""
+        km = np.full(len(keys), np.nan)
+        found = np.zeros(len(keys), dtype=bool)
+        if not len(keys):
+            return km, found
+        # A plain read: the temp table is private to the connection, so only
+        # marking the hits as used needs the database's write lock
+        with self.pool.connection() as db:
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (i INTEGER, a INTEGER, b INTEGER, c INTEGER, d INTEGER)")
+            db.execute("DELETE FROM wanted")
+            db.executemany("INSERT INTO wanted VALUES (?, ?, ?, ?, ?)", ((i, *row) for i, row in enumerate(keys.tolist())))
+            rows = db.execute(
+                """SELECT w.i, d.km FROM wanted w JOIN distances d
+                ON d.method = ? AND d.home_lat = w.a AND d.home_lon = w.b AND d.work_lat = w.c AND d.work_lon = w.d""",
+                (method,),
+            ).fetchall()
+            db.execute("DELETE FROM wanted")
+        if rows:
+            used = time.time_ns()
+            hits = keys[[i for i, _ in rows]].tolist()
+            with self.pool.transaction() as db:
+                db.executemany(
+                    "UPDATE distances SET used = ? WHERE method = ? AND home_lat = ? AND home_lon = ? AND work_lat = ? AND work_lon = ?",
+                    ((used, method, *row) for row in hits),
+                )
+        for i, value in rows:
+            found[i] = True
+            km[i] = np.nan if value is None else value
+        return km, found
+
+    def store(self, method, keys, km):
+        """Cache km for ``keys``; NaN records that there is no route."""
+        used = time.time_ns()
+        with self.pool.transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO distances VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((method, *row, None if math.isnan(value) else value, used) for row, value in zip(keys.tolist(), km.tolist())),
+            )
+            excess = db.execute("SELECT COUNT(*) FROM distances").fetchone()[0] - self.max_entries
+            if excess > 0:
+                db.execute(
+                    """DELETE FROM distances WHERE (method, home_lat, home_lon, work_lat, work_lon) IN (
+                        SELECT method, home_lat, home_lon, work_lat, work_lon FROM distances ORDER BY used LIMIT ?)""",
+                    (excess,),
+                )
+
+
+class DistanceResolver:
+    """One-way commute km from home and work coordinates.
+
+    ``graph`` is a ``RoutingGraph``, or the path of one to load; without
+    it, distances are great-circle km times the ``circuity`` factors (see
+    ``circuity``). ``cache`` is the path of an SQLite route cache.
+    """
+
+    def __init__(self, graph=None, circuity=DEFAULT_CIRCUITY, cache=None, precision=DEFAULT_PRECISION,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        if isinstance(graph, (str, os.PathLike)):
+            graph = RoutingGraph.load(graph)
+        self.graph = graph
+        self.circuity = circuity
+        self.precision = precision
+        self.cache = RouteCache(cache, max_entries) if cache is not None else None
+        factors = repr(circuity if np.ndim(circuity) == 0 else tuple(map(tuple, circuity)))
+        kind = f"graph:{graph.digest}" if graph is not None else "haversine"
+        # Results of other methods, factors or rounding never share cache entries
+        self.method = f"{kind}:{factors}:{precision}"
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _compute(self, home_lat, home_lon, work_lat, work_lon):
+        if self.graph is not None:
+            return self.graph.route(home_lat, home_lon, work_lat, work_lon, self.circuity)
+        return circuity(haversine(home_lat, home_lon, work_lat, work_lon), self.circuity)
+
+    def resolve(self, home_lat, home_lon, work_lat, work_lon):
+        """One-way km for arrays of coordinates in degrees; NaN where they are missing or invalid."""
+        coordinates = np.stack([np.asarray(a, dtype=np.float64) for a in (home_lat, home_lon, work_lat, work_lon)], axis=-1)
+        km = np.full(len(coordinates), np.nan)
+        with np.errstate(invalid="ignore"):
+            valid = (
+                np.isfinite(coordinates).all(axis=1)
+                & (np.abs(coordinates[:, [0, 2]]) <= 90).all(axis=1)
+                & (np.abs(coordinates[:, [1, 3]]) <= 180).all(axis=1)
+            )
+        if not valid.any():
+            return km
+        scale = 10 ** self.precision
+        keys, inverse = np.unique(np.rint(coordinates[valid] * scale).astype(np.int64), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        if self.cache is not None:
+            with instrument.stage("distance_cache"):
+                unique_km, found = self.cache.lookup(self.method, keys)
+        else:
+            unique_km, found = np.full(len(keys), np.nan), np.zeros(len(keys), dtype=bool)
+        missing = ~found
+        if missing.any():
+            # Computed from the rounded coordinates, so a pair's distance
+            # doesn't depend on which of its points was seen first
+            rounded = keys[missing] / scale
+            with instrument.stage("distance_compute"):
+                unique_km[missing] = self._compute(*rounded.T)
+            if self.cache is not None:
+                with instrument.stage("distance_cache"):
+                    self.cache.store(self.method, keys[missing], unique_km[missing])
+        km[valid] = unique_km[inverse]
+        return km
+
+
+def fill_distances(chunk, resolver):
+    """``chunk`` with ``distance`` resolved from coordinate columns where it has them.
+
+    Rows with all four of ``COORDINATE_COLUMNS`` get the resolved distance
+    in place of any typed one; other rows keep theirs.
+    """
+    import pandas as pd
+
+    if not all(name in chunk for name in COORDINATE_COLUMNS):
+        return chunk
+    with instrument.stage("distances"):
+        coordinates = [pd.to_numeric(chunk[name], errors="coerce").to_numpy(np.float64) for name in COORDINATE_COLUMNS]
+        km = resolver.resolve(*coordinates)
+        has_coordinates = np.isfinite(np.stack(coordinates)).all(axis=0)
+        chunk = chunk.copy()
+        typed = pd.to_numeric(chunk["distance"], errors="coerce").to_numpy(np.float64) if "distance" in chunk else np.full(len(chunk), np.nan)
+        chunk["distance"] = np.where(has_coordinates, km, typed)
+    return chunk
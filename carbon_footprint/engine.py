@@ -0,0 +1,136 @@
+"""Emission calculations shared by the Streamlit app and batch scoring.
+
+``score`` takes columns of commute profiles as NumPy arrays and returns the
+monthly kg CO₂e for every row in one vectorized pass. The scalar helpers used
+by the app run through the same code so both paths give identical numbers.
+"""
+import numpy as np
+
+from carbon_footprint.factors import CATEGORIES, FUEL_CODES, SIZE_CODES, VEHICLE_CODES
+from carbon_footprint.factorsets import resolve
+from carbon_footprint.table import METRO, TWO_WHEELER
+
+PRIVATE, PUBLIC, BOTH = range(len(CATEGORIES))
+
+# Batch input columns as (name, dtype, default). Columns without a default
+# must be present; the rest only matter for some transport categories.
+PROFILE_FIELDS = (
+    ("distance", np.float64, None),
+    ("days_per_week", np.int64, None),
+    ("weeks_per_month", np.int64, None),
+    ("category", np.int8, PRIVATE),
+    ("vehicle", np.int8, TWO_WHEELER),
+    ("size", np.int8, 0),
+    ("fuel", np.int8, 0),
+    ("engine_cc", np.float64, 0),
+    ("people_count", np.int64, 1),
+    ("public_mode", np.int8, METRO),
+    ("public_size", np.int8, 0),
+    ("public_fuel", np.int8, 0),
+    ("public_people", np.int64, 1),
+    ("private_ratio", np.float64, 1.0),
+)
+
+
+def encode(values, names):
+    """Map an array of labels to their integer codes in ``names``."""
+    lookup = {name: code for code, name in enumerate(names)}
+    uniques, inverse = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    try:
+        codes = np.array([lookup[u] for u in uniques], dtype=np.int8)
+    except KeyError as exc:
+        raise ValueError(f"Unknown value {exc.args[0]!r}, expected one of {names}") from None
+    return codes[inverse]
+
+
+def factors(vehicle, size, fuel, engine_cc, table=None):
+    """Per-km emission factor for arrays of vehicle, size and fuel codes.
+
+    Combinations without a factor come back as NaN. ``table`` defaults to
+    the active factor set's (see ``carbon_footprint.factorsets``).
+    """
+    return resolve(table).per_km(vehicle, size, fuel, engine_cc)
+
+
+def blend(private_ef, people_count, public_ef, public_people, private_ratio):
+    """Combined factor for commutes split between a private and a public leg."""
+    public_ratio = 1 - private_ratio
+    return (private_ef / people_count) * private_ratio + (public_ef / public_people) * public_ratio
+
+
+def split_commute(category, private_ratio):
+    """Rows whose factor blends a private and a public leg."""
+    private_ratio = np.asarray(private_ratio)
+    return (np.asarray(category) == BOTH) & (private_ratio > 0) & (1 - private_ratio > 0)
+
+
+def private_only(category, private_ratio):
+    """Rows whose factor comes from the private vehicle alone."""
+    return (np.asarray(category) != PUBLIC) & ~split_commute(category, private_ratio)
+
+
+def commute_factor(category, private_ef, people_count, public_ef, public_people, private_ratio):
+    """Per-km factor of whole commutes from the factors of their legs."""
+    combined = blend(private_ef, people_count, public_ef, public_people, private_ratio)
+    split = split_commute(category, private_ratio)
+    return np.where(category == PUBLIC, public_ef, np.where(split, combined, private_ef))
+
+
+def monthly_km(distance, days_per_week, weeks_per_month):
+    """Total monthly commute distance for a daily round trip."""
+    return distance * 2 * days_per_week * weeks_per_month
+
+
+def score(profiles, table=None):
+    """Monthly kg CO₂e for every row of ``profiles``.
+
+    ``profiles`` maps the column names in ``PROFILE_FIELDS`` to equal-length
+    arrays; a dict, a pandas DataFrame or a NumPy structured array all work.
+    Categorical columns hold the integer codes defined in
+    ``carbon_footprint.factors`` (see ``encode``). As in the app, sharing
+    only reduces the factor when a commute is split between a private and a
+    public leg. Rows whose vehicle, size and fuel have no emission factor
+    score as NaN. ``table`` is as for ``factors``.
+    """
+    cols = profile_columns(profiles)
+    table = resolve(table)
+    private_ef = factors(cols["vehicle"], cols["size"], cols["fuel"], cols["engine_cc"], table)
+    public_ef = factors(cols["public_mode"], cols["public_size"], cols["public_fuel"], 0.0, table)
+    emission_factor = commute_factor(
+        cols["category"], private_ef, cols["people_count"], public_ef, cols["public_people"], cols["private_ratio"]
+    )
+    return monthly_km(cols["distance"], cols["days_per_week"], cols["weeks_per_month"]) * emission_factor
+
+
+def profile_columns(profiles):
+    """``profiles`` as a dict of arrays with every column in ``PROFILE_FIELDS``."""
+    cols = {}
+    for name, dtype, default in PROFILE_FIELDS:
+        if default is None or _has_column(profiles, name):
+            cols[name] = np.asarray(profiles[name], dtype=dtype)
+    n = len(cols["distance"])
+    for name, dtype, default in PROFILE_FIELDS:
+        if name not in cols:
+            cols[name] = np.full(n, default, dtype=dtype)
+    return cols
+
+
+def _has_column(profiles, name):
+    names = getattr(getattr(profiles, "dtype", None), "names", None)
+    if names is not None:
+        return name in names
+    return name in profiles
+
+
+def emission_factor(vehicle, size="", fuel=None, engine_cc=0, table=None):
+    """Per-km factor for a single vehicle, using the names shown in the app."""
+    value = factors(
+        VEHICLE_CODES[vehicle],
+        SIZE_CODES[size],
+        FUEL_CODES[fuel] if fuel is not None else 0,
+        engine_cc,
+        table,
+    )
+    if np.isnan(value):
+        raise ValueError(f"No emission factor for {vehicle} {size!r} {fuel!r}")
+    return float(value)
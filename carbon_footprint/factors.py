@@ -0,0 +1,32 @@
+"""Emission factors (approximate kg CO₂e per km) used by the calculator.
+
+Two and three wheelers store a ``min``/``max`` range that is interpolated on
+engine size, four wheelers and taxis store a ``base`` factor with a fuel
+specific ``uplift``, and buses and metro store the factor directly.
+
+The factors themselves live in versioned data files; ``EMISSION_FACTORS``
+is the set shipped in ``data/factors.json``. See
+``carbon_footprint.factorsets`` for loading other sets.
+"""
+import json
+import os
+
+# Integer codes used by the batch engine, in a fixed order
+VEHICLES = ("two_wheeler", "three_wheeler", "four_wheeler", "taxi", "bus", "metro")
+SIZES = (
+    "",  # not applicable (three wheelers, bus, metro)
+    "Scooter", "Motorcycle",
+    "small", "hatchback", "premium_hatchback", "compact_suv", "sedan", "suv", "hybrid",
+)
+FUELS = ("petrol", "diesel", "cng", "electric")
+CATEGORIES = ("Private Transport", "Public Transport", "Both Private and Public")
+
+VEHICLE_CODES = {name: code for code, name in enumerate(VEHICLES)}
+SIZE_CODES = {name: code for code, name in enumerate(SIZES)}
+FUEL_CODES = {name: code for code, name in enumerate(FUELS)}
+CATEGORY_CODES = {name: code for code, name in enumerate(CATEGORIES)}
+
+BUNDLED_FACTORS = os.path.join(os.path.dirname(__file__), "data", "factors.json")
+
+with open(BUNDLED_FACTORS, encoding="utf-8") as _file:
+    EMISSION_FACTORS = json.load(_file)["factors"]
@@ -0,0 +1,243 @@
+"""Versioned emission factor sets with a shared, memory-mapped cache.
+
+A factor set is a JSON file with a ``version`` and the nested ``factors``
+(see ``data/factors.json``, the set shipped with the app). The first load
+of a set compiles it into a ``FactorTable`` and writes the table's arrays to
+a binary cache file named after the SHA-256 of the set's file and the cache
+``LAYOUT``. Later loads, in this or any other process, map that file
+read-only instead of compiling, so the operating system keeps one copy
+however many workers and sessions use it. Within a process, the active set
+and the ``KEEP_LOADED`` sets loaded most recently are kept loaded.
+
+``active()`` returns the set in use: the file named by ``CARBON_FACTORS``
+(the shipped set by default), reloaded when the file changes.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import warnings
+
+import numpy as np
+
+from carbon_footprint.factors import BUNDLED_FACTORS
+from carbon_footprint.table import FactorTable, compile_factors
+
+# Version of what a cache file holds; bump it when FactorTable or
+# compile_factors change, so older files are not read as the new layout
+LAYOUT = 2
+MAGIC = b"CFTABLE" + str(LAYOUT).encode("ascii")
+# Arrays in cache files start on multiples of this many bytes
+ALIGNMENT = 64
+# Factor sets kept loaded besides the active one, as a hot-reloaded file goes through versions
+KEEP_LOADED = 4
+
+
+def cache_dir():
+    """Directory for compiled factor tables (``CARBON_FACTOR_CACHE``)."""
+    return os.environ.get("CARBON_FACTOR_CACHE") or os.path.join(tempfile.gettempdir(), "carbon_footprint-factors")
+
+
+class FactorSet:
+    """A loaded factor set: ``version``, ``digest``, nested ``factors`` and ``table``.
+
+    ``digest`` is the SHA-256 of the file the set came from. Pickling a set
+    only sends its factors; the receiving process maps the cached table.
+    """
+
+    __slots__ = ("version", "digest", "factors", "table")
+
+    def __init__(self, version, digest, factors, table):
+        self.version = version
+        self.digest = digest
+        self.factors = factors
+        self.table = table
+
+    @property
+    def label(self):
+        """Version plus the start of the digest, as recorded with results."""
+        return f"{self.version}+{self.digest[:12]}"
+
+    def __reduce__(self):
+        return _restore, (self.version, self.digest, self.factors)
+
+    def __repr__(self):
+        return f"FactorSet({self.label!r})"
+
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_cache(path, table):
+    """Write ``table``'s arrays to the binary cache file ``path``."""
+    arrays = [np.ascontiguousarray(getattr(table, name)) for name in FactorTable.__slots__]
+    header, offset = [], 0
+    for array in arrays:
+        offset = _align(offset)
+        header.append({"dtype": array.dtype.str, "shape": array.shape, "offset": offset})
+        offset += array.nbytes
+    head = json.dumps(header).encode("ascii")
+    start = _align(len(MAGIC) + 8 + len(head))
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # Written under a temporary name and renamed, so readers never see half a file
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as out:
+            out.write(MAGIC + len(head).to_bytes(8, "little") + head)
+            for array, entry in zip(arrays, header):
+                out.seek(start + entry["offset"])
+                out.write(array.tobytes())
+        # Readable by the other users' processes that share the cache
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read_cache(path):
+    """Map a cache file written by ``write_cache`` as a read-only ``FactorTable``.
+
+    Raises ValueError for a file that isn't one.
+    """
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not a factor table cache")
+    size = int.from_bytes(bytes(buffer[len(MAGIC):len(MAGIC) + 8]), "little")
+    header = json.loads(bytes(buffer[len(MAGIC) + 8:len(MAGIC) + 8 + size]))
+    start = _align(len(MAGIC) + 8 + size)
+    arrays = []
+    for entry in header:
+        dtype = np.dtype(entry["dtype"])
+        begin = start + entry["offset"]
+        count = int(np.prod(entry["shape"]))
+        arrays.append(buffer[begin:begin + count * dtype.itemsize].view(dtype).reshape(entry["shape"]))
+    if len(arrays) != len(FactorTable.__slots__):
+        raise ValueError(f"{path} is not a factor table cache")
+    return FactorTable(*arrays)
+
+
+def _table(digest, factors):
+    path = os.path.join(cache_dir(), f"factors-{digest}-v{LAYOUT}.bin")
+    try:
+        return read_cache(path)
+    except (OSError, ValueError):
+        pass
+    table = compile_factors(factors)
+    try:
+        write_cache(path, table)
+        return read_cache(path)
+    except (OSError, ValueError):
+        # Without a usable cache directory the set still works, unshared
+        return table
+
+
+def _register(version, digest, factors):
+    with _loaded_lock:
+        factor_set = _loaded.get(digest)
+        if factor_set is None:
+            factor_set = _loaded[digest] = FactorSet(version, digest, factors, _table(digest, factors))
+            _prune()
+        return factor_set
+
+
+def _prune():
+    # Sets still referenced elsewhere stay usable; they're only no longer shared
+    current = _source.current if _source is not None else None
+    old = [digest for digest, factor_set in _loaded.items() if factor_set is not current]
+    for digest in old[:max(0, len(old) - KEEP_LOADED)]:
+        del _loaded[digest]
+
+
+def _restore(version, digest, factors):
+    return _loaded.get(digest) or _register(version, digest, factors)
+
+
+def from_bytes(data):
+    """The factor set in the content of a factor set file.
+
+    Raises ValueError if it isn't a valid set.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    if digest in _loaded:
+        return _loaded[digest]
+    try:
+        content = json.loads(data)
+        # Compiling a new set checks every key against the engine's codes
+        return _register(str(content["version"]), digest, content["factors"])
+    except (KeyError, TypeError, AttributeError) as exc:
+        raise ValueError(f"Not a factor set: missing or malformed {exc}") from None
+
+
+def load(path):
+    """The factor set in the file at ``path``; ValueError if it isn't one."""
+    with open(path, "rb") as file:
+        return from_bytes(file.read())
+
+
+class FactorSource:
+    """The factor set in the file at ``path``, reloaded when the file changes.
+
+    Checking costs one ``stat`` per call. If a changed file can't be loaded,
+    the previous set stays in use and a warning is issued; so it does while
+    the file is missing, as when it is being replaced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.current = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            if self.current is None:
+                raise
+            return self.current
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp != self.stamp:
+            with self.lock:
+                if stamp != self.stamp:
+                    try:
+                        self.current = load(self.path)
+                    except ValueError as exc:
+                        if self.current is None:
+                            raise
+                        warnings.warn(f"Keeping factor set {self.current.label}: {exc}", RuntimeWarning)
+                    self.stamp = stamp
+        return self.current
+
+
+_source = None
+
+
+def use(path):
+    """Make the file at ``path`` the active factor set; returns the set."""
+    global _source
+    source = FactorSource(path)
+    factor_set = source.get()
+    _source = source
+    return factor_set
+
+
+def active():
+    """The factor set in use, reloaded if its file changed."""
+    global _source
+    if _source is None:
+        _source = FactorSource(os.environ.get("CARBON_FACTORS") or BUNDLED_FACTORS)
+    return _source.get()
+
+
+def resolve(table=None):
+    """``table``, or the active set's table when None."""
+    return active().table if table is None else table
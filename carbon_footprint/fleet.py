@@ -0,0 +1,363 @@
+"""Fleet analytics over streamed per-commuter results.
+
+``FleetSummary`` takes scored commutes a chunk at a time and keeps only
+running totals per group, the top emitters and quantile sketches, so memory
+stays bounded however many rows go through it. Summaries of separate chunks
+can be merged, which lets workers summarize in parallel.
+
+The quantile sketch puts values in logarithmic buckets (as in DDSketch):
+every quantile it reports is within ``alpha`` (1% by default) of the exact
+value, and merging two sketches just adds their bucket counts.
+"""
+import heapq
+import itertools
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from carbon_footprint import instrument
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+DEFAULT_ALPHA = 0.01
+DEFAULT_TOP = 10
+# Smaller values count as zero emissions
+MIN_VALUE = 1e-9
+
+
+def quantile_name(q):
+    return f"p{q * 100:g}_kg"
+
+
+class QuantileSketch:
+    """Mergeable approximate quantiles of non-negative values."""
+
+    __slots__ = ("alpha", "log_gamma", "offset", "counts", "zeros")
+
+    def __init__(self, alpha=DEFAULT_ALPHA):
+        self.alpha = alpha
+        self.log_gamma = math.log((1 + alpha) / (1 - alpha))
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.zeros = 0
+
+    @property
+    def count(self):
+        return self.zeros + int(self.counts.sum())
+
+    def buckets(self, values):
+        """Bucket index of each positive value."""
+        return np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+
+    def _cover(self, lo, hi):
+        if not len(self.counts):
+            self.offset = lo
+            self.counts = np.zeros(hi - lo + 1, dtype=np.int64)
+            return
+        start = min(lo, self.offset)
+        stop = max(hi + 1, self.offset + len(self.counts))
+        if start != self.offset or stop != self.offset + len(self.counts):
+            counts = np.zeros(stop - start, dtype=np.int64)
+            counts[self.offset - start:self.offset - start + len(self.counts)] = self.counts
+            self.offset, self.counts = start, counts
+
+    def add_buckets(self, buckets, zeros=0):
+        """Count values already mapped with ``buckets``, plus ``zeros`` zeros."""
+        self.zeros += int(zeros)
+        if len(buckets):
+            lo, hi = int(buckets.min()), int(buckets.max())
+            self._cover(lo, hi)
+            self.counts[lo - self.offset:hi - self.offset + 1] += np.bincount(buckets - lo, minlength=hi - lo + 1)
+
+    def add(self, values):
+        """Count an array of values; NaN is ignored."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        positive = values[values > MIN_VALUE]
+        self.add_buckets(self.buckets(positive), len(values) - len(positive))
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError("Can only merge sketches with the same alpha")
+        self.zeros += other.zeros
+        if len(other.counts):
+            self._cover(other.offset, other.offset + len(other.counts) - 1)
+            start = other.offset - self.offset
+            self.counts[start:start + len(other.counts)] += other.counts
+        return self
+
+    def quantiles(self, qs=QUANTILES):
+        """Approximate quantiles, NaN while the sketch is empty."""
+        count = self.count
+        if not count:
+            return [math.nan] * len(qs)
+        cumulative = np.cumsum(self.counts)
+        gamma = math.exp(self.log_gamma)
+        values = []
+        for q in qs:
+            rank = q * (count - 1)
+            if rank < self.zeros:
+                values.append(0.0)
+                continue
+            bucket = int(np.searchsorted(cumulative, rank - self.zeros, side="right")) + self.offset
+            values.append(2 * gamma ** bucket / (gamma + 1))
+        return values
+
+
+class TopEmitters:
+    """The ``n`` largest emissions seen, with their commuter ids."""
+
+    __slots__ = ("n", "heap", "order")
+
+    def __init__(self, n=DEFAULT_TOP):
+        self.n = n
+        self.heap = []
+        # Breaks ties so ids of any type never get compared
+        self.order = itertools.count()
+
+    def __getstate__(self):
+        return self.n, self.heap
+
+    def __setstate__(self, state):
+        self.n, self.heap = state
+        self.order = itertools.count(len(self.heap))
+
+    def add(self, values, ids):
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.flatnonzero(~np.isnan(values))
+        if not self.n or not len(valid):
+            return
+        # Only this chunk's own top n can make it into the heap
+        if len(valid) > self.n:
+            valid = valid[np.argpartition(-values[valid], self.n - 1)[:self.n]]
+        for i in valid.tolist():
+            self._push(float(values[i]), ids[i])
+
+    def _push(self, value, id_):
+        item = (value, next(self.order), id_)
+        if len(self.heap) < self.n:
+            heapq.heappush(self.heap, item)
+        elif value > self.heap[0][0]:
+            heapq.heapreplace(self.heap, item)
+
+    def merge(self, other):
+        for value, _, id_ in other.heap:
+            self._push(value, id_)
+        return self
+
+    def items(self):
+        """``(id, emissions)`` pairs, largest first."""
+        return [(id_, value) for value, _, id_ in sorted(self.heap, key=lambda item: (-item[0], item[1]))]
+
+
+class _Group:
+    __slots__ = ("rows", "emissions_kg", "monthly_km", "sketch")
+
+    def __init__(self, alpha):
+        self.rows = 0
+        self.emissions_kg = 0.0
+        self.monthly_km = 0.0
+        self.sketch = QuantileSketch(alpha)
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.emissions_kg += other.emissions_kg
+        self.monthly_km += other.monthly_km
+        self.sketch.merge(other.sketch)
+
+    def summary(self, qs):
+        mean = self.emissions_kg / self.rows if self.rows else math.nan
+        result = {"rows": self.rows, "emissions_kg": self.emissions_kg, "monthly_km": self.monthly_km, "mean_kg": mean}
+        result.update(zip(map(quantile_name, qs), self.sketch.quantiles(qs)))
+        return result
+
+
+class FleetSummary:
+    """Running rollups of scored commutes, overall and per group.
+
+    ``by`` names the columns to group on, such as site or department;
+    ``top`` is how many of the highest emitters to keep.
+    """
+
+    def __init__(self, by=(), top=DEFAULT_TOP, alpha=DEFAULT_ALPHA):
+        self.by = tuple(by)
+        self.alpha = alpha
+        self.total = _Group(alpha)
+        self.groups = {}
+        self.top = TopEmitters(top)
+        self.rejected = 0
+
+    def update(self, emissions_kg, monthly_km, keys=None, ids=None):
+        """Add a chunk of results.
+
+        ``keys`` maps each ``by`` column to an array of labels and ``ids``
+        identifies commuters for the top emitters list (row numbers
+        otherwise). Rows with NaN emissions are counted as rejected.
+        """
+        emissions_kg = np.asarray(emissions_kg, dtype=np.float64)
+        monthly_km = np.asarray(monthly_km, dtype=np.float64)
+        if ids is None:
+            start = self.total.rows + self.rejected
+            ids = np.arange(start, start + len(emissions_kg))
+        scored = ~np.isnan(emissions_kg)
+        self.rejected += int((~scored).sum())
+        self.top.add(emissions_kg, ids)
+
+        values = emissions_kg[scored]
+        km = monthly_km[scored]
+        positive = values > MIN_VALUE
+        buckets = np.zeros(len(values), dtype=np.int64)
+        buckets[positive] = self.total.sketch.buckets(values[positive])
+        self._add(self.total, values, km, buckets, positive)
+
+        if self.by:
+            labels = [np.asarray(keys[name], dtype=object)[scored] for name in self.by]
+            codes, uniques = _factorize(labels)
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            for code, key in enumerate(uniques):
+                rows = order[bounds[code]:bounds[code + 1]]
+                group = self.groups.get(key)
+                if group is None:
+                    group = self.groups[key] = _Group(self.alpha)
+                self._add(group, values[rows], km[rows], buckets[rows], positive[rows])
+
+    @staticmethod
+    def _add(group, values, km, buckets, positive):
+        group.rows += len(values)
+        group.emissions_kg += float(values.sum())
+        group.monthly_km += float(km.sum())
+        group.sketch.add_buckets(buckets[positive], len(values) - int(positive.sum()))
+
+    def update_results(self, frame, id_column=None, ids=None):
+        """Add a results DataFrame such as ``ingest.score_chunk`` returns.
+
+        Commuters are identified by ``id_column``, else by ``ids``.
+        """
+        self.update(
+            frame["emissions_kg"].to_numpy(),
+            frame["monthly_km"].to_numpy(),
+            {name: frame[name].to_numpy() for name in self.by},
+            frame[id_column].to_numpy() if id_column else ids,
+        )
+
+    def merge(self, other):
+        if other.by != self.by:
+            raise ValueError("Can only merge summaries grouped by the same columns")
+        self.total.merge(other.total)
+        self.rejected += other.rejected
+        for key, group in other.groups.items():
+            if key in self.groups:
+                self.groups[key].merge(group)
+            else:
+                self.groups[key] = group
+        self.top.merge(other.top)
+        return self
+
+    def to_dict(self, qs=QUANTILES):
+        """Plain summary: overall figures, ``groups`` and ``top`` emitters."""
+        result = self.total.summary(qs)
+        result["rejected"] = self.rejected
+        result["groups"] = [
+            {**dict(zip(self.by, key)), **group.summary(qs)}
+            for key, group in sorted(self.groups.items())
+        ]
+        result["top"] = [{"id": _plain(id_), "emissions_kg": value} for id_, value in self.top.items()]
+        return result
+
+
+def _factorize(labels):
+    """Integer codes for each distinct tuple of labels, and the tuples."""
+    combined = np.zeros(len(labels[0]), dtype=np.int64)
+    names = []
+    for column in labels:
+        # Missing labels (-1) pick the trailing ""
+        inverse, uniques = pd.factorize(column)
+        names.append([str(value) for value in uniques] + [""])
+        combined = combined * len(names[-1]) + np.where(inverse < 0, len(uniques), inverse)
+    keys, codes = np.unique(combined, return_inverse=True)
+    uniques = []
+    for key in keys.tolist():
+        parts = []
+        for column in reversed(names):
+            key, code = divmod(key, len(column))
+            parts.append(column[code])
+        uniques.append(tuple(reversed(parts)))
+    return codes.reshape(-1), uniques
+
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _summarize_chunk(chunk, start, by, id_column, top, alpha, factor_set):
+    from carbon_footprint.ingest import score_chunk
+
+    keep = list(by) + ([id_column] if id_column and id_column not in by else [])
+    if "emissions_kg" not in chunk:
+        chunk = score_chunk(chunk, keep, factor_set=factor_set)
+    summary = FleetSummary(by, top, alpha)
+    # Without an id column, commuters are numbered by their row in the file
+    summary.update_results(chunk, id_column, np.arange(start, start + len(chunk)))
+    return summary
+
+
+def summarize_file(source, by=(), id_column=None, top=DEFAULT_TOP, chunksize=None, input_format=None, workers=1,
+                   alpha=DEFAULT_ALPHA, factor_set=None):
+    """Summarize a commute survey, or a results file from ``process_file``.
+
+    Surveys are scored as they are read, with ``factor_set`` (the active
+    one by default). Chunks are summarized in ``workers``
+    processes (None for all cores) and the partial summaries merged; only a
+    few chunks are in flight at a time, so memory stays bounded.
+    """
+    from carbon_footprint.factorsets import active
+    from carbon_footprint.ingest import DEFAULT_CHUNKSIZE, read_chunks
+
+    factor_set = factor_set or active()
+    keep = list(by) + ([id_column] if id_column else []) + ["emissions_kg", "monthly_km"]
+    chunks = read_chunks(source, chunksize or DEFAULT_CHUNKSIZE, input_format, keep)
+    summary = FleetSummary(by, top, alpha)
+    workers = workers or os.cpu_count() or 1
+    start = 0
+    with instrument.job("batch", job="summarize_file"):
+        chunks = instrument.timed(chunks, "read")
+        if workers == 1:
+            for chunk in chunks:
+                with instrument.stage("summarize"):
+                    summary.merge(_summarize_chunk(chunk, start, by, id_column, top, alpha, factor_set))
+                start += len(chunk)
+            return summary
+
+        # Time spent in the worker processes isn't broken down; "wait" is
+        # how long this process waited for their results
+        with ProcessPoolExecutor(workers) as pool:
+            pending = []
+            for chunk in chunks:
+                pending.append(pool.submit(_summarize_chunk, chunk, start, by, id_column, top, alpha, factor_set))
+                start += len(chunk)
+                if len(pending) >= 2 * workers:
+                    with instrument.stage("wait"):
+                        summary.merge(pending.pop(0).result())
+            with instrument.stage("wait"):
+                for future in pending:
+                    summary.merge(future.result())
+    return summary
+
+
+def save(summary, path):
+    """Write ``summary.to_dict()`` as JSON."""
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(summary.to_dict(), handle, indent=2, ensure_ascii=False)
+
+
+def load(path):
+    """A summary written by ``save``, or None if there is no file."""
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return json.load(handle)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,214 @@
+"""Persisted history of calculated footprints with yearly projections.
+
+Footprints are appended to a local SQLite database in WAL mode, so readers
+never wait for a bulk import. Each month's footprints go to their own table
+(``footprints_YYYY_MM``), which keeps inserts free of index maintenance and
+lets old months be exported or dropped one at a time. Each append also
+updates running totals per user and month and per month in the same
+transaction. Trends and
+projections read only those totals, so their cost depends on the number of
+months and not on how many footprints have been recorded.
+
+A user's footprint for a month is the mean of the footprints recorded for
+them that month; a month's fleet total is the sum of those means.
+"""
+import datetime
+
+import numpy as np
+
+from carbon_footprint.db import DEFAULT_POOL_SIZE, ConnectionPool
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_months (
+    user TEXT NOT NULL,
+    month TEXT NOT NULL,
+    records INTEGER NOT NULL,
+    monthly_km REAL NOT NULL,
+    emissions_kg REAL NOT NULL,
+    PRIMARY KEY (user, month)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS months (
+    month TEXT PRIMARY KEY,
+    users INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    monthly_km REAL NOT NULL,
+    emissions_kg REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+PARTITION = """
+CREATE TABLE IF NOT EXISTS {table} (
+    user TEXT NOT NULL,
+    recorded_at TEXT NOT NULL,
+    monthly_km REAL NOT NULL,
+    emissions_kg REAL NOT NULL,
+    vehicle_name TEXT
+)
+"""
+
+# Change in each month's totals from a batch of per-user sums in _batch
+_MONTH_DELTAS = """
+SELECT b.month,
+       SUM(u.user IS NULL),
+       SUM(b.records),
+       SUM((IFNULL(u.monthly_km, 0) + b.monthly_km) / (IFNULL(u.records, 0) + b.records)
+           - IFNULL(u.monthly_km / u.records, 0)),
+       SUM((IFNULL(u.emissions_kg, 0) + b.emissions_kg) / (IFNULL(u.records, 0) + b.records)
+           - IFNULL(u.emissions_kg / u.records, 0))
+FROM _batch b LEFT JOIN user_months u ON u.user = b.user AND u.month = b.month
+GROUP BY b.month
+"""
+
+# Months used for yearly projections
+PROJECTION_MONTHS = 12
+
+
+def current_month():
+    return datetime.date.today().strftime("%Y-%m")
+
+
+def parse_month(value):
+    """``value`` as a ``YYYY-MM`` month; ValueError if it isn't one."""
+    return datetime.datetime.strptime(str(value)[:7], "%Y-%m").strftime("%Y-%m")
+
+
+def partition(month):
+    """Name of the table holding the footprints recorded for ``month``."""
+    return "footprints_" + parse_month(month).replace("-", "_")
+
+
+def _projection(monthly_kg):
+    if not monthly_kg:
+        return {"months": 0, "monthly_kg": None, "yearly_kg": None}
+    mean = sum(monthly_kg) / len(monthly_kg)
+    return {"months": len(monthly_kg), "monthly_kg": mean, "yearly_kg": mean * 12}
+
+
+class HistoryStore:
+    """Append-only footprint history in the SQLite database at ``path``.
+
+    Safe to share between threads, such as Streamlit sessions.
+    """
+
+    def __init__(self, path, pool_size=DEFAULT_POOL_SIZE):
+        self.pool = ConnectionPool(path, SCHEMA, pool_size)
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, users, emissions_kg, monthly_km, month=None, vehicle_names=None):
+        """Record footprints for arrays of users; returns the number recorded.
+
+        ``month`` is one ``YYYY-MM`` string for the whole batch or an array
+        of them, defaulting to the current month. Rows with a missing user or
+        NaN emissions are skipped.
+        """
+        users = np.asarray(users, dtype=object)
+        n = len(users)
+        emissions_kg = np.asarray(emissions_kg, dtype=np.float64)
+        monthly_km = np.asarray(monthly_km, dtype=np.float64)
+        if month is None or isinstance(month, str):
+            months = np.full(n, parse_month(month or current_month()), dtype=object)
+        else:
+            months = np.array([parse_month(value) for value in month], dtype=object)
+        names = np.full(n, None, dtype=object) if vehicle_names is None else np.asarray(vehicle_names, dtype=object)
+
+        valid = ~np.isnan(emissions_kg) & ~np.isnan(monthly_km) & np.array([user is not None and user == user and str(user) != "" for user in users], dtype=bool)
+        users, emissions_kg, monthly_km, months, names = (
+            users[valid].astype(str), emissions_kg[valid], monthly_km[valid], months[valid], names[valid]
+        )
+        if not len(users):
+            return 0
+
+        # Sum the batch per user and month before touching the running totals
+        month_keys, month_codes = np.unique(months.astype(str), return_inverse=True)
+        month_codes = month_codes.reshape(-1)
+        user_keys, user_codes = np.unique(users, return_inverse=True)
+        keys, inverse = np.unique(month_codes * len(user_keys) + user_codes.reshape(-1), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        batch = zip(
+            user_keys[keys % len(user_keys)].tolist(),
+            month_keys[keys // len(user_keys)].tolist(),
+            np.bincount(inverse).tolist(),
+            np.bincount(inverse, weights=monthly_km).tolist(),
+            np.bincount(inverse, weights=emissions_kg).tolist(),
+        )
+        recorded_at = datetime.datetime.now().isoformat(timespec="seconds")
+
+        with self.pool.transaction() as db:
+            for code, month in enumerate(month_keys.tolist()):
+                rows = month_codes == code
+                table = partition(month)
+                db.execute(PARTITION.format(table=table))
+                db.executemany(
+                    f"INSERT INTO {table} VALUES (?, ?, ?, ?, ?)",
+                    zip(users[rows].tolist(), [recorded_at] * int(rows.sum()), monthly_km[rows].tolist(), emissions_kg[rows].tolist(), names[rows].tolist()),
+                )
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS _batch (user TEXT, month TEXT, records INTEGER, monthly_km REAL, emissions_kg REAL, PRIMARY KEY (user, month))")
+            db.execute("DELETE FROM _batch")
+            db.executemany("INSERT INTO _batch VALUES (?, ?, ?, ?, ?)", batch)
+            db.executemany(
+                """INSERT INTO months VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (month) DO UPDATE SET
+                    users = users + excluded.users,
+                    records = records + excluded.records,
+                    monthly_km = monthly_km + excluded.monthly_km,
+                    emissions_kg = emissions_kg + excluded.emissions_kg""",
+                db.execute(_MONTH_DELTAS).fetchall(),
+            )
+            db.execute(
+                """INSERT INTO user_months SELECT * FROM _batch WHERE true
+                ON CONFLICT (user, month) DO UPDATE SET
+                    records = records + excluded.records,
+                    monthly_km = monthly_km + excluded.monthly_km,
+                    emissions_kg = emissions_kg + excluded.emissions_kg"""
+            )
+        return len(users)
+
+    def record(self, user, emissions_kg, monthly_km, vehicle_name=None, month=None):
+        """Record one footprint, such as a ``calculate`` result."""
+        return self.append([user], [emissions_kg], [monthly_km], month, [vehicle_name])
+
+    def _query(self, sql, parameters=()):
+        with self.pool.connection() as db:
+            return db.execute(sql, parameters).fetchall()
+
+    def trend(self, user=None, months=None):
+        """Monthly footprints, oldest first, for one user or the whole fleet.
+
+        Each item has ``month``, ``emissions_kg``, ``monthly_km`` and
+        ``records``; fleet items also have ``users``. ``months`` limits the
+        result to the most recent months.
+        """
+        limit = -1 if months is None else int(months)
+        if user is None:
+            rows = self._query(
+                "SELECT month, emissions_kg, monthly_km, records, users FROM months ORDER BY month DESC LIMIT ?", (limit,)
+            )
+            return [
+                {"month": month, "emissions_kg": kg, "monthly_km": km, "records": records, "users": users}
+                for month, kg, km, records, users in reversed(rows)
+            ]
+        rows = self._query(
+            """SELECT month, emissions_kg / records, monthly_km / records, records FROM user_months
+            WHERE user = ? ORDER BY month DESC LIMIT ?""",
+            (str(user), limit),
+        )
+        return [
+            {"month": month, "emissions_kg": kg, "monthly_km": km, "records": records}
+            for month, kg, km, records in reversed(rows)
+        ]
+
+    def projection(self, user=None, months=PROJECTION_MONTHS):
+        """Yearly kg CO₂e projected from the mean of the most recent months.
+
+        Returns ``months`` (how many were available), ``monthly_kg`` and
+        ``yearly_kg``; both are None without any history.
+        """
+        return _projection([item["emissions_kg"] for item in self.trend(user, months)])
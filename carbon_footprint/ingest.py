@@ -0,0 +1,219 @@
+"""Bulk scoring of commute survey exports.
+
+Surveys are read from CSV or Parquet in chunks, validated against the same
+choices the app's widgets allow, scored with the batch engine and written out
+chunk by chunk, so memory use depends on the chunk size and not on the size
+of the file.
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from carbon_footprint import instrument
+from carbon_footprint.alternatives import ALTERNATIVES, alternatives
+from carbon_footprint.engine import monthly_km, private_only, score
+from carbon_footprint.factorsets import active
+from carbon_footprint.recommend import evaluate, profile_rule_columns, rule_ids
+from carbon_footprint.validate import LABEL_COLUMNS, NUMBER_COLUMNS, SURVEY_COLUMNS, encode_inputs
+
+DEFAULT_CHUNKSIZE = 100_000
+
+RESULT_COLUMNS = ("monthly_km", "emissions_kg") + ALTERNATIVES + ("recommendations", "error", "factor_version")
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet support needs pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def _format(file, format):
+    if format is not None:
+        return format
+    name = file if isinstance(file, (str, os.PathLike)) else getattr(file, "name", "")
+    return "parquet" if str(name).lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def read_chunks(source, chunksize=DEFAULT_CHUNKSIZE, format=None, keep=()):
+    """Yield the survey columns (plus ``keep``) of ``source`` as DataFrames."""
+    wanted = set(SURVEY_COLUMNS) | set(keep)
+    if _format(source, format) == "parquet":
+        parquet = _parquet().parquet.ParquetFile(source)
+        columns = [name for name in parquet.schema_arrow.names if name in wanted]
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        with pd.read_csv(source, chunksize=chunksize, usecols=lambda name: name in wanted) as reader:
+            yield from reader
+
+
+def encode_survey(chunk):
+    """Validate a survey DataFrame chunk, see ``validate.encode_inputs``."""
+    columns = {}
+    for name in NUMBER_COLUMNS:
+        if name in chunk:
+            columns[name] = pd.to_numeric(chunk[name], errors="coerce").to_numpy(np.float64)
+    for name in LABEL_COLUMNS:
+        if name in chunk:
+            # Clean each distinct value once; missing values (-1) pick the trailing ""
+            inverse, uniques = pd.factorize(chunk[name])
+            columns[name] = [str(value).strip() for value in uniques] + [""], inverse
+    return encode_inputs(columns, len(chunk))
+
+
+def score_chunk(chunk, keep=(), draws=0, seed=0, workers=1, factor_set=None, distances=None):
+    """Score one survey chunk, returning ``keep`` columns plus the results.
+
+    With ``draws``, also adds Monte Carlo percentile columns (see
+    ``carbon_footprint.uncertainty``). ``factor_set`` defaults to the active
+    one. ``distances``, a ``distances.DistanceResolver``, resolves the
+    distance of rows with home and work coordinates.
+    """
+    return _score(chunk, keep, draws, seed, workers, factor_set or active(), distances)[0]
+
+
+def _score(chunk, keep, draws, seed, workers, factor_set, distances=None):
+    if distances is not None:
+        from carbon_footprint.distances import fill_distances
+
+        chunk = fill_distances(chunk, distances)
+    missing = [name for name in keep if name not in chunk]
+    if missing:
+        raise ValueError(f"Survey has no column {missing[0]!r}")
+    table = factor_set.table
+    with instrument.stage("validate"):
+        profiles, errors = encode_survey(chunk)
+        rejected = errors != ""
+
+    with instrument.stage("score"):
+        km = monthly_km(profiles["distance"], profiles["days_per_week"], profiles["weeks_per_month"])
+        results = {"monthly_km": km, "emissions_kg": score(profiles, table)}
+    with instrument.stage("alternatives"):
+        results.update(alternatives(
+            km,
+            profiles["vehicle"],
+            profiles["fuel"],
+            profiles["people_count"],
+            private_only(profiles["category"], profiles["private_ratio"]),
+            table,
+        ))
+    totals = None
+    if draws:
+        from carbon_footprint.uncertainty import simulate
+
+        with instrument.stage("uncertainty"):
+            accepted = {name: values[~rejected] for name, values in profiles.items()}
+            bands, totals = simulate(accepted, draws, seed, workers=workers, factor_set=factor_set)
+            for name, values in bands.items():
+                results[name] = np.full(len(chunk), np.nan)
+                results[name][~rejected] = values
+
+    with instrument.stage("recommendations"):
+        recommendations = rule_ids(evaluate(profile_rule_columns(profiles, results["emissions_kg"], km, table)))
+    with instrument.stage("dataframe"):
+        out = pd.DataFrame({name: chunk[name].to_numpy() for name in keep})
+        for name, values in results.items():
+            out[name] = np.where(rejected, np.nan, values)
+        out["recommendations"] = np.where(rejected, "", recommendations)
+        out["error"] = errors
+        out["factor_version"] = factor_set.label
+    return out, totals
+
+
+class _CsvWriter:
+    def __init__(self, destination):
+        if isinstance(destination, (str, os.PathLike)):
+            self.handle = self.owned = open(destination, "w", newline="", encoding="utf-8")
+        elif isinstance(destination, io.TextIOBase):
+            self.handle, self.owned = destination, None
+        else:
+            self.handle = io.TextIOWrapper(destination, encoding="utf-8", newline="")
+            self.owned = None
+        self.header = True
+
+    def write(self, frame):
+        frame.to_csv(self.handle, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        if self.owned is not None:
+            self.owned.close()
+        elif isinstance(self.handle, io.TextIOWrapper):
+            # Leave the caller's binary stream open
+            self.handle.flush()
+            self.handle.detach()
+
+
+class _ParquetWriter:
+    def __init__(self, destination):
+        self.pyarrow = _parquet()
+        self.destination = destination
+        self.writer = None
+
+    def write(self, frame):
+        if self.writer is None:
+            table = self.pyarrow.Table.from_pandas(frame, preserve_index=False)
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.destination, table.schema)
+        else:
+            table = self.pyarrow.Table.from_pandas(frame, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def process_file(source, destination, chunksize=DEFAULT_CHUNKSIZE, keep=(), input_format=None, output_format=None,
+                 draws=0, seed=0, workers=1, on_chunk=None, factor_set=None, distances=None):
+    """Score a survey file chunk by chunk and write the results incrementally.
+
+    ``source`` and ``destination`` are paths or file objects; the format
+    follows the file extension (``.csv``, ``.parquet``) unless given. Returns
+    the number of rows read and rejected. With ``draws``, rows also get
+    Monte Carlo percentiles, and the summary includes the percentiles of the
+    whole survey's total under ``"fleet"``. ``on_chunk`` is called with
+    each scored chunk after it is written. The whole file is scored with
+    one factor set, the active one by default, whose label is in the
+    summary and in every row's ``factor_version``. With ``distances``, a
+    ``distances.DistanceResolver``, rows with ``home_lat``, ``home_lon``,
+    ``work_lat`` and ``work_lon`` are scored on the distance resolved from
+    them.
+    """
+    factor_set = factor_set or active()
+    columns = tuple(keep)
+    if distances is not None:
+        from carbon_footprint.distances import COORDINATE_COLUMNS
+
+        columns += COORDINATE_COLUMNS
+    if _format(destination, output_format) == "parquet":
+        writer = _ParquetWriter(destination)
+    else:
+        writer = _CsvWriter(destination)
+    rows = rejected = 0
+    fleet_totals = np.zeros(draws)
+    with instrument.job("batch", job="process_file"):
+        try:
+            for chunk in instrument.timed(read_chunks(source, chunksize, input_format, columns), "read"):
+                result, totals = _score(chunk, keep, draws, seed, workers, factor_set, distances)
+                with instrument.stage("write"):
+                    writer.write(result)
+                if on_chunk is not None:
+                    with instrument.stage("on_chunk"):
+                        on_chunk(result)
+                rows += len(result)
+                rejected += int((result["error"] != "").sum())
+                if totals is not None:
+                    fleet_totals += totals
+        finally:
+            writer.close()
+    summary = {"rows": rows, "rejected": rejected, "factor_version": factor_set.label}
+    if draws:
+        from carbon_footprint.uncertainty import fleet_bands
+
+        summary["fleet"] = fleet_bands(fleet_totals)
+    return summary
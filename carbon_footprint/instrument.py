@@ -0,0 +1,288 @@
+"""Optional per-stage timing of app reruns and batch jobs.
+
+Off unless ``CARBON_PROFILE`` is set (or ``enable`` is called); while off,
+``stage`` returns a shared do-nothing context manager, so instrumented code
+pays about one function call per stage.
+
+When on, ``start`` opens a run for an app rerun, and ``job`` one for a
+batch job unless it runs inside another run. Each ``stage`` records its
+wall time and the net number of memory blocks it allocated
+(``sys.getallocatedblocks``). ``Run.finish`` adds the run to the
+process-wide totals and writes it as one JSON line to
+``CARBON_PROFILE_LOG`` (a path, or ``-`` for stderr) if set.
+``prometheus_text`` renders the totals in the Prometheus text format and
+``serve_metrics`` serves them on ``/metrics`` locally.
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+
+_enabled = bool(os.environ.get("CARBON_PROFILE"))
+_log_path = os.environ.get("CARBON_PROFILE_LOG")
+_current = contextvars.ContextVar("carbon_footprint_run", default=None)
+_lock = threading.Lock()
+# (kind, stage) -> [calls, seconds, allocated blocks]; stage "" is the whole run
+_totals = {}
+_server = None
+
+
+def enabled():
+    return _enabled
+
+
+def enable(log=None):
+    """Turn instrumentation on; ``log`` is as for ``CARBON_PROFILE_LOG``."""
+    global _enabled, _log_path
+    _enabled = True
+    if log is not None:
+        _log_path = log
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+class _Noop:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class _Stage:
+    __slots__ = ("run", "name", "start", "blocks")
+
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.run.add(self.name, seconds, sys.getallocatedblocks() - self.blocks)
+        return False
+
+
+class Run:
+    """Stages timed during one rerun or batch job, in the order they finished."""
+
+    __slots__ = ("kind", "labels", "stages", "start", "blocks", "seconds", "alloc_blocks")
+
+    def __init__(self, kind, labels):
+        self.kind = kind
+        self.labels = labels
+        self.stages = []
+        self.seconds = None
+        self.alloc_blocks = None
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+
+    def add(self, name, seconds, alloc_blocks):
+        self.stages.append((name, seconds, alloc_blocks))
+
+    def finish(self):
+        """Close the run, add it to the totals and log it; returns the run."""
+        if self.seconds is not None:
+            return self
+        self.seconds = time.perf_counter() - self.start
+        self.alloc_blocks = sys.getallocatedblocks() - self.blocks
+        with _lock:
+            _count(self.kind, "", self.seconds, self.alloc_blocks)
+            for name, seconds, alloc_blocks in self.stages:
+                _count(self.kind, name, seconds, alloc_blocks)
+        if _log_path:
+            _log(self.to_dict())
+        return self
+
+    def to_dict(self):
+        return {
+            "time": time.time(),
+            "kind": self.kind,
+            **self.labels,
+            "seconds": self.seconds,
+            "alloc_blocks": self.alloc_blocks,
+            "stages": [
+                {"stage": name, "seconds": seconds, "alloc_blocks": alloc_blocks}
+                for name, seconds, alloc_blocks in self.stages
+            ],
+        }
+
+
+def _count(kind, name, seconds, alloc_blocks):
+    entry = _totals.setdefault((kind, name), [0, 0.0, 0])
+    entry[0] += 1
+    entry[1] += seconds
+    entry[2] += alloc_blocks
+
+
+def _log(record):
+    line = json.dumps(record) + "\n"
+    with _lock:
+        if _log_path == "-":
+            sys.stderr.write(line)
+        else:
+            with open(_log_path, "a", encoding="utf-8") as file:
+                file.write(line)
+
+
+def start(kind, **labels):
+    """Open a run of ``kind`` ("rerun", "batch", ...) for this thread; None while off.
+
+    An unfinished run left open by this thread is finished first.
+    """
+    if not _enabled:
+        return None
+    previous = _current.get()
+    if previous is not None:
+        previous.finish()
+    run = Run(kind, labels)
+    _current.set(run)
+    return run
+
+
+class _Job:
+    __slots__ = ("kind", "labels", "run", "token")
+
+    def __init__(self, kind, labels):
+        self.kind = kind
+        self.labels = labels
+
+    def __enter__(self):
+        self.run = Run(self.kind, self.labels)
+        self.token = _current.set(self.run)
+        return self.run
+
+    def __exit__(self, *exc_info):
+        _current.reset(self.token)
+        self.run.finish()
+        return False
+
+
+def job(kind, **labels):
+    """Context manager running a batch job as a run of its own.
+
+    Inside another open run, such as an app rerun scoring an upload, the
+    job's stages join that run instead.
+    """
+    if not _enabled:
+        return _NOOP
+    run = _current.get()
+    if run is not None and run.seconds is None:
+        return _NOOP
+    return _Job(kind, labels)
+
+
+def current():
+    """This thread's latest run, finished or not."""
+    return _current.get()
+
+
+def stage(name):
+    """Context manager timing ``name`` within this thread's open run.
+
+    Outside a run, the stage is counted as a run of its own, of kind "other".
+    """
+    if not _enabled:
+        return _NOOP
+    run = _current.get()
+    if run is None or run.seconds is not None:
+        run = _Detached()
+    return _Stage(run, name)
+
+
+_END = object()
+
+
+def timed(iterable, name):
+    """``iterable``, timing the production of each item as stage ``name``."""
+    if not _enabled:
+        return iterable
+    return _timed(iter(iterable), name)
+
+
+def _timed(iterator, name):
+    while True:
+        with stage(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+class _Detached:
+    __slots__ = ()
+
+    def add(self, name, seconds, alloc_blocks):
+        with _lock:
+            _count("other", name, seconds, alloc_blocks)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text():
+    """The totals of every finished run, in the Prometheus text format."""
+    with _lock:
+        totals = sorted(_totals.items())
+    lines = []
+    for metric, column, kind_, help_ in (
+        ("carbon_runs_total", 0, "counter", "Finished runs."),
+        ("carbon_run_seconds_total", 1, "counter", "Wall time of finished runs."),
+        ("carbon_stage_calls_total", 0, "counter", "Times each stage ran."),
+        ("carbon_stage_seconds_total", 1, "counter", "Wall time spent in each stage."),
+        ("carbon_stage_alloc_blocks_total", 2, "counter", "Net memory blocks allocated in each stage."),
+    ):
+        lines.append(f"# HELP {metric} {help_}")
+        lines.append(f"# TYPE {metric} {kind_}")
+        per_run = metric.startswith("carbon_run")
+        for (kind, name), values in totals:
+            if (name == "") != per_run:
+                continue
+            labels = f'kind="{_escape(kind)}"' + ("" if per_run else f',stage="{_escape(name)}"')
+            lines.append(f"{metric}{{{labels}}} {values[column]}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve ``prometheus_text`` on ``/metrics`` from a background thread.
+
+    Only the first call in a process starts a server; returns it.
+    """
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=_server.serve_forever, name="carbon-metrics", daemon=True).start()
+    return _server
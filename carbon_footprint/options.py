@@ -0,0 +1,49 @@
+"""Choices offered by the app's input widgets.
+
+The Streamlit form and the bulk survey validation both read these, so a
+survey row is accepted exactly when the same inputs could be entered in the
+app. Lists keep the order shown in the widgets; the first entry is the
+default.
+"""
+from carbon_footprint.factors import CATEGORIES
+
+TRANSPORT_CATEGORIES = list(CATEGORIES)
+
+# Private vehicle labels and their keys in the emission factors
+VEHICLE_TYPES = {
+    "Two Wheeler": "two_wheeler",
+    "Three Wheeler": "three_wheeler",
+    "Four Wheeler": "four_wheeler",
+}
+TWO_WHEELER_CATEGORIES = ["Scooter", "Motorcycle"]
+CAR_TYPES = ["small", "hatchback", "premium_hatchback", "compact_suv", "sedan", "suv", "hybrid"]
+
+# Public transport labels and their keys in the emission factors
+PUBLIC_MODES = {"Taxi": "taxi", "Bus": "bus", "Metro": "metro"}
+TAXI_TYPES = ["small", "hatchback", "sedan", "suv"]
+
+FUEL_OPTIONS = {
+    "two_wheeler": ["petrol", "diesel", "electric"],
+    "three_wheeler": ["petrol", "diesel", "electric", "cng"],
+    "four_wheeler": ["petrol", "diesel", "cng", "electric"],
+    "hybrid": ["petrol", "diesel", "electric"],
+    "taxi": ["petrol", "diesel", "cng", "electric"],
+    "bus": ["diesel", "cng", "electric", "petrol"],
+}
+
+# Engine size widgets as (min, max, default) cc
+ENGINE_CC = {
+    "two_wheeler": (50, 1500, 150),
+    "three_wheeler": (50, 1000, 200),
+    "four_wheeler": (600, 4000, 1200),
+}
+
+# Largest number of people the rideshare sliders allow
+MAX_PEOPLE = {"two_wheeler": 2, "three_wheeler": 3, "four_wheeler": 5, "taxi": 4}
+
+# Commute detail widgets as (min, max)
+MIN_DISTANCE = 0.1
+DAYS_PER_WEEK = (1, 7)
+WEEKS_PER_MONTH = (1, 5)
+PRIVATE_TRIPS = (0, 10)
+TOTAL_TRIPS = (1, 10)
@@ -0,0 +1,147 @@
+"""Saved commute profiles for side-by-side comparison.
+
+Each user can save several named commutes in a local SQLite database.
+Results are cached in the database by a hash of the commute's inputs and
+the factor set's digest, so a comparison only calculates profiles that are
+new, whose inputs changed or whose factors were updated, and profiles with
+identical inputs share one result, whoever saved them.
+"""
+import datetime
+import hashlib
+import json
+
+from carbon_footprint.calculator import calculate_many, with_defaults
+from carbon_footprint.db import DEFAULT_POOL_SIZE, ConnectionPool
+from carbon_footprint.factorsets import active
+from carbon_footprint.validate import NUMBER_COLUMNS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    user TEXT NOT NULL,
+    name TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    inputs_key TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (user, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS profiles_inputs_key ON profiles (inputs_key);
+CREATE TABLE IF NOT EXISTS results (
+    inputs_key TEXT PRIMARY KEY,
+    result TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def canonical(inputs):
+    """``calculate`` inputs with defaults filled in and numbers as floats."""
+    row = with_defaults(inputs)
+    for name in NUMBER_COLUMNS:
+        try:
+            row[name] = float(row[name])
+        except (TypeError, ValueError):
+            pass
+    return row
+
+
+def inputs_key(row):
+    return hashlib.sha256(json.dumps(row, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def result_key(key, factor_set):
+    """Key of the cached result for ``inputs_key`` ``key`` under ``factor_set``."""
+    return f"{key}:{factor_set.digest}"
+
+
+class ProfileStore:
+    """Named commutes per user in the SQLite database at ``path``.
+
+    Safe to share between threads, such as Streamlit sessions.
+    """
+
+    def __init__(self, path, pool_size=DEFAULT_POOL_SIZE):
+        self.pool = ConnectionPool(path, SCHEMA, pool_size)
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _cache(self, db, rows, factor_set):
+        """Calculate and store results for ``{key: inputs}``; returns ``{key: result}``."""
+        results = dict(zip(rows, calculate_many(list(rows.values()), factor_set)))
+        db.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?)",
+            [(result_key(key, factor_set), json.dumps(result)) for key, result in results.items() if "error" not in result],
+        )
+        return results
+
+    def save(self, user, name, inputs, factor_set=None):
+        """Save or replace the profile ``name`` of ``user``.
+
+        Raises ValueError for inputs the app would not accept. Its result is
+        cached under ``factor_set``, the active one by default.
+        """
+        row = canonical(inputs)
+        key = inputs_key(row)
+        factor_set = factor_set or active()
+        with self.pool.transaction() as db:
+            if db.execute("SELECT 1 FROM results WHERE inputs_key = ?", (result_key(key, factor_set),)).fetchone() is None:
+                result = self._cache(db, {key: row}, factor_set)[key]
+                if "error" in result:
+                    raise ValueError(result["error"])
+            db.execute(
+                "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?, ?)",
+                (str(user), str(name), json.dumps(row), key, datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+
+    def delete(self, user, name):
+        with self.pool.transaction() as db:
+            db.execute("DELETE FROM profiles WHERE user = ? AND name = ?", (str(user), str(name)))
+
+    def names(self, user):
+        """Names of the profiles saved by ``user``, sorted."""
+        with self.pool.connection() as db:
+            rows = db.execute("SELECT name FROM profiles WHERE user = ? ORDER BY name", (str(user),)).fetchall()
+        return [name for name, in rows]
+
+    def compare(self, user, names=None, factor_set=None):
+        """Saved profiles of ``user`` with their results, sorted by name.
+
+        Each item has ``name``, ``inputs``, ``updated_at`` and ``result`` (a
+        ``calculate`` result, or ``{"error": message}`` for inputs the
+        calculator no longer accepts). Only profiles without a cached result
+        under ``factor_set`` (the active one by default) are calculated, all
+        in one batch. ``names`` limits the profiles compared.
+        """
+        factor_set = factor_set or active()
+        sql = """SELECT p.name, p.inputs, p.inputs_key, p.updated_at, r.result
+            FROM profiles p LEFT JOIN results r ON r.inputs_key = p.inputs_key || ':' || ?
+            WHERE p.user = ?"""
+        parameters = [factor_set.digest, str(user)]
+        if names is not None:
+            names = [str(name) for name in names]
+            if not names:
+                return []
+            sql += f" AND p.name IN ({', '.join('?' * len(names))})"
+            parameters += names
+        with self.pool.connection() as db:
+            rows = db.execute(sql + " ORDER BY p.name", parameters).fetchall()
+
+        missing = {key: json.loads(inputs) for _, inputs, key, _, result in rows if result is None}
+        computed = {}
+        if missing:
+            with self.pool.transaction() as db:
+                computed = self._cache(db, missing, factor_set)
+        return [
+            {
+                "name": name,
+                "inputs": json.loads(inputs),
+                "updated_at": updated_at,
+                "result": json.loads(result) if result is not None else computed[key],
+            }
+            for name, inputs, key, updated_at, result in rows
+        ]
@@ -0,0 +1,256 @@
+"""Sustainability rating and recommendations shown with the results.
+
+Recommendations come from ``RULES``, a table of conditions on a commute's
+columns. ``compile_rules`` turns the table into NumPy comparisons once, so a
+whole fleet is checked against every rule in one pass; ``recommendations``
+runs the same rules for a single commute. New rules only need a table entry.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from carbon_footprint import options
+from carbon_footprint.engine import PUBLIC, private_only, split_commute
+from carbon_footprint.factors import FUELS
+from carbon_footprint.factorsets import resolve
+from carbon_footprint.table import BASE, BUS, METRO
+
+RATINGS = ("Low", "Moderate", "High")
+# Monthly kg CO₂e where the rating goes up
+MODERATE_KG = 50
+HIGH_KG = 100
+# Car sharers the carpooling advice assumes, the commuter included
+CARPOOL_PEOPLE = 4
+
+# What produced the emissions, as the app labels it
+KINDS = tuple(options.VEHICLE_TYPES) + ("Public Transport", "Combined Transport")
+PUBLIC_KIND = KINDS.index("Public Transport")
+COMBINED_KIND = KINDS.index("Combined Transport")
+# No fuel chosen, as for public transport
+NO_FUEL = -1
+
+# Rule columns holding codes, with the labels rules use for them
+LABELS = {"kind": KINDS, "fuel": FUELS}
+
+# A condition's value may be another column, times ``scale``
+Column = namedtuple("Column", "name scale", defaults=(1.0,))
+
+# ``when`` holds (column, operator, value) conditions that must all hold.
+# ``saving`` names the column with the emissions after following the advice,
+# or is a fixed percentage; the message can then use ``{saving_pct}``.
+Rule = namedtuple("Rule", "id message when saving", defaults=((), None))
+
+RULES = (
+    Rule(
+        "high",
+        "Your carbon footprint from commuting is quite high. Consider switching to more sustainable transport options.",
+        (("emissions_kg", ">", HIGH_KG),),
+    ),
+    Rule(
+        "moderate",
+        "Your carbon footprint is moderate. There's room for improvement by considering more sustainable options.",
+        (("emissions_kg", ">", MODERATE_KG), ("emissions_kg", "<=", HIGH_KG)),
+    ),
+    Rule(
+        "low",
+        "Your carbon footprint is relatively low, but you can still make improvements.",
+        (("emissions_kg", "<=", MODERATE_KG),),
+    ),
+    Rule(
+        "carpool",
+        "Consider carpooling to reduce emissions. Sharing your ride with 3 other people could reduce your emissions by up to {saving_pct:.0f}%.",
+        (("kind", "==", "Four Wheeler"), ("people_count", "==", 1)),
+        100 * (1 - 1 / CARPOOL_PEOPLE),
+    ),
+    Rule(
+        "electric_vehicle",
+        "Consider switching to an electric vehicle to significantly reduce your carbon footprint.",
+        (("fuel", "in", ("petrol", "diesel")), ("kind", "!=", "Public Transport")),
+    ),
+    Rule(
+        "electric_bus",
+        "Using an electric bus could reduce your emissions by approximately {saving_pct:.1f}%.",
+        (("kind", "in", ("Four Wheeler", "Two Wheeler")), ("emissions_kg", ">", Column("electric_bus_kg", 2))),
+        "electric_bus_kg",
+    ),
+    Rule(
+        "metro",
+        "Using metro could reduce your emissions by approximately {saving_pct:.1f}%.",
+        (("kind", "in", ("Four Wheeler", "Two Wheeler")), ("emissions_kg", ">", Column("metro_kg", 2))),
+        "metro_kg",
+    ),
+)
+
+_OPERATORS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+    "in": np.isin,
+    "not in": lambda values, choices: np.isin(values, choices, invert=True),
+}
+
+
+def rating(total_emissions):
+    """Sustainability rating for monthly emissions in kg CO₂e."""
+    return RATINGS[int(min(2, total_emissions / MODERATE_KG))]
+
+
+def _code(column, value):
+    labels = LABELS.get(column)
+    if labels is None:
+        return value
+    if isinstance(value, tuple):
+        return np.array([labels.index(label) for label in value])
+    return labels.index(value)
+
+
+def compile_rules(rules=RULES):
+    """Compile a rule table into ``(rule, conditions)`` pairs.
+
+    Labels are swapped for codes and operators for NumPy functions up front;
+    a typo in a rule raises here rather than when scoring.
+    """
+    compiled = []
+    for rule in rules:
+        conditions = []
+        for column, operator, value in rule.when:
+            if not isinstance(value, Column):
+                value = _code(column, value)
+            conditions.append((column, _OPERATORS[operator], value))
+        compiled.append((rule, conditions))
+    return compiled
+
+
+COMPILED_RULES = compile_rules()
+
+
+def rule_columns(emissions_kg, monthly_km, kind, people_count, fuel, table=None):
+    """Columns the rules read, for arrays of commutes.
+
+    ``kind`` holds ``KINDS`` codes and ``fuel`` ``FUELS`` codes, ``NO_FUEL``
+    where none was chosen. ``people_count`` is 1 unless the emissions come
+    from a shared private vehicle alone.
+    """
+    emissions_kg = np.asarray(emissions_kg, dtype=np.float64)
+    monthly_km = np.asarray(monthly_km, dtype=np.float64)
+    table = resolve(table)
+    return {
+        "emissions_kg": emissions_kg,
+        "monthly_km": monthly_km,
+        "kind": np.asarray(kind),
+        "people_count": np.asarray(people_count),
+        "fuel": np.asarray(fuel),
+        "electric_bus_kg": monthly_km * table.params[BUS, 0, FUELS.index("electric"), BASE],
+        "metro_kg": monthly_km * table.params[METRO, 0, 0, BASE],
+    }
+
+
+def profile_rule_columns(profiles, emissions_kg, monthly_km, table=None):
+    """``rule_columns`` for engine profiles, labelled the way the app does."""
+    category = profiles["category"]
+    kind = np.where(
+        category == PUBLIC,
+        PUBLIC_KIND,
+        np.where(split_commute(category, profiles["private_ratio"]), COMBINED_KIND, profiles["vehicle"]),
+    )
+    return rule_columns(
+        emissions_kg,
+        monthly_km,
+        kind,
+        np.where(private_only(category, profiles["private_ratio"]), profiles["people_count"], 1),
+        np.where(category == PUBLIC, NO_FUEL, profiles["fuel"]),
+        table,
+    )
+
+
+def evaluate(columns, compiled=COMPILED_RULES):
+    """Which commutes each rule applies to.
+
+    Returns ``{rule id: (mask, saving_pct)}``; ``saving_pct`` is None for
+    rules without a saving.
+    """
+    results = {}
+    for rule, conditions in compiled:
+        mask = np.ones(len(columns["emissions_kg"]), dtype=bool)
+        for column, operator, value in conditions:
+            if isinstance(value, Column):
+                value = columns[value.name] * value.scale
+            mask &= operator(columns[column], value)
+        saving_pct = None
+        if isinstance(rule.saving, str):
+            emissions_kg = columns["emissions_kg"]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                saving_pct = (emissions_kg - columns[rule.saving]) / emissions_kg * 100
+        elif rule.saving is not None:
+            saving_pct = np.full(len(mask), float(rule.saving))
+        results[rule.id] = (mask, saving_pct)
+    return results
+
+
+def advice(results, i, compiled=COMPILED_RULES):
+    """The rules applying to commute ``i`` of ``evaluate`` results, as ``(bits, savings)``.
+
+    Bit n of ``bits`` is set when rule n of ``compiled`` applies, and
+    ``savings`` has the ``saving_pct`` of those with a saving, in order.
+    ``advice_messages`` formats the texts from them.
+    """
+    bits = 0
+    savings = []
+    for position, (rule, _) in enumerate(compiled):
+        mask, saving_pct = results[rule.id]
+        if mask[i]:
+            bits |= 1 << position
+            if saving_pct is not None:
+                savings.append(float(saving_pct[i]))
+    return bits, tuple(savings)
+
+
+def advice_messages(bits, savings, compiled=COMPILED_RULES):
+    """Recommendation texts for ``advice`` codes."""
+    texts = []
+    savings = iter(savings)
+    for position, (rule, _) in enumerate(compiled):
+        if bits >> position & 1:
+            texts.append(rule.message.format(saving_pct=next(savings) if rule.saving is not None else None))
+    return texts
+
+
+def messages(results, i, compiled=COMPILED_RULES):
+    """Recommendation texts for commute ``i`` of ``evaluate`` results."""
+    return advice_messages(*advice(results, i, compiled), compiled)
+
+
+def rule_ids(results):
+    """``;``-separated ids of the rules applying to each commute."""
+    ids = list(results)
+    # One bit per rule; each distinct combination is formatted once
+    bits = np.zeros(len(next(iter(results.values()))[0]), dtype=np.int64)
+    for position, (mask, _) in enumerate(results.values()):
+        bits |= mask.astype(np.int64) << position
+    combinations, inverse = np.unique(bits, return_inverse=True)
+    labels = np.array(
+        [";".join(rule_id for position, rule_id in enumerate(ids) if combination >> position & 1) for combination in combinations.tolist()],
+        dtype=object,
+    )
+    return labels[inverse.reshape(-1)]
+
+
+def recommendations(total_emissions, total_monthly_km, vehicle_type, people_count, fuel_type=None, table=None):
+    """Recommendations for one commute.
+
+    ``vehicle_type`` is the app's label for what produced the emissions:
+    "Two Wheeler", "Three Wheeler", "Four Wheeler", "Public Transport" or
+    "Combined Transport". ``fuel_type`` is None when no fuel was chosen.
+    """
+    columns = rule_columns(
+        [total_emissions],
+        [total_monthly_km],
+        [KINDS.index(vehicle_type)],
+        [people_count],
+        [FUELS.index(fuel_type) if fuel_type is not None else NO_FUEL],
+        table,
+    )
+    return messages(evaluate(columns), 0)
@@ -0,0 +1,400 @@
+"""Per-employee footprint reports for a whole survey, in one zip archive.
+
+Each accepted row gets a folder ``reports/<id>/`` with ``report.html`` (the
+emissions, rating, comparison chart and recommendations, as in the app) and
+``report.csv`` (the comparison options). Charts are inline SVG by default,
+so no extra dependency is needed; ``images="png"`` adds ``chart.png`` through
+Plotly and kaleido instead. ``summary.csv`` lists every row, with the error
+for rejected ones.
+
+Chunks are rendered across a process pool and written into the archive as
+they finish, so memory holds only the chunks in flight. Every
+``CHECKPOINT_SECONDS``, and when a run fails, the archive is closed between
+chunks and its directory saved in ``<archive>.progress.json``; a run that
+failed or was killed resumes from the last checkpoint, with that directory
+put back after the entries it lists.
+"""
+import base64
+import csv
+import html
+import io
+import json
+import math
+import os
+import re
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from carbon_footprint import instrument
+from carbon_footprint.calculator import calculate_many
+from carbon_footprint.charts import emissions_color
+from carbon_footprint.validate import NUMBER_COLUMNS, SURVEY_COLUMNS
+
+DEFAULT_CHUNKSIZE = 1000
+DEFAULT_ID_COLUMN = "employee_id"
+# Longest stretch of work a resumed run may have to redo, in seconds
+CHECKPOINT_SECONDS = 10
+FORMATS = ("html", "csv")
+IMAGES = ("svg", "png", "none")
+SUMMARY_COLUMNS = ("id", "report", "monthly_km", "emissions_kg", "rating", "vehicle_name", "error")
+
+# Bar colours from low to high emissions, as in the app's comparison chart
+_SCALE = ((26, 152, 80), (254, 224, 139), (215, 48, 39))
+
+
+def _color(fraction):
+    position = min(max(fraction, 0.0), 1.0) * (len(_SCALE) - 1)
+    low = min(int(position), len(_SCALE) - 2)
+    weight = position - low
+    channels = (round(a + (b - a) * weight) for a, b in zip(_SCALE[low], _SCALE[low + 1]))
+    return "#{:02x}{:02x}{:02x}".format(*channels)
+
+
+def svg_chart(comparison, width=640, bar=26):
+    """Horizontal bar chart of ``{option: monthly kg}`` as an SVG string."""
+    items = sorted(comparison.items(), key=lambda item: item[1])
+    largest = max((value for _, value in items), default=0) or 1
+    smallest = min((value for _, value in items), default=0)
+    label_width, value_width = 260, 70
+    scale = (width - label_width - value_width) / largest
+    height = bar * len(items) + 10
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="12">'
+    ]
+    for i, (label, value) in enumerate(items):
+        y = 5 + i * bar
+        fraction = (value - smallest) / (largest - smallest) if largest > smallest else 0.0
+        parts.append(
+            f'<text x="{label_width - 6}" y="{y + bar * 0.65:.1f}" text-anchor="end">{html.escape(label)}</text>'
+            f'<rect x="{label_width}" y="{y + 3}" width="{value * scale:.1f}" height="{bar - 6}" fill="{_color(fraction)}"/>'
+            f'<text x="{label_width + value * scale + 4:.1f}" y="{y + bar * 0.65:.1f}">{value:.1f}</text>'
+        )
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def render_html(employee, result, chart):
+    """The HTML report of one employee; ``chart`` is inline SVG or an <img> tag."""
+    kg = result["emissions_kg"]
+    recommendations = "".join(f"<li>{html.escape(text)}</li>" for text in result["recommendations"])
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Commute footprint: {html.escape(employee)}</title>
+<style>
+body {{ font-family: sans-serif; max-width: 720px; margin: 2em auto; color: #222; }}
+.kg {{ font-size: 2em; font-weight: bold; }}
+.rating {{ font-size: 1.2em; color: {emissions_color(kg)}; }}
+footer {{ color: #777; font-size: 0.8em; margin-top: 2em; }}
+</style>
+</head>
+<body>
+<h1>Commute footprint: {html.escape(employee)}</h1>
+<p>{html.escape(result["vehicle_name"])}, {result["monthly_km"]:.1f} km a month</p>
+<p class="kg">{kg:.1f} kg CO₂e a month</p>
+<p class="rating"><strong>Sustainability rating:</strong> {result["rating"]}</p>
+<h2>Comparison with alternative transport options</h2>
+{chart}
+<h2>Recommendations</h2>
+<ol>{recommendations}</ol>
+<footer>Emission factors: version {html.escape(result["factor_version"])}</footer>
+</body>
+</html>
+"""
+
+
+def render_csv(result):
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(("option", "monthly_kg_co2e"))
+    writer.writerows(result["comparison"].items())
+    return out.getvalue()
+
+
+def _inputs(record):
+    # Blank cells stay blank, so rows are validated exactly as by process_file
+    inputs = {}
+    for name in SURVEY_COLUMNS:
+        value = record.get(name)
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            value = math.nan if name in NUMBER_COLUMNS else ""
+        inputs[name] = value
+    return inputs
+
+
+def _render_chunk(records, ids, formats, images, factor_set):
+    """Render one chunk; returns ``(id, result, {file name: content})`` per row."""
+    rendered = []
+    with instrument.stage("calculate"):
+        results = calculate_many([_inputs(record) for record in records], factor_set)
+    with instrument.stage("render"):
+        for employee, result in zip(ids, results):
+            files = {}
+            if "error" not in result:
+                if images == "png":
+                    from carbon_footprint import charts
+
+                    files["chart.png"] = charts.comparison(result["comparison"]).to_image(format="png")
+                    chart = '<img src="chart.png" alt="Comparison with alternative transport options">'
+                elif images == "svg":
+                    chart = svg_chart(result["comparison"])
+                else:
+                    chart = ""
+                if "html" in formats:
+                    files["report.html"] = render_html(employee, result, chart)
+                if "csv" in formats:
+                    files["report.csv"] = render_csv(result)
+            rendered.append((employee, result, files))
+    return rendered
+
+
+def _folder(employee):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", employee).strip("._") or "employee"
+
+
+def _exists(zf, name):
+    try:
+        zf.getinfo(name)
+    except KeyError:
+        return False
+    return True
+
+
+class _Progress:
+    """Checkpoints of a report run in ``<archive>.progress.json``.
+
+    The partial summary is kept next to it in ``<archive>.summary.csv``
+    until the run completes.
+    """
+
+    def __init__(self, archive, settings):
+        self.path = f"{archive}.progress.json"
+        self.summary_path = f"{archive}.summary.csv"
+        self.settings = settings
+
+    def load(self):
+        """The last checkpoint, if there is one for the same run; ValueError for another run's."""
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                state = json.load(handle)
+        except FileNotFoundError:
+            return None
+        if state["settings"] != self.settings:
+            raise ValueError(f"{self.path} belongs to a run with other settings; restart to start over")
+        return state
+
+    def save(self, rows, reports, rejected, entries_size, directory, summary_size):
+        state = {
+            "settings": self.settings,
+            "rows": rows,
+            "reports": reports,
+            "rejected": rejected,
+            "entries_size": entries_size,
+            "directory": base64.b64encode(directory).decode("ascii"),
+            "summary_size": summary_size,
+        }
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            json.dump(state, handle)
+        os.replace(temporary, self.path)
+
+    def clear(self):
+        for path in (self.path, self.summary_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+class _ReportWriter:
+    """Rendered reports into the archive, and rows into the partial summary.
+
+    The archive stays open between chunks. Closing it writes its directory,
+    which makes a checkpoint; since that rewrites the whole directory, it
+    is done at most every ``CHECKPOINT_SECONDS``. The next chunk is written
+    over that directory, so the checkpoint keeps a copy of it.
+    """
+
+    def __init__(self, archive, progress, state):
+        self.archive = archive
+        self.progress = progress
+        self.rows = self.reports = self.rejected = 0
+        if state is not None:
+            self.rows, self.reports, self.rejected = state["rows"], state["reports"], state["rejected"]
+        self.zf = zipfile.ZipFile(archive, "a", zipfile.ZIP_DEFLATED)
+        self.summary = open(progress.summary_path, "a", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.summary)
+        self.checkpointed = time.monotonic()
+        self.writing = False
+
+    def write(self, rendered):
+        self.writing = True
+        with instrument.stage("write"):
+            for employee, result, files in rendered:
+                folder = ""
+                if files:
+                    folder = _folder(employee)
+                    if _exists(self.zf, f"reports/{folder}/{next(iter(files))}"):
+                        folder = f"{folder}-{self.rows}"
+                    for name, content in files.items():
+                        self.zf.writestr(f"reports/{folder}/{name}", content)
+                    self.reports += 1
+                if "error" in result:
+                    self.rejected += 1
+                    self.writer.writerow((employee, "", "", "", "", "", result["error"]))
+                else:
+                    self.writer.writerow((
+                        employee, f"reports/{folder}/" if folder else "", result["monthly_km"],
+                        result["emissions_kg"], result["rating"], result["vehicle_name"], "",
+                    ))
+                self.rows += 1
+        self.writing = False
+        if time.monotonic() - self.checkpointed >= CHECKPOINT_SECONDS:
+            with instrument.stage("checkpoint"):
+                self.checkpoint()
+            self.zf = zipfile.ZipFile(self.archive, "a", zipfile.ZIP_DEFLATED)
+
+    def checkpoint(self):
+        # Where close() writes the directory, after the last entry
+        entries_size = self.zf.start_dir
+        self.zf.close()
+        with open(self.archive, "rb") as handle:
+            handle.seek(entries_size)
+            directory = handle.read()
+        self.summary.flush()
+        self.progress.save(
+            self.rows, self.reports, self.rejected,
+            entries_size, directory, os.path.getsize(self.progress.summary_path),
+        )
+        self.checkpointed = time.monotonic()
+
+    def abandon(self):
+        """Checkpoint what was written, so a new run resumes after it.
+
+        A chunk left half written isn't checkpointed; a new run resumes
+        from the checkpoint before it.
+        """
+        if not self.writing:
+            self.checkpoint()
+        self.summary.close()
+
+    def finish(self):
+        self.summary.close()
+        self.zf.write(self.progress.summary_path, "summary.csv")
+        self.zf.close()
+
+
+def _restore(archive, progress, state, files):
+    """Put the archive and summary back as they were at the checkpoint ``state``.
+
+    ``files`` are the names in each report folder. ValueError if the
+    restored archive isn't the one the checkpoint describes.
+    """
+    with open(archive, "r+b") as handle:
+        handle.truncate(state["entries_size"])
+        handle.seek(state["entries_size"])
+        handle.write(base64.b64decode(state["directory"]))
+    with open(progress.summary_path, "r+b") as handle:
+        handle.truncate(state["summary_size"])
+    with open(progress.summary_path, newline="", encoding="utf-8") as handle:
+        folders = [row["report"] for row in csv.DictReader(handle) if row["report"]]
+    expected = {folder + name for folder in folders for name in files}
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            if zf.testzip() is None and set(zf.namelist()) == expected:
+                return
+    # A damaged entry fails its CRC check, or doesn't inflate at all
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        pass
+    raise ValueError(f"{archive} doesn't match its checkpoint in {progress.path}; restart to start over")
+
+
+def build_reports(source, archive, id_column=DEFAULT_ID_COLUMN, formats=FORMATS, images="svg",
+                  chunksize=DEFAULT_CHUNKSIZE, input_format=None, workers=1, restart=False, factor_set=None):
+    """Write a report for every row of the survey ``source`` into the zip file ``archive``.
+
+    Rows are named by ``id_column``, or by row number if the survey has no
+    such column. ``formats`` picks from ``FORMATS`` and ``images`` from
+    ``IMAGES``. ``workers`` processes render the chunks (None or 0 for all
+    cores). An unfinished earlier run into ``archive`` is resumed unless
+    ``restart``. Returns the number of rows, reports and rejected rows and
+    the factor set's label.
+    """
+    from carbon_footprint.factorsets import active
+    from carbon_footprint.ingest import read_chunks
+
+    formats = tuple(formats)
+    for name in formats:
+        if name not in FORMATS:
+            raise ValueError(f"Unknown report format {name!r}, expected one of {FORMATS}")
+    if images not in IMAGES:
+        raise ValueError(f"Unknown image type {images!r}, expected one of {IMAGES}")
+    if images == "png":
+        try:
+            import kaleido  # noqa: F401
+        except ImportError:
+            raise ImportError("PNG charts need kaleido: pip install kaleido") from None
+    factor_set = factor_set or active()
+
+    settings = {
+        "source": os.path.abspath(source),
+        "id_column": id_column,
+        "formats": list(formats),
+        "images": images,
+        "chunksize": chunksize,
+        "factor_version": factor_set.label,
+    }
+    progress = _Progress(archive, settings)
+    if restart:
+        progress.clear()
+    state = progress.load()
+    if state is not None:
+        # Drop whatever was written after the last checkpoint
+        files = [f"report.{name}" for name in formats] + (["chart.png"] if images == "png" else [])
+        _restore(archive, progress, state, files)
+    else:
+        with zipfile.ZipFile(archive, "w"):
+            pass
+        with open(progress.summary_path, "w", newline="", encoding="utf-8") as handle:
+            csv.writer(handle).writerow(SUMMARY_COLUMNS)
+    out = _ReportWriter(archive, progress, state)
+    done = out.rows
+
+    def chunks():
+        start = 0
+        for chunk in read_chunks(source, chunksize, input_format, [id_column]):
+            end = start + len(chunk)
+            if end > done:
+                chunk = chunk.iloc[max(done - start, 0):]
+                if id_column in chunk:
+                    ids = ["" if value != value else str(value) for value in chunk[id_column].tolist()]
+                else:
+                    ids = [str(row) for row in range(max(done, start), end)]
+                yield chunk.to_dict("records"), ids
+            start = end
+
+    workers = workers or os.cpu_count() or 1
+    with instrument.job("batch", job="build_reports"):
+        try:
+            if workers == 1:
+                for records, ids in instrument.timed(chunks(), "read"):
+                    out.write(_render_chunk(records, ids, formats, images, factor_set))
+            else:
+                with ProcessPoolExecutor(workers) as pool:
+                    pending = []
+                    for records, ids in instrument.timed(chunks(), "read"):
+                        pending.append(pool.submit(_render_chunk, records, ids, formats, images, factor_set))
+                        if len(pending) >= 2 * workers:
+                            out.write(pending.pop(0).result())
+                    for future in pending:
+                        out.write(future.result())
+        except BaseException:
+            out.abandon()
+            raise
+        out.finish()
+    progress.clear()
+    return {"rows": out.rows, "reports": out.reports, "rejected": out.rejected, "factor_version": factor_set.label}
@@ -0,0 +1,326 @@
+"""What-if scenarios over every transport option the app can express.
+
+The scenario cube crosses every private vehicle (type × size × fuel × engine
+size bucket × people sharing) and every public mode (taxi type × fuel ×
+people sharing, bus fuel, metro) at several private/public trip ratios.
+Emissions are monthly km times a per-km factor, so the cube's factors are
+computed once per process and a commuter's emissions under every scenario
+are a single multiplication.
+
+``optimize`` finds the lowest-emission scenario for one commute and
+``sweep`` does the same for a whole fleet across a process pool.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import lru_cache
+
+import numpy as np
+
+from carbon_footprint import factorsets, options
+from carbon_footprint.engine import BOTH, PRIVATE, PROFILE_FIELDS, PUBLIC, monthly_km, profile_columns, score
+from carbon_footprint.factors import FUEL_CODES, FUELS, SIZE_CODES, SIZES, VEHICLE_CODES, VEHICLES
+from carbon_footprint.factorsets import active
+
+# Engine sizes tried for each private vehicle type, within the app's ranges
+CC_BUCKETS = {
+    "two_wheeler": (100, 150, 300, 600, 1000, 1500),
+    "three_wheeler": (50, 200, 400, 700, 1000),
+    "four_wheeler": (800, 1200, 1600, 2000, 3000, 4000),
+}
+# Private share of daily trips tried for combined commutes
+RATIOS = (0.25, 0.5, 0.75)
+
+PRIVATE_LEG = ("vehicle", "size", "fuel", "engine_cc", "people_count")
+PUBLIC_LEG = ("public_mode", "public_size", "public_fuel", "public_people")
+SCENARIO_FIELDS = ("category",) + PRIVATE_LEG + PUBLIC_LEG + ("private_ratio",)
+DTYPES = {name: dtype for name, dtype, _ in PROFILE_FIELDS}
+
+DEFAULT_CHUNKSIZE = 50_000
+
+
+def _columns(rows, names):
+    return {name: np.array(values, dtype=DTYPES[name]) for name, values in zip(names, zip(*rows))}
+
+
+def private_legs():
+    """Every private vehicle configuration the app offers, at the cc buckets."""
+    rows = []
+    for key in options.VEHICLE_TYPES.values():
+        if key == "two_wheeler":
+            sizes = options.TWO_WHEELER_CATEGORIES
+        elif key == "four_wheeler":
+            sizes = options.CAR_TYPES
+        else:
+            sizes = [""]
+        for size in sizes:
+            fuels = options.FUEL_OPTIONS["hybrid" if size == "hybrid" else key]
+            for fuel in fuels:
+                for cc in CC_BUCKETS[key]:
+                    for people in range(1, options.MAX_PEOPLE[key] + 1):
+                        rows.append((VEHICLE_CODES[key], SIZE_CODES[size], FUEL_CODES[fuel], cc, people))
+    return _columns(rows, PRIVATE_LEG)
+
+
+def public_legs():
+    """Every public transport configuration the app offers."""
+    rows = []
+    for size in options.TAXI_TYPES:
+        for fuel in options.FUEL_OPTIONS["taxi"]:
+            for people in range(1, options.MAX_PEOPLE["taxi"] + 1):
+                rows.append((VEHICLE_CODES["taxi"], SIZE_CODES[size], FUEL_CODES[fuel], people))
+    for fuel in options.FUEL_OPTIONS["bus"]:
+        rows.append((VEHICLE_CODES["bus"], 0, FUEL_CODES[fuel], 1))
+    rows.append((VEHICLE_CODES["metro"], 0, 0, 1))
+    return _columns(rows, PUBLIC_LEG)
+
+
+def build_cube(private, public, ratios=RATIOS, table=None):
+    """Scenario columns for private-only, public-only and combined commutes.
+
+    Includes a ``factor`` column with the per-km emission factor of each
+    scenario, computed with the same engine as every other result.
+    """
+    n_private = len(private["vehicle"])
+    n_public = len(public["public_mode"])
+    n_mixed = n_private * n_public * len(ratios)
+    n = n_private + n_public + n_mixed
+
+    cube = {name: np.zeros(n, dtype=DTYPES[name]) for name in SCENARIO_FIELDS}
+    cube["people_count"][:] = 1
+    cube["public_people"][:] = 1
+    cube["public_mode"][:] = VEHICLE_CODES["metro"]
+
+    mixed = slice(n_private + n_public, n)
+    cube["category"][:n_private] = PRIVATE
+    cube["category"][n_private:mixed.start] = PUBLIC
+    cube["category"][mixed] = BOTH
+    cube["private_ratio"][:n_private] = 1.0
+    cube["private_ratio"][mixed] = np.tile(np.asarray(ratios, dtype=np.float64), n_private * n_public)
+    for name in PRIVATE_LEG:
+        cube[name][:n_private] = private[name]
+        cube[name][mixed] = np.repeat(private[name], n_public * len(ratios))
+    for name in PUBLIC_LEG:
+        cube[name][n_private:mixed.start] = public[name]
+        cube[name][mixed] = np.tile(np.repeat(public[name], len(ratios)), n_private)
+
+    # One km a month (0.5 km each way, one day, one week) gives the factor itself
+    unit = {"distance": np.full(n, 0.5), "days_per_week": np.ones(n, np.int64), "weeks_per_month": np.ones(n, np.int64)}
+    cube["factor"] = score({**unit, **cube}, table)
+    return cube
+
+
+def cube(ratios=RATIOS, factor_set=None):
+    """The full scenario cube, built once per process and factor set."""
+    return _cube(tuple(ratios), _digest(factor_set or active()))
+
+
+def _digest(factor_set):
+    """Key of ``factor_set`` in the caches below.
+
+    They look the set up by its digest among the loaded sets rather than
+    keep it, so a replaced set is released as ``factorsets.KEEP_LOADED``
+    intends. A set passed in after it was released is loaded again.
+    """
+    with factorsets._loaded_lock:
+        factorsets._loaded.setdefault(factor_set.digest, factor_set)
+    return factor_set.digest
+
+
+@lru_cache(maxsize=4)
+def _cube(ratios, digest):
+    return build_cube(private_legs(), public_legs(), ratios, factorsets._loaded[digest].table)
+
+
+def _feasible(scenarios, max_public_legs, max_rideshare, exclude):
+    category = scenarios["category"]
+    uses_private = category != PUBLIC
+    uses_public = category != PRIVATE
+    mask = np.ones(len(category), dtype=bool)
+    if max_public_legs is not None and max_public_legs < 1:
+        mask &= ~uses_public
+    if max_rideshare is not None:
+        mask &= ~uses_private | (scenarios["people_count"] <= max_rideshare)
+        mask &= ~uses_public | (scenarios["public_people"] <= max_rideshare)
+    for name in exclude:
+        code = VEHICLE_CODES[name]
+        mask &= ~(uses_private & (scenarios["vehicle"] == code))
+        mask &= ~(uses_public & (scenarios["public_mode"] == code))
+    return mask
+
+
+@lru_cache(maxsize=65536)
+def _best(own_vehicle, ratios, digest, max_public_legs, no_new_vehicle, max_rideshare, exclude):
+    """Lowest-factor feasible scenario as ``(factor, scenario values)``.
+
+    Cached on the parts of a profile that change which scenarios are
+    feasible; monthly distance only scales the result, so it isn't part of the
+    key. ``own_vehicle`` is ``(vehicle, size, fuel, engine_cc)``, or None for
+    commuters without a private vehicle.
+    """
+    scenarios = _cube(ratios, digest)
+    if no_new_vehicle:
+        # Only public legs from the cube, plus the commuter's own vehicle
+        # shared by any number of people
+        public_only = {name: values[scenarios["category"] == PUBLIC] for name, values in scenarios.items()}
+        if own_vehicle is not None:
+            vehicle, size, fuel, engine_cc = own_vehicle
+            people = np.arange(1, options.MAX_PEOPLE[VEHICLES[vehicle]] + 1)
+            own = {
+                "vehicle": np.full(len(people), vehicle, dtype=DTYPES["vehicle"]),
+                "size": np.full(len(people), size, dtype=DTYPES["size"]),
+                "fuel": np.full(len(people), fuel, dtype=DTYPES["fuel"]),
+                "engine_cc": np.full(len(people), engine_cc, dtype=DTYPES["engine_cc"]),
+                "people_count": people.astype(DTYPES["people_count"]),
+            }
+            with_own = build_cube(own, public_legs(), ratios, factorsets._loaded[digest].table)
+            scenarios = {name: np.concatenate([public_only[name], with_own[name]]) for name in public_only}
+        else:
+            scenarios = public_only
+
+    mask = _feasible(scenarios, max_public_legs, max_rideshare, exclude)
+    if not mask.any():
+        return None
+    candidates = np.flatnonzero(mask)
+    best = candidates[np.argmin(scenarios["factor"][candidates])]
+    return float(scenarios["factor"][best]), tuple(scenarios[name][best].item() for name in SCENARIO_FIELDS)
+
+
+def _sweep_chunk(profiles, ratios, factor_set, constraints):
+    n = len(profiles["distance"])
+    km = monthly_km(profiles["distance"], profiles["days_per_week"], profiles["weeks_per_month"])
+
+    if constraints["no_new_vehicle"]:
+        # One integer key per distinct own vehicle; -1 for public-only commuters
+        has_vehicle = profiles["category"] != PUBLIC
+        cc_values, cc_codes = np.unique(profiles["engine_cc"], return_inverse=True)
+        vehicle = (profiles["vehicle"].astype(np.int64) * len(SIZES) + profiles["size"]) * len(FUELS) + profiles["fuel"]
+        key = np.where(has_vehicle, vehicle * len(cc_values) + cc_codes.reshape(-1), -1)
+        keys, inverse = np.unique(key, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        own_vehicles = []
+        for value in keys.tolist():
+            if value < 0:
+                own_vehicles.append(None)
+                continue
+            vehicle, cc = divmod(value, len(cc_values))
+            vehicle, fuel = divmod(vehicle, len(FUELS))
+            vehicle, size = divmod(vehicle, len(SIZES))
+            own_vehicles.append((vehicle, size, fuel, float(cc_values[cc])))
+    else:
+        # Without vehicle constraints every commuter shares the same optimum
+        own_vehicles, inverse = [None], np.zeros(n, dtype=np.intp)
+
+    # Best scenario per key, then gathered for every commuter
+    factor = np.full(len(own_vehicles), np.nan)
+    best = {name: np.zeros(len(own_vehicles), dtype=DTYPES[name]) for name in SCENARIO_FIELDS}
+    digest = _digest(factor_set)
+    for index, own_vehicle in enumerate(own_vehicles):
+        found = _best(own_vehicle, ratios, digest, **constraints)
+        if found is not None:
+            factor[index] = found[0]
+            for name, value in zip(SCENARIO_FIELDS, found[1]):
+                best[name][index] = value
+
+    return {
+        "current_kg": score(profiles, factor_set.table),
+        "best_kg": km * factor[inverse],
+        "feasible": ~np.isnan(factor)[inverse],
+        **{"best_" + name: values[inverse] for name, values in best.items()},
+    }
+
+
+def sweep(profiles, ratios=RATIOS, max_public_legs=None, no_new_vehicle=False, max_rideshare=None,
+          exclude=(), workers=None, chunksize=DEFAULT_CHUNKSIZE, factor_set=None):
+    """Lowest-emission feasible scenario for every commute in ``profiles``.
+
+    ``profiles`` are engine columns as for ``engine.score``. Constraints:
+    ``max_public_legs=0`` keeps commuters off public transport,
+    ``no_new_vehicle`` only allows the commuter's current private vehicle
+    (or none), ``max_rideshare`` caps the people sharing a vehicle and
+    ``exclude`` names vehicle classes to leave out (e.g. ``("metro",)``).
+
+    Returns columns ``current_kg``, ``best_kg``, ``feasible`` and
+    ``best_<field>`` with the chosen scenario in engine codes. Chunks are
+    spread over ``workers`` processes (all cores by default; 1 runs inline).
+    ``factor_set`` defaults to the active one.
+    """
+    profiles = profile_columns(profiles)
+    factor_set = factor_set or active()
+    constraints = {
+        "max_public_legs": max_public_legs,
+        "no_new_vehicle": bool(no_new_vehicle),
+        "max_rideshare": max_rideshare,
+        "exclude": tuple(sorted(exclude)),
+    }
+    n = len(profiles["distance"])
+    chunks = [
+        {name: values[start:start + chunksize] for name, values in profiles.items()}
+        for start in range(0, max(n, 1), chunksize)
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) == 1:
+        parts = [_sweep_chunk(chunk, tuple(ratios), factor_set, constraints) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(min(workers, len(chunks))) as pool:
+            parts = list(pool.map(
+                _sweep_chunk, chunks, [tuple(ratios)] * len(chunks), [factor_set] * len(chunks), [constraints] * len(chunks)
+            ))
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def describe(scenario):
+    """``calculate`` inputs for one scenario given as ``{field: code}``."""
+    category = int(scenario["category"])
+    inputs = {"transport_category": options.TRANSPORT_CATEGORIES[category]}
+    if category != PUBLIC:
+        vehicle_key = VEHICLES[int(scenario["vehicle"])]
+        inputs["vehicle_type"] = next(label for label, key in options.VEHICLE_TYPES.items() if key == vehicle_key)
+        if vehicle_key != "three_wheeler":
+            inputs["vehicle_category"] = SIZES[int(scenario["size"])]
+        inputs["fuel_type"] = FUELS[int(scenario["fuel"])]
+        inputs["engine_cc"] = int(scenario["engine_cc"]) if float(scenario["engine_cc"]).is_integer() else float(scenario["engine_cc"])
+        inputs["people_count"] = int(scenario["people_count"])
+    if category != PRIVATE:
+        mode_key = VEHICLES[int(scenario["public_mode"])]
+        inputs["public_mode"] = next(label for label, key in options.PUBLIC_MODES.items() if key == mode_key)
+        if mode_key == "taxi":
+            inputs["taxi_type"] = SIZES[int(scenario["public_size"])]
+            inputs["public_people_count"] = int(scenario["public_people"])
+        if mode_key != "metro":
+            inputs["public_fuel_type"] = FUELS[int(scenario["public_fuel"])]
+    if category == BOTH:
+        ratio = Fraction(float(scenario["private_ratio"])).limit_denominator(options.TOTAL_TRIPS[1])
+        inputs["private_trips"] = ratio.numerator
+        inputs["total_trips"] = ratio.denominator
+    return inputs
+
+
+def optimize(inputs, ratios=RATIOS, max_public_legs=None, no_new_vehicle=False, max_rideshare=None, exclude=(),
+             factor_set=None):
+    """Lowest-emission feasible alternative to one commute.
+
+    ``inputs`` are ``calculate`` arguments; constraints are as for
+    ``sweep``. Returns the current and best monthly kg CO₂e and the best
+    scenario as ``calculate`` inputs, or None for ``best`` when the
+    constraints rule everything out, and the factor set's label.
+    """
+    from carbon_footprint.calculator import encode_commutes
+
+    profiles, errors = encode_commutes([inputs])
+    if errors[0]:
+        raise ValueError(errors[0])
+    factor_set = factor_set or active()
+    result = sweep(profiles, ratios, max_public_legs, no_new_vehicle, max_rideshare, exclude, workers=1, factor_set=factor_set)
+    best = None
+    if result["feasible"][0]:
+        best = describe({name: result["best_" + name][0] for name in SCENARIO_FIELDS})
+        best.update(distance=inputs.get("distance", 10.0), days_per_week=inputs.get("days_per_week", 5),
+                    weeks_per_month=inputs.get("weeks_per_month", 4))
+    return {
+        "current_kg": float(result["current_kg"][0]),
+        "best_kg": float(result["best_kg"][0]),
+        "saving_kg": float(result["current_kg"][0] - result["best_kg"][0]),
+        "best": best,
+        "factor_version": factor_set.label,
+    }
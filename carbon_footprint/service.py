@@ -0,0 +1,208 @@
+"""Local JSON HTTP scoring service.
+
+Built on asyncio streams from the standard library, so it runs anywhere the
+package does. Requests that arrive close together are coalesced into one
+vectorized ``calculate_many`` call.
+
+Endpoints:
+
+- ``GET /health``
+- ``GET /metrics``: stage timings in the Prometheus text format, when
+  ``carbon_footprint.instrument`` is on
+- ``POST /calculate``: one commute as a JSON object of ``calculate``
+  arguments; responds with the result, or 400 and ``{"error": ...}``
+- ``POST /calculate/batch``: a JSON list of commutes; responds with a list
+  of results or errors, in order
+"""
+import asyncio
+import json
+
+from carbon_footprint import instrument
+from carbon_footprint.calculator import calculate_many
+
+DEFAULT_MAX_BATCH_SIZE = 256
+DEFAULT_MAX_WAIT = 0.002  # seconds
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class MicroBatcher:
+    """Coalesce concurrent submissions into batched calls of ``handler``.
+
+    ``handler`` takes a list of items and returns a list of results in the
+    same order. A batch is run as soon as it holds ``max_batch_size`` items,
+    or once the first item in it has waited ``max_wait`` seconds. If the
+    handler raises for a batch, its items are run one at a time, so only
+    the submissions that fail get the exception.
+    """
+
+    def __init__(self, handler, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.timer = None
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            with instrument.job("batch", job="service", size=len(batch)):
+                results = self.handler([item for item, _ in batch])
+        except Exception as exc:
+            if len(batch) == 1:
+                self.fail(batch, exc)
+                return
+            # One bad item mustn't fail the others coalesced with it
+            for entry in batch:
+                try:
+                    self.deliver([entry], self.handler([entry[0]]))
+                except Exception as item_exc:
+                    self.fail([entry], item_exc)
+            return
+        self.deliver(batch, results)
+
+    @staticmethod
+    def deliver(batch, results):
+        # Futures of clients that went away are already cancelled
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def fail(batch, exc):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+
+class Service:
+    def __init__(self, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+        self.batcher = MicroBatcher(calculate_many, max_batch_size, max_wait)
+
+    async def route(self, method, path, body):
+        """Return ``(status, payload)`` for one request."""
+        path = path.split("?", 1)[0]
+        if path == "/health":
+            if method != "GET":
+                return 405, {"error": "Use GET"}
+            return 200, {"status": "ok"}
+        if path == "/metrics":
+            if method != "GET":
+                return 405, {"error": "Use GET"}
+            return 200, instrument.prometheus_text()
+        if path not in ("/calculate", "/calculate/batch"):
+            return 404, {"error": f"No endpoint {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST"}
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400, {"error": "Request body must be JSON"}
+
+        if path == "/calculate":
+            if not isinstance(data, dict):
+                return 400, {"error": "Request body must be a JSON object"}
+            result = await self.batcher.submit(data)
+            return (400 if "error" in result else 200), result
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            return 400, {"error": "Request body must be a JSON list of objects"}
+        # Large lists would hold up every other connection on the event loop
+        loop = asyncio.get_running_loop()
+        return 200, await loop.run_in_executor(None, calculate_many, data)
+
+    async def handle(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection, with keep-alive."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY_SIZE:
+                    await self.respond(writer, 413 if length > 0 else 400, {"error": "Bad Content-Length"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as exc:
+                    status, payload = 500, {"error": f"{type(exc).__name__}: {exc}"}
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        # Text payloads are Prometheus metrics; everything else is JSON
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+async def serve(host="127.0.0.1", port=8000, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+    service = Service(max_batch_size, max_wait)
+    server = await asyncio.start_server(service.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def run(host="127.0.0.1", port=8000, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait=DEFAULT_MAX_WAIT):
+    """Run the service until interrupted."""
+    try:
+        asyncio.run(serve(host, port, max_batch_size, max_wait))
+    except KeyboardInterrupt:
+        pass
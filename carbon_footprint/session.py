@@ -0,0 +1,162 @@
+"""Compact per-session results for the app.
+
+Streamlit keeps each session's state for as long as the session lives, so
+with hundreds of sessions in one process, the size of that state decides how
+many fit. ``Commute`` holds one commute's inputs and results as numbers and
+codes. Labels, recommendation texts and figures are made from it when shown,
+and the factor table is the factor set's, shared by every session. A scored
+survey is kept as ``SurveyResults``, with the results in a temporary file.
+"""
+import math
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+from carbon_footprint.alternatives import ALTERNATIVES, alternatives, rank
+from carbon_footprint.engine import monthly_km
+from carbon_footprint.factors import FUELS
+from carbon_footprint.ingest import process_file
+from carbon_footprint.recommend import (
+    COMBINED_KIND, KINDS, NO_FUEL, PUBLIC_KIND, advice, advice_messages, evaluate, rating, rule_columns,
+)
+
+_INPUTS = (
+    "distance", "days_per_week", "weeks_per_month", "emission_factor",
+    "kind", "fuel", "people_count", "vehicle_name", "factor_set",
+)
+
+
+def commute_alternatives(km, kind, fuel, people_count, table):
+    """Monthly kg CO₂e of each of ``ALTERNATIVES`` for one commute, NaN where one doesn't apply."""
+    values = alternatives(
+        np.array([km]),
+        np.array([kind]),
+        np.array([fuel]),
+        np.array([people_count]),
+        np.array([kind not in (PUBLIC_KIND, COMBINED_KIND)]),
+        table,
+    )
+    return np.array([values[label][0] for label in ALTERNATIVES])
+
+
+class Commute:
+    """One commute's inputs and results, as numbers and codes.
+
+    ``kind`` is a ``recommend.KINDS`` code and ``fuel`` a ``FUELS`` code, or
+    ``NO_FUEL``. ``alternatives`` has the monthly kg CO₂e of each of
+    ``alternatives.ALTERNATIVES``, NaN where one doesn't apply, and
+    ``rules`` and ``savings`` are ``recommend.advice`` codes. Results are
+    None until ``set`` is first called.
+    """
+
+    __slots__ = _INPUTS + ("monthly_km", "emissions_kg", "alternatives", "rules", "savings")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+    def set(self, distance, days_per_week, weeks_per_month, emission_factor, vehicle_type, vehicle_name,
+            people_count, fuel_type, factor_set):
+        """Set the inputs; only the results that depend on changed ones are recomputed.
+
+        ``vehicle_type`` is the app's label for what produced the emissions and
+        ``fuel_type`` None when no fuel was chosen. Returns whether any input
+        changed.
+        """
+        inputs = (
+            distance, days_per_week, weeks_per_month, emission_factor,
+            KINDS.index(vehicle_type), FUELS.index(fuel_type) if fuel_type is not None else NO_FUEL,
+            people_count, vehicle_name, factor_set,
+        )
+        changed = set()
+        for name, value in zip(_INPUTS, inputs):
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+                changed.add(name)
+
+        # Each result is recomputed when one it depends on changed; a result
+        # that comes out the same doesn't make the ones after it recompute
+        if changed & {"distance", "days_per_week", "weeks_per_month"}:
+            km = monthly_km(distance, days_per_week, weeks_per_month)
+            if km != self.monthly_km:
+                self.monthly_km = km
+                changed.add("monthly_km")
+        if changed & {"monthly_km", "emission_factor"}:
+            kg = self.monthly_km * emission_factor
+            if kg != self.emissions_kg:
+                self.emissions_kg = kg
+                changed.add("emissions_kg")
+        km, kg, kind, fuel = self.monthly_km, self.emissions_kg, self.kind, self.fuel
+        if changed & {"monthly_km", "kind", "fuel", "people_count", "factor_set"}:
+            self.alternatives = commute_alternatives(km, kind, fuel, people_count, factor_set.table)
+        if changed & {"monthly_km", "emissions_kg", "kind", "fuel", "people_count", "factor_set"}:
+            columns = rule_columns([kg], [km], [kind], [people_count], [fuel], factor_set.table)
+            self.rules, self.savings = advice(evaluate(columns), 0)
+        return bool(changed)
+
+    @property
+    def vehicle_type(self):
+        return KINDS[self.kind]
+
+    @property
+    def fuel_type(self):
+        return FUELS[self.fuel] if self.fuel != NO_FUEL else None
+
+    def rating(self):
+        return rating(self.emissions_kg)
+
+    def comparison(self):
+        """The commute's emissions and those of the alternatives, by label, as the app shows them.
+
+        The commute comes first; an alternative with the same label replaces it.
+        """
+        result = {self.vehicle_name: self.emissions_kg}
+        for label, value in zip(ALTERNATIVES, self.alternatives.tolist()):
+            if not math.isnan(value):
+                result[label] = value
+        return result
+
+    def rank(self):
+        """``(n, m)``: the commute is the nth cleanest of the m options compared."""
+        n, m = rank(self.emissions_kg, self.alternatives)
+        return int(n), int(m)
+
+    def recommendations(self):
+        return advice_messages(self.rules, self.savings)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class SurveyResults:
+    """A scored survey: ``process_file``'s summary, and ``path`` to the results as CSV.
+
+    The file is deleted once nothing refers to this any more, as when the
+    session holding it ends.
+    """
+
+    __slots__ = ("summary", "path", "__weakref__")
+
+    def __init__(self, summary, path):
+        self.summary = summary
+        self.path = path
+        weakref.finalize(self, _remove, path)
+
+
+def score_survey(source, **options):
+    """Score the survey ``source`` into a temporary CSV file, with ``process_file``'s options."""
+    handle, path = tempfile.mkstemp(prefix="commute_emissions-", suffix=".csv")
+    os.close(handle)
+    try:
+        summary = process_file(source, path, output_format="csv", **options)
+    except BaseException:
+        _remove(path)
+        raise
+    return SurveyResults(summary, path)
+
@@ -0,0 +1,159 @@
+"""Dense, integer-coded form of the nested emission factor dict.
+
+``compile_factors`` turns the nested dict into arrays indexed by
+``[vehicle, size, fuel]`` codes so that resolving factors for millions of rows
+is a single fancy-index gather. Factors that depend on engine size are also
+precomputed for every whole cc in the range offered by the app's sliders.
+``carbon_footprint.factorsets`` compiles and caches the active factor set.
+"""
+import numpy as np
+
+from carbon_footprint.factors import FUELS, SIZES, VEHICLES
+
+TWO_WHEELER, THREE_WHEELER, FOUR_WHEELER, TAXI, BUS, METRO = range(len(VEHICLES))
+ELECTRIC = FUELS.index("electric")
+
+# Index of each parameter along the last axis of FactorTable.params
+MIN, MAX, BASE, UPLIFT = range(4)
+
+# Engine size ranges (cc) offered by the app, per vehicle class
+CC_RANGES = {
+    TWO_WHEELER: (50, 1500),
+    THREE_WHEELER: (50, 1000),
+    FOUR_WHEELER: (600, 4000),
+}
+
+
+def per_km(vehicle, fuel, params, engine_cc):
+    """Per-km factor from vehicle and fuel codes and gathered ``params``."""
+    vehicle = np.asarray(vehicle)
+    fuel = np.asarray(fuel)
+    engine_cc = np.asarray(engine_cc, dtype=np.float64)
+    min_ef, max_ef, base, uplift = np.moveaxis(np.asarray(params, dtype=np.float64), -1, 0)
+
+    with np.errstate(invalid="ignore"):
+        # Linear interpolation on engine size, 150-1500cc for two wheelers
+        # and 50-1000cc for three wheelers
+        two = min_ef + np.clip((engine_cc - 150) / 1350, 0.0, 1.0) * (max_ef - min_ef)
+        three = min_ef + np.clip((engine_cc - 50) / 950, 0.0, 1.0) * (max_ef - min_ef)
+        # Larger engines emit up to 50% more; electric doesn't scale with engine size
+        engine_factor = np.where(
+            fuel == ELECTRIC, 1.0, 1.0 + np.minimum(1.0, (engine_cc - 600) / 3400) * 0.5
+        )
+        four = base * uplift * engine_factor
+        taxi = base * uplift
+
+    return np.select(
+        [vehicle == TWO_WHEELER, vehicle == THREE_WHEELER, vehicle == FOUR_WHEELER, vehicle == TAXI],
+        [two, three, four, taxi],
+        default=base,
+    )
+
+
+class FactorTable:
+    """Emission factors as read-only arrays indexed by ``[vehicle, size, fuel]``.
+
+    ``params`` holds (min, max, base, uplift) with NaN where a combination or
+    parameter does not exist. ``flat`` holds the final factor for vehicles that
+    don't depend on engine size. For the others, ``curves`` is one flat buffer
+    of precomputed factors; a combination's curve starts at ``curve_start``
+    and covers ``curve_lo``..``curve_hi`` cc in steps of 1cc.
+    """
+
+    __slots__ = ("params", "flat", "curve_start", "curve_lo", "curve_hi", "curves")
+
+    def __init__(self, params, flat, curve_start, curve_lo, curve_hi, curves):
+        self.params = params
+        self.flat = flat
+        self.curve_start = curve_start
+        self.curve_lo = curve_lo
+        self.curve_hi = curve_hi
+        self.curves = curves
+        for name in self.__slots__:
+            getattr(self, name).setflags(write=False)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__slots__)
+
+    def per_km(self, vehicle, size, fuel, engine_cc):
+        """Per-km factor for arrays of codes; NaN where no factor exists."""
+        vehicle, size, fuel, engine_cc = np.broadcast_arrays(
+            np.asarray(vehicle, dtype=np.intp),
+            np.asarray(size, dtype=np.intp),
+            np.asarray(fuel, dtype=np.intp),
+            np.asarray(engine_cc, dtype=np.float64),
+        )
+        shape = vehicle.shape
+        vehicle, size, fuel, engine_cc = (a.ravel() for a in (vehicle, size, fuel, engine_cc))
+        out = self.flat[vehicle, size, fuel]
+        lo = self.curve_lo[vehicle, size, fuel]
+        hi = self.curve_hi[vehicle, size, fuel]
+
+        on_curve = (engine_cc >= lo) & (engine_cc <= hi) & (engine_cc == np.floor(engine_cc))
+        start = self.curve_start[vehicle, size, fuel][on_curve]
+        out[on_curve] = self.curves[start + (engine_cc[on_curve] - lo[on_curve]).astype(np.intp)]
+
+        # Fractional or out-of-range engine sizes fall back to the formula
+        off_curve = (hi >= lo) & ~on_curve
+        if off_curve.any():
+            v, s, f = vehicle[off_curve], size[off_curve], fuel[off_curve]
+            out[off_curve] = per_km(v, f, self.params[v, s, f], engine_cc[off_curve])
+        return out.reshape(shape)
+
+
+def compile_factors(emission_factors):
+    """Compile the nested factor dict into a ``FactorTable``."""
+    params = np.full((len(VEHICLES), len(SIZES), len(FUELS), 4), np.nan)
+
+    def fill(vehicle, size, fuel, leaf):
+        try:
+            index = VEHICLES.index(vehicle), SIZES.index(size), FUELS.index(fuel)
+        except ValueError:
+            raise ValueError(f"Unknown emission factor key in {vehicle}/{size}/{fuel}") from None
+        if isinstance(leaf, dict):
+            for name, column in (("min", MIN), ("max", MAX), ("base", BASE), ("uplift", UPLIFT)):
+                if name in leaf:
+                    params[index + (column,)] = leaf[name]
+        else:
+            params[index + (BASE,)] = leaf
+
+    for size, fuels in emission_factors["two_wheeler"].items():
+        for fuel, leaf in fuels.items():
+            fill("two_wheeler", size, fuel, leaf)
+    for fuel, leaf in emission_factors["three_wheeler"].items():
+        fill("three_wheeler", "", fuel, leaf)
+    for size, fuels in emission_factors["four_wheeler"].items():
+        for fuel, leaf in fuels.items():
+            fill("four_wheeler", size, fuel, leaf)
+    public = emission_factors["public_transport"]
+    for size, fuels in public["taxi"].items():
+        for fuel, leaf in fuels.items():
+            fill("taxi", size, fuel, leaf)
+    for fuel, value in public["bus"].items():
+        fill("bus", "", fuel, value)
+    # Metro doesn't depend on fuel, every fuel code resolves to the same factor
+    for fuel in FUELS:
+        fill("metro", "", fuel, public["metro"])
+
+    defined = ~np.isnan(params).all(axis=-1)
+    vehicle, size, fuel = np.indices(defined.shape)
+    flat = np.where(defined, per_km(vehicle, fuel, params, 0.0), np.nan)
+
+    curve_start = np.zeros(defined.shape, dtype=np.int64)
+    curve_lo = np.ones(defined.shape, dtype=np.int64)
+    curve_hi = np.zeros(defined.shape, dtype=np.int64)
+    curves = []
+    offset = 0
+    for v, (lo, hi) in CC_RANGES.items():
+        cc = np.arange(lo, hi + 1, dtype=np.float64)
+        flat[v] = np.nan
+        for s, f in zip(*np.nonzero(defined[v])):
+            curves.append(per_km(v, f, params[v, s, f], cc))
+            curve_start[v, s, f] = offset
+            curve_lo[v, s, f] = lo
+            curve_hi[v, s, f] = hi
+            offset += len(cc)
+
+    return FactorTable(params, flat, curve_start, curve_lo, curve_hi, np.concatenate(curves))
+
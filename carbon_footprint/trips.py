@@ -0,0 +1,332 @@
+"""Trips made of any number of legs.
+
+The app describes a combined commute as one private and one public mode
+blended by ``private_trips / total_trips``. Here a trip is a sequence of
+legs, each with its own vehicle, size, fuel, engine size, distance and
+occupancy, such as GPS traces split into car, metro and taxi legs.
+
+Legs of all trips are kept in flat arrays (``LEG_FIELDS``) with ``offsets``
+marking where each trip starts, as in compressed sparse rows: trip ``i`` is
+legs ``offsets[i]:offsets[i + 1]``. Per-trip figures are segmented
+reductions over those arrays, so tens of millions of legs cost a few bytes
+each instead of a Python object per leg.
+"""
+import numpy as np
+
+from carbon_footprint import instrument, options
+from carbon_footprint.engine import PUBLIC, factors, private_only, profile_columns, split_commute
+from carbon_footprint.factors import FUELS, SIZES, VEHICLE_CODES, VEHICLES
+
+# Leg columns as (name, dtype, default), as for engine profiles
+LEG_FIELDS = (
+    ("vehicle", np.int8, None),
+    ("size", np.int8, 0),
+    ("fuel", np.int8, 0),
+    ("engine_cc", np.float64, 0),
+    ("km", np.float64, None),
+    ("people", np.int64, 1),
+)
+
+# Columns of a legs file, one row per leg, grouped by trip
+LEG_COLUMNS = ("mode", "size", "fuel", "engine_cc", "km", "people")
+TRIP_RESULT_COLUMNS = ("legs", "km", "emissions_kg", "main_mode", "error", "factor_version")
+DEFAULT_TRIP_COLUMN = "trip_id"
+
+
+def leg_columns(legs):
+    """``legs`` as a dict of arrays with every column in ``LEG_FIELDS``."""
+    cols = {}
+    for name, dtype, default in LEG_FIELDS:
+        if default is None or name in legs:
+            cols[name] = np.asarray(legs[name], dtype=dtype)
+    n = len(cols["km"])
+    for name, dtype, default in LEG_FIELDS:
+        if name not in cols:
+            cols[name] = np.full(n, default, dtype=dtype)
+    return cols
+
+
+class Trips:
+    """Legs of many trips as flat arrays plus offsets.
+
+    ``legs`` maps the ``LEG_FIELDS`` names to arrays with one entry per leg,
+    holding the codes defined in ``carbon_footprint.factors``. Trip ``i`` is
+    legs ``offsets[i]:offsets[i + 1]``; a trip may have no legs.
+    """
+
+    __slots__ = ("legs", "offsets")
+
+    def __init__(self, legs, offsets):
+        self.legs = leg_columns(legs)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        if (
+            self.offsets.ndim != 1
+            or not len(self.offsets)
+            or self.offsets[0] != 0
+            or self.offsets[-1] != len(self.legs["km"])
+            or np.any(np.diff(self.offsets) < 0)
+        ):
+            raise ValueError("offsets must rise from 0 to the number of legs")
+
+    @classmethod
+    def from_lengths(cls, legs, lengths):
+        """Trips of ``lengths[i]`` consecutive legs each."""
+        return cls(legs, np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]))
+
+    @classmethod
+    def from_ids(cls, legs, trip_ids):
+        """Trips from legs listed trip by trip, with each leg's trip id.
+
+        Returns ``(trips, ids)`` with the id of each trip. A trip whose legs
+        are not next to each other counts as separate trips.
+        """
+        trip_ids = np.asarray(trip_ids)
+        starts = np.flatnonzero(trip_ids[1:] != trip_ids[:-1]) + 1
+        starts = np.concatenate([[0], starts]) if len(trip_ids) else starts
+        return cls(legs, np.append(starts, len(trip_ids))), trip_ids[starts]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        """Number of legs of each trip."""
+        return np.diff(self.offsets)
+
+    def leg_trip(self):
+        """Trip index of each leg."""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def sum(self, values):
+        """Per-trip sums of an array with one value per leg."""
+        values = np.asarray(values, dtype=np.float64)
+        # Not reduceat, which can't give a trip without legs an empty segment
+        totals = np.bincount(self.leg_trip(), weights=values, minlength=len(self))
+        return totals.astype(np.float64, copy=False)
+
+    def first(self, mask):
+        """Index of each trip's first leg in ``mask``, -1 where there is none."""
+        mask = np.asarray(mask, dtype=bool)
+        n = len(self.legs["km"])
+        first = np.full(len(self), n)
+        np.minimum.at(first, self.leg_trip()[mask], np.flatnonzero(mask))
+        return np.where(first < n, first, -1)
+
+
+def leg_emissions(trips, table=None):
+    """kg CO₂e of each leg, shared between its people; NaN without a factor."""
+    legs = trips.legs
+    return legs["km"] * factors(legs["vehicle"], legs["size"], legs["fuel"], legs["engine_cc"], table) / legs["people"]
+
+
+def summarize(trips, table=None):
+    """Per-trip ``legs``, ``km``, ``emissions_kg`` and ``main_vehicle``.
+
+    ``main_vehicle`` is the vehicle code of the trip's longest leg, -1 for a
+    trip without legs. A leg without an emission factor makes its trip's
+    emissions NaN.
+    """
+    legs = trips.legs
+    lengths = trips.lengths
+    main_vehicle = np.full(len(trips), -1, dtype=np.int64)
+    if len(legs["km"]):
+        # Sort legs by distance within each trip; the last of each is the longest
+        order = np.lexsort((legs["km"], trips.leg_trip()))
+        has_legs = lengths > 0
+        main_vehicle[has_legs] = legs["vehicle"][order[trips.offsets[1:][has_legs] - 1]]
+    return {
+        "legs": lengths,
+        "km": trips.sum(legs["km"]),
+        "emissions_kg": trips.sum(leg_emissions(trips, table)),
+        "main_vehicle": main_vehicle,
+    }
+
+
+def from_profiles(profiles):
+    """One-way trips for engine profiles, as ``score`` rates them.
+
+    Combined commutes become a private and a public leg splitting the
+    distance by ``private_ratio``; other commutes are a single leg. As in the
+    app, sharing only counts for combined commutes. Summed emissions times
+    ``monthly_km(1, days_per_week, weeks_per_month)`` match ``score`` up to
+    rounding.
+    """
+    cols = profile_columns(profiles)
+    category = cols["category"]
+    split = split_commute(category, cols["private_ratio"])
+    private = private_only(category, cols["private_ratio"]) | split
+    public = (category == PUBLIC) | split
+    lengths = private.astype(np.int64) + public
+    # Each profile's private leg, if any, comes before its public leg
+    first = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    private_at, public_at = first[private], first[public] + private[public]
+
+    n = int(lengths.sum())
+    legs = {name: np.zeros(n, dtype=dtype) for name, dtype, _ in LEG_FIELDS}
+    ratio = np.where(split, cols["private_ratio"], 1.0)
+    for at, rows, vehicle, size, fuel, engine_cc, people, km in (
+        (private_at, private, "vehicle", "size", "fuel", cols["engine_cc"], cols["people_count"], cols["distance"] * ratio),
+        (public_at, public, "public_mode", "public_size", "public_fuel", 0.0, cols["public_people"], cols["distance"] * (1 - ratio)),
+    ):
+        legs["vehicle"][at] = cols[vehicle][rows]
+        legs["size"][at] = cols[size][rows]
+        legs["fuel"][at] = cols[fuel][rows]
+        legs["engine_cc"][at] = np.broadcast_to(engine_cc, rows.shape)[rows]
+        legs["people"][at] = np.where(split, people, 1)[rows]
+        legs["km"][at] = np.where(category == PUBLIC, cols["distance"], km)[rows]
+    return Trips.from_lengths(legs, lengths)
+
+
+def _labels(chunk, name, names):
+    """Codes of a label column in ``names``, -1 where it isn't one; blank is ""."""
+    if name not in chunk:
+        return np.full(len(chunk), list(names).index("") if "" in names else -1, dtype=np.int64)
+    inverse, uniques = chunk[name].factorize()
+    names = list(names)
+    positions = np.array([names.index(u) if u in names else -1 for u in (str(value).strip() for value in uniques)] + [names.index("") if "" in names else -1])
+    return positions[inverse]
+
+
+def encode_legs(chunk, table=None):
+    """Validate a legs DataFrame chunk (``LEG_COLUMNS``) into leg columns.
+
+    Returns ``(legs, errors)``; ``errors`` holds the problem with each leg
+    and "" for accepted legs. A blank ``fuel`` only suits metro, and a blank
+    ``engine_cc`` takes the app's default engine size; others must be in the
+    range of ``options.ENGINE_CC``.
+    """
+    import pandas as pd
+
+    n = len(chunk)
+    errors = np.full(n, "", dtype=object)
+
+    def reject(mask, message):
+        errors[mask & (errors == "")] = message
+
+    def number(name, default):
+        if name not in chunk:
+            return np.full(n, default, dtype=np.float64)
+        values = pd.to_numeric(chunk[name], errors="coerce").to_numpy(np.float64)
+        return np.where(np.isnan(values), default, values)
+
+    vehicle = _labels(chunk, "mode", VEHICLES)
+    reject(vehicle < 0, "mode must be one of " + ", ".join(VEHICLES))
+    size = _labels(chunk, "size", SIZES)
+    reject(size < 0, "size must be blank or one of " + ", ".join(SIZES[1:]))
+    fuel = _labels(chunk, "fuel", FUELS + ("",))
+    reject(fuel < 0, "fuel must be one of " + ", ".join(FUELS))
+    km = number("km", np.nan)
+    reject(~(km >= 0) | np.isinf(km), "km must be a number of at least 0")
+    people = number("people", 1)
+    reject(~(people >= 1) | (people != np.floor(people)), "people must be a whole number of at least 1")
+    default_cc = np.zeros(len(VEHICLES))
+    for key, (_, _, cc) in options.ENGINE_CC.items():
+        default_cc[VEHICLE_CODES[key]] = cc
+    engine_cc = number("engine_cc", np.nan)
+    engine_cc = np.where(np.isnan(engine_cc), default_cc[np.maximum(vehicle, 0)], engine_cc)
+    # Engine sizes the app's widgets allow; other modes don't use one
+    for key, (low, high, _) in options.ENGINE_CC.items():
+        mode = vehicle == VEHICLE_CODES[key]
+        reject(mode & ~((engine_cc >= low) & (engine_cc <= high)), f"engine_cc must be from {low} to {high} for {key}")
+
+    valid = errors == ""
+    legs = {
+        "vehicle": np.where(valid, vehicle, 0).astype(np.int8),
+        "size": np.where(valid, size, 0).astype(np.int8),
+        # A blank fuel picks code 0, which only metro has a factor for
+        "fuel": np.where(valid & (fuel < len(FUELS)), fuel, 0).astype(np.int8),
+        "engine_cc": np.where(valid, engine_cc, 0.0),
+        "km": np.where(valid, km, 0.0),
+        "people": np.where(valid, people, 1).astype(np.int64),
+    }
+    blank_fuel = valid & (fuel == len(FUELS)) & (vehicle != VEHICLE_CODES["metro"])
+    reject(blank_fuel, "fuel must be one of " + ", ".join(FUELS))
+    no_factor = np.isnan(factors(legs["vehicle"], legs["size"], legs["fuel"], legs["engine_cc"], table))
+    reject(no_factor, "no emission factor for this mode, size and fuel")
+    return legs, errors
+
+
+def read_trips(source, trip_column=DEFAULT_TRIP_COLUMN, chunksize=None, format=None):
+    """Yield chunks of a legs file that each hold whole trips.
+
+    Legs of a trip must be on consecutive rows. A trip cut off by the end
+    of a chunk is held back and joined to the next one.
+    """
+    import pandas as pd
+
+    from carbon_footprint.ingest import DEFAULT_CHUNKSIZE, read_chunks
+
+    tail = None
+    for chunk in read_chunks(source, chunksize or DEFAULT_CHUNKSIZE, format, LEG_COLUMNS + (trip_column,)):
+        if trip_column not in chunk:
+            raise ValueError(f"Legs file has no column {trip_column!r}")
+        if tail is not None:
+            chunk = pd.concat([tail, chunk], ignore_index=True)
+        ids = chunk[trip_column].to_numpy()
+        # Rows from the start of the last trip on may continue in the next chunk
+        last = len(ids) - 1
+        while last > 0 and ids[last - 1] == ids[-1]:
+            last -= 1
+        tail = chunk.iloc[last:]
+        if last:
+            yield chunk.iloc[:last]
+    if tail is not None and len(tail):
+        yield tail
+
+
+def score_trips(chunk, trip_column=DEFAULT_TRIP_COLUMN, factor_set=None):
+    """Score a chunk of legs, returning one row per trip.
+
+    Trips with an invalid leg are rejected with the first problem in
+    ``error``. ``factor_set`` defaults to the active one.
+    """
+    import pandas as pd
+
+    from carbon_footprint.factorsets import active
+
+    factor_set = factor_set or active()
+    legs, errors = encode_legs(chunk, factor_set.table)
+    trips, ids = Trips.from_ids(legs, chunk[trip_column].to_numpy())
+    result = summarize(trips, factor_set.table)
+    first_error = trips.first(errors != "")
+    rejected = first_error >= 0
+    out = pd.DataFrame({trip_column: ids, "legs": result["legs"]})
+    out["km"] = np.where(rejected, np.nan, result["km"])
+    out["emissions_kg"] = np.where(rejected, np.nan, result["emissions_kg"])
+    names = np.array(VEHICLES + ("",), dtype=object)
+    out["main_mode"] = np.where(rejected, "", names[result["main_vehicle"]])
+    out["error"] = np.where(rejected, errors[np.maximum(first_error, 0)] if len(errors) else "", "")
+    out["factor_version"] = factor_set.label
+    return out
+
+
+def process_trips(source, destination, trip_column=DEFAULT_TRIP_COLUMN, chunksize=None, input_format=None,
+                  output_format=None, factor_set=None):
+    """Score a legs file chunk by chunk and write one row per trip.
+
+    Paths, file objects and formats work as for ``ingest.process_file``.
+    Returns the number of legs and trips read and of trips rejected, and
+    the factor set's label. The whole file uses the same factor set.
+    """
+    from carbon_footprint.factorsets import active
+    from carbon_footprint.ingest import _format, _CsvWriter, _ParquetWriter
+
+    factor_set = factor_set or active()
+    if _format(destination, output_format) == "parquet":
+        writer = _ParquetWriter(destination)
+    else:
+        writer = _CsvWriter(destination)
+    legs = trips = rejected = 0
+    with instrument.job("batch", job="process_trips"):
+        try:
+            for chunk in instrument.timed(read_trips(source, trip_column, chunksize, input_format), "read"):
+                with instrument.stage("score"):
+                    result = score_trips(chunk, trip_column, factor_set)
+                with instrument.stage("write"):
+                    writer.write(result)
+                legs += len(chunk)
+                trips += len(result)
+                rejected += int((result["error"] != "").sum())
+        finally:
+            writer.close()
+    return {"legs": legs, "trips": trips, "rejected": rejected, "factor_version": factor_set.label}
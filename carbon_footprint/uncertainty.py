@@ -0,0 +1,131 @@
+"""Monte Carlo uncertainty bands for monthly emissions.
+
+The app turns each factor range into one point: two and three wheelers are
+interpolated on engine size between ``min`` and ``max``, and cars and taxis
+apply a point ``uplift``. Here those points become distributions:
+
+- the position within a ``min``/``max`` range is triangular on [0, 1],
+  peaking at the app's interpolated position;
+- the real-world uplift over the base factor is triangular between none and
+  twice the stored uplift, peaking at the stored value.
+
+Bus and metro factors are single values and stay fixed. Each draw picks one
+value per factor table entry and applies it to every commuter using that
+entry, so a fleet's total carries the shared uncertainty instead of averaging
+it away. Samples are generated a block of commuters at a time, and only
+percentiles and per-draw fleet totals are kept.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from carbon_footprint.engine import commute_factor, monthly_km, profile_columns
+from carbon_footprint.factorsets import active, resolve
+from carbon_footprint.table import MAX, MIN, UPLIFT, per_km
+
+PERCENTILES = (5, 50, 95)
+DEFAULT_DRAWS = 10_000
+# Samples held per block of commuters (draws × rows)
+SAMPLE_BUDGET = 1_000_000
+
+# Parameters that turn per_km into the position within a min/max range
+_UNIT_RANGE = np.array([0.0, 1.0, np.nan, np.nan])
+
+
+def percentile_columns(percentiles=PERCENTILES):
+    return [f"p{p:g}_kg" for p in percentiles]
+
+
+@lru_cache(maxsize=4)
+def _uniforms(draws, seed, cells):
+    # Two uniforms per draw and factor table entry: range position and uplift
+    uniforms = np.random.default_rng(seed).random((draws, cells, 2))
+    uniforms.setflags(write=False)
+    return uniforms
+
+
+def _triangular(u, mode):
+    """Inverse CDF of the triangular distribution on [0, 1]."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(u < mode, np.sqrt(u * mode), 1 - np.sqrt((1 - u) * (1 - mode)))
+
+
+def sample_factors(vehicle, size, fuel, engine_cc, uniforms, table=None):
+    """Per-km factors of shape (draws, rows) for arrays of codes.
+
+    ``uniforms`` has shape (draws, table entries, 2), one row of random numbers
+    per factor table entry. NaN where no factor exists, as in ``factors``.
+    """
+    table = resolve(table)
+    vehicle, size, fuel, engine_cc = np.broadcast_arrays(vehicle, size, fuel, np.asarray(engine_cc, dtype=np.float64))
+    cell = np.ravel_multi_index((vehicle, size, fuel), table.params.shape[:3])
+    # Rows mostly share a handful of vehicles; sample each distinct one once
+    keys, first, inverse = np.unique(
+        np.stack([cell.astype(np.float64), engine_cc], axis=1), axis=0, return_index=True, return_inverse=True
+    )
+    vehicle, fuel, engine_cc = vehicle[first], fuel[first], engine_cc[first]
+    params = table.params.reshape(-1, 4)[cell[first]]
+    u = uniforms[:, cell[first]]
+
+    # Sample the range position around the app's point, then collapse the
+    # range onto it so the usual formula returns the sample
+    position = _triangular(u[..., 0], per_km(vehicle, fuel, _UNIT_RANGE, engine_cc))
+    sampled = np.broadcast_to(params, u.shape[:2] + (4,)).copy()
+    sampled[..., MIN] = sampled[..., MAX] = params[:, MIN] + position * (params[:, MAX] - params[:, MIN])
+    sampled[..., UPLIFT] = 1 + (params[:, UPLIFT] - 1) * 2 * _triangular(u[..., 1], 0.5)
+    return per_km(vehicle, fuel, sampled, engine_cc)[:, inverse.reshape(-1)]
+
+
+def _simulate_block(profiles, draws, seed, percentiles, factor_set):
+    table = factor_set.table
+    uniforms = _uniforms(draws, seed, table.params[..., 0].size)
+    private_ef = sample_factors(profiles["vehicle"], profiles["size"], profiles["fuel"], profiles["engine_cc"], uniforms, table)
+    public_ef = sample_factors(profiles["public_mode"], profiles["public_size"], profiles["public_fuel"], 0.0, uniforms, table)
+    km = monthly_km(profiles["distance"], profiles["days_per_week"], profiles["weeks_per_month"])
+    samples = km * commute_factor(
+        profiles["category"], private_ef, profiles["people_count"], public_ef, profiles["public_people"], profiles["private_ratio"]
+    )
+    # Commutes without a factor are NaN in every draw; leave them out of the total
+    totals = np.where(np.isnan(samples), 0.0, samples).sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        bands = np.percentile(samples, percentiles, axis=0)
+    return bands, totals
+
+
+def simulate(profiles, draws=DEFAULT_DRAWS, seed=0, percentiles=PERCENTILES, workers=1, factor_set=None):
+    """Monthly kg CO₂e percentiles per commute and per-draw fleet totals.
+
+    ``profiles`` are engine columns as for ``engine.score``. Returns
+    ``(bands, totals)``: a dict with a ``p<percentile>_kg`` array per
+    percentile, and the fleet's total emissions in each draw. Totals from
+    separate calls with the same ``draws`` and ``seed`` can be added up and
+    passed to ``fleet_bands``. Blocks of commuters are spread over ``workers``
+    processes (None for all cores); results don't depend on the number of
+    workers. ``factor_set`` defaults to the active one.
+    """
+    profiles = profile_columns(profiles)
+    n = len(profiles["distance"])
+    rows = max(1, SAMPLE_BUDGET // draws)
+    blocks = [{name: values[start:start + rows] for name, values in profiles.items()} for start in range(0, n, rows)]
+    factor_set = factor_set or active()
+    args = ([draws] * len(blocks), [seed] * len(blocks), [tuple(percentiles)] * len(blocks), [factor_set] * len(blocks))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(blocks) <= 1:
+        parts = list(map(_simulate_block, blocks, *args))
+    else:
+        with ProcessPoolExecutor(min(workers, len(blocks))) as pool:
+            parts = list(pool.map(_simulate_block, blocks, *args))
+
+    bands = np.concatenate([part[0] for part in parts], axis=1) if parts else np.empty((len(percentiles), 0))
+    totals = np.zeros(draws)
+    for _, part_totals in parts:
+        totals += part_totals
+    return dict(zip(percentile_columns(percentiles), bands)), totals
+
+
+def fleet_bands(totals, percentiles=PERCENTILES):
+    """Percentiles of a fleet's total monthly kg CO₂e from per-draw totals."""
+    return {name: float(value) for name, value in zip(percentile_columns(percentiles), np.percentile(totals, percentiles))}
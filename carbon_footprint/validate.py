@@ -0,0 +1,172 @@
+"""Validation of raw commute inputs against the choices the app allows.
+
+Used by bulk survey scoring and by ``calculate``; it only needs NumPy so
+headless callers don't pay for importing pandas.
+"""
+import numpy as np
+
+from carbon_footprint import options
+from carbon_footprint.engine import BOTH, PRIVATE, PUBLIC
+from carbon_footprint.factors import FUEL_CODES, SIZE_CODES, VEHICLE_CODES
+
+# Survey columns, named after the app's inputs. Only the ones relevant to a
+# row's transport category need a value.
+SURVEY_COLUMNS = (
+    "distance",
+    "days_per_week",
+    "weeks_per_month",
+    "transport_category",
+    "vehicle_type",  # Two Wheeler, Three Wheeler or Four Wheeler
+    "vehicle_category",  # Scooter/Motorcycle, or the car type for four wheelers
+    "fuel_type",
+    "engine_cc",
+    "people_count",
+    "public_mode",  # Taxi, Bus or Metro
+    "taxi_type",
+    "public_fuel_type",
+    "public_people_count",
+    "private_trips",
+    "total_trips",
+)
+NUMBER_COLUMNS = (
+    "distance",
+    "days_per_week",
+    "weeks_per_month",
+    "engine_cc",
+    "people_count",
+    "public_people_count",
+    "private_trips",
+    "total_trips",
+)
+LABEL_COLUMNS = tuple(name for name in SURVEY_COLUMNS if name not in NUMBER_COLUMNS)
+
+
+def _index(labels, names):
+    """Position of each label in ``names``, -1 where it isn't one of them."""
+    uniques, inverse = labels
+    names = list(names)
+    positions = np.array([names.index(u) if u in names else -1 for u in uniques], dtype=np.int64)
+    return positions[inverse]
+
+
+def encode_inputs(columns, n):
+    """Validate raw input columns and encode them as engine profile columns.
+
+    ``columns`` maps names from ``SURVEY_COLUMNS`` to arrays of length ``n``:
+    floats (NaN when blank) for ``NUMBER_COLUMNS`` and stripped strings ("" when
+    blank) for ``LABEL_COLUMNS``; absent columns count as blank. A label
+    column can also be given already factorized as ``(uniques, inverse)``,
+    which keeps the work per distinct value rather than per row. Returns
+    ``(profiles, errors)``. ``errors`` holds the first problem found for each
+    rejected row and "" for accepted rows; rejected rows are encoded with
+    placeholder codes and should not be used.
+    """
+    errors = np.full(n, "", dtype=object)
+
+    def reject(mask, message):
+        errors[mask & (errors == "")] = message
+
+    def number(name, default=np.nan):
+        if name not in columns:
+            return np.full(n, default)
+        values = np.asarray(columns[name], dtype=np.float64)
+        return np.where(np.isnan(values), default, values)
+
+    def label(name):
+        if name not in columns:
+            return [""], np.zeros(n, dtype=np.intp)
+        if isinstance(columns[name], tuple):
+            return columns[name]
+        return np.unique(np.asarray(columns[name], dtype=str), return_inverse=True)
+
+    def whole(values, low, high):
+        return (values >= low) & (values <= high) & (values == np.floor(values))
+
+    def lookup(values, mapping):
+        index = _index(values, mapping)
+        codes = np.array([VEHICLE_CODES[key] for key in mapping.values()])
+        return np.where(index >= 0, codes[index], -1)
+
+    distance = number("distance")
+    reject(~(distance >= options.MIN_DISTANCE), f"distance must be at least {options.MIN_DISTANCE} km")
+    days = number("days_per_week")
+    reject(~whole(days, *options.DAYS_PER_WEEK), "days_per_week must be a whole number from %d to %d" % options.DAYS_PER_WEEK)
+    weeks = number("weeks_per_month")
+    reject(~whole(weeks, *options.WEEKS_PER_MONTH), "weeks_per_month must be a whole number from %d to %d" % options.WEEKS_PER_MONTH)
+
+    category = _index(label("transport_category"), options.TRANSPORT_CATEGORIES)
+    reject(category < 0, "transport_category must be one of " + ", ".join(options.TRANSPORT_CATEGORIES))
+    uses_private = (category == PRIVATE) | (category == BOTH)
+    uses_public = (category == PUBLIC) | (category == BOTH)
+
+    # Private leg
+    vehicle = lookup(label("vehicle_type"), options.VEHICLE_TYPES)
+    reject(uses_private & (vehicle < 0), "vehicle_type must be one of " + ", ".join(options.VEHICLE_TYPES))
+    vehicle_category = label("vehicle_category")
+    fuel_type = label("fuel_type")
+    engine_cc = number("engine_cc")
+    people = number("people_count", 1)
+    for key in options.VEHICLE_TYPES.values():
+        rows = uses_private & (vehicle == VEHICLE_CODES[key])
+        kind = key.replace("_", " ") + "s"
+        fuel_rows = rows
+        if key == "two_wheeler":
+            reject(rows & (_index(vehicle_category, options.TWO_WHEELER_CATEGORIES) < 0), "vehicle_category must be Scooter or Motorcycle")
+        elif key == "four_wheeler":
+            reject(rows & (_index(vehicle_category, options.CAR_TYPES) < 0), "vehicle_category must be one of " + ", ".join(options.CAR_TYPES))
+            hybrid = rows & (_index(vehicle_category, ["hybrid"]) == 0)
+            reject(hybrid & (_index(fuel_type, options.FUEL_OPTIONS["hybrid"]) < 0), "fuel_type not available for hybrid cars")
+            fuel_rows = rows & ~hybrid
+        reject(fuel_rows & (_index(fuel_type, options.FUEL_OPTIONS[key]) < 0), f"fuel_type not available for {kind}")
+        low, high, _ = options.ENGINE_CC[key]
+        reject(rows & ~whole(engine_cc, low, high), f"engine_cc must be a whole number from {low} to {high} for {kind}")
+        reject(rows & ~whole(people, 1, options.MAX_PEOPLE[key]), f"people_count must be from 1 to {options.MAX_PEOPLE[key]} for {kind}")
+
+    # Public leg
+    public_mode = lookup(label("public_mode"), options.PUBLIC_MODES)
+    reject(uses_public & (public_mode < 0), "public_mode must be one of " + ", ".join(options.PUBLIC_MODES))
+    taxi_type = label("taxi_type")
+    public_fuel = label("public_fuel_type")
+    public_people = number("public_people_count", 1)
+    taxi = uses_public & (public_mode == VEHICLE_CODES["taxi"])
+    bus = uses_public & (public_mode == VEHICLE_CODES["bus"])
+    reject(taxi & (_index(taxi_type, options.TAXI_TYPES) < 0), "taxi_type must be one of " + ", ".join(options.TAXI_TYPES))
+    reject(taxi & (_index(public_fuel, options.FUEL_OPTIONS["taxi"]) < 0), "public_fuel_type not available for taxis")
+    reject(taxi & ~whole(public_people, 1, options.MAX_PEOPLE["taxi"]), f"public_people_count must be from 1 to {options.MAX_PEOPLE['taxi']} for taxis")
+    reject(bus & (_index(public_fuel, options.FUEL_OPTIONS["bus"]) < 0), "public_fuel_type not available for buses")
+    # Buses and metro have occupancy built into their factors
+    public_people = np.where(taxi, public_people, 1)
+
+    # Usage distribution for combined commutes
+    private_trips = number("private_trips")
+    total_trips = number("total_trips")
+    both = category == BOTH
+    reject(both & ~whole(private_trips, *options.PRIVATE_TRIPS), "private_trips must be a whole number from %d to %d" % options.PRIVATE_TRIPS)
+    reject(both & ~whole(total_trips, *options.TOTAL_TRIPS), "total_trips must be a whole number from %d to %d" % options.TOTAL_TRIPS)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        private_ratio = np.where(both, private_trips / total_trips, np.where(category == PRIVATE, 1.0, 0.0))
+
+    valid = errors == ""
+    profiles = {
+        "distance": np.where(valid, distance, 0.0),
+        "days_per_week": np.where(valid, days, 0).astype(np.int64),
+        "weeks_per_month": np.where(valid, weeks, 0).astype(np.int64),
+        "category": np.where(valid, category, PRIVATE).astype(np.int8),
+        "vehicle": np.where(valid & uses_private, vehicle, 0).astype(np.int8),
+        "size": np.where(valid & uses_private, _codes(vehicle_category, SIZE_CODES), 0).astype(np.int8),
+        "fuel": np.where(valid & uses_private, _codes(fuel_type, FUEL_CODES), 0).astype(np.int8),
+        "engine_cc": np.where(valid & uses_private, engine_cc, 0.0),
+        "people_count": np.where(valid & uses_private, people, 1).astype(np.int64),
+        "public_mode": np.where(valid & uses_public, public_mode, VEHICLE_CODES["metro"]).astype(np.int8),
+        "public_size": np.where(valid & taxi, _codes(taxi_type, SIZE_CODES), 0).astype(np.int8),
+        "public_fuel": np.where(valid & (taxi | bus), _codes(public_fuel, FUEL_CODES), 0).astype(np.int8),
+        "public_people": np.where(valid, public_people, 1).astype(np.int64),
+        "private_ratio": np.where(valid, private_ratio, 1.0),
+    }
+    # Three wheelers have no size category
+    profiles["size"][profiles["vehicle"] == VEHICLE_CODES["three_wheeler"]] = SIZE_CODES[""]
+    return profiles, errors
+
+
+def _codes(values, codes):
+    return np.maximum(_index(values, codes), 0)
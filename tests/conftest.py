@@ -0,0 +1,65 @@
+"""Fixtures shared by the test modules: factor sets and a survey."""
+import json
+import random
+
+import pandas as pd
+import pytest
+
+from carbon_footprint import options
+from carbon_footprint.calculator import with_defaults
+from carbon_footprint.factors import BUNDLED_FACTORS
+from carbon_footprint.factorsets import active, from_bytes
+
+SITES = ["Pune", "Delhi", "Chennai"]
+
+
+@pytest.fixture(scope="session")
+def factor_set():
+    return active()
+
+
+@pytest.fixture(scope="session")
+def bundled():
+    """The bundled factor file's content; copy it before changing it."""
+    with open(BUNDLED_FACTORS) as file:
+        return json.load(file)
+
+
+@pytest.fixture(scope="session")
+def doubled(bundled):
+    """A factor set other than the active one."""
+    content = json.loads(json.dumps(bundled))
+    content["version"] = "doubled"
+    content["factors"]["four_wheeler"]["sedan"]["petrol"]["base"] *= 2
+    return from_bytes(json.dumps(content).encode("utf-8"))
+
+
+@pytest.fixture(scope="session")
+def survey_rows():
+    """Survey rows with every column, as the app's form fills them in; every 50th, from the 8th, is rejected."""
+    rng = random.Random(0)
+    rows = []
+    for i in range(1200):
+        inputs = {"distance": round(rng.uniform(1, 40), 1) if i % 50 != 7 else -1, "days_per_week": rng.randint(1, 6)}
+        if rng.random() < 0.3:
+            mode = rng.choice(list(options.PUBLIC_MODES))
+            inputs.update(transport_category="Public Transport", public_mode=mode)
+            if mode != "Metro":
+                inputs["public_fuel_type"] = rng.choice(options.FUEL_OPTIONS["bus" if mode == "Bus" else "taxi"])
+        else:
+            inputs.update(
+                transport_category="Private Transport",
+                vehicle_type="Four Wheeler",
+                vehicle_category=rng.choice([car for car in options.CAR_TYPES if car != "hybrid"]),
+                fuel_type=rng.choice(options.FUEL_OPTIONS["four_wheeler"]),
+            )
+        rows.append(dict(with_defaults(inputs), employee_id=f"e{i}", site=rng.choice(SITES)))
+    return rows
+
+
+@pytest.fixture(scope="session")
+def survey(survey_rows, tmp_path_factory):
+    """The first 300 survey rows as a CSV file; returns its path."""
+    path = tmp_path_factory.mktemp("survey") / "survey.csv"
+    pd.DataFrame(survey_rows[:300]).to_csv(path, index=False)
+    return str(path)
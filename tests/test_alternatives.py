@@ -0,0 +1,134 @@
+"""Parity of the precomputed comparison index with the app's alternatives formulas.
+
+The reference function below has the app's original formulas, on the
+nested factor dict, one commute at a time. The index must give the same
+numbers, to the last bit, across the whole grid of inputs the app offers.
+
+One thing differs from the original app on purpose: the electric
+alternatives are left out by the fuel of the private vehicle. The original
+app used whichever ``fuel_type`` was set last, which in "Both" mode was the
+taxi's; the app now passes the private fuel, as ``calculate`` always did.
+"""
+import itertools
+
+import numpy as np
+import pytest
+
+from carbon_footprint import options
+from carbon_footprint.alternatives import ALTERNATIVES, alternatives, comparison_index, rank
+from carbon_footprint.calculator import calculate_many
+from carbon_footprint.table import FOUR_WHEELER, TWO_WHEELER
+
+# Short distances at the form's finest step and longer ones more sparsely,
+# with every number of days and weeks
+DISTANCES = np.round(np.concatenate([np.arange(0.1, 10, 0.1), np.arange(10, 200, 1.5), [200.0]]), 1)
+DAYS = range(options.DAYS_PER_WEEK[0], options.DAYS_PER_WEEK[1] + 1)
+WEEKS = range(options.WEEKS_PER_MONTH[0], options.WEEKS_PER_MONTH[1] + 1)
+
+
+def reference(total_monthly_km, vehicle_type, rideshare, people_count, fuel_type, emission_factors):
+    """The alternatives as the app's original formulas give them."""
+    result = {}
+    result["Bus (Diesel)"] = (total_monthly_km * emission_factors["public_transport"]["bus"]["diesel"])
+    result["Bus (CNG)"] = (total_monthly_km * emission_factors["public_transport"]["bus"]["cng"])
+    result["Bus (Electric)"] = (total_monthly_km * emission_factors["public_transport"]["bus"]["electric"])
+    result["Metro"] = (total_monthly_km * emission_factors["public_transport"]["metro"])
+    if not (vehicle_type == "Four Wheeler" and rideshare and people_count >= 3):
+        result["Car Pooling (4 people)"] = (total_monthly_km * emission_factors["four_wheeler"]["sedan"]["petrol"]["base"] *
+                                            emission_factors["four_wheeler"]["sedan"]["petrol"]["uplift"]) / 4
+    if not (vehicle_type == "Four Wheeler" and fuel_type == "electric"):
+        result["Electric Car"] = (total_monthly_km * emission_factors["four_wheeler"]["sedan"]["electric"]["base"] *
+                                  emission_factors["four_wheeler"]["sedan"]["electric"]["uplift"])
+    if not (vehicle_type == "Two Wheeler" and fuel_type == "electric"):
+        result["Electric Scooter"] = (total_monthly_km * emission_factors["two_wheeler"]["Scooter"]["electric"]["min"])
+    return result
+
+
+def same_bits(a, b):
+    return np.asarray(a, dtype=np.float64).tobytes() == np.asarray(b, dtype=np.float64).tobytes()
+
+
+@pytest.fixture(scope="module")
+def monthly_kms():
+    return np.array([distance * 2 * days * weeks for distance in DISTANCES.tolist() for days in DAYS for weeks in WEEKS])
+
+
+def test_values_match_formulas_bit_for_bit(factor_set, monthly_kms):
+    km = monthly_kms
+    none = np.zeros(len(km), dtype=bool)
+    values = alternatives(km, np.full(len(km), TWO_WHEELER), np.zeros(len(km), dtype=int), np.ones(len(km)), none, factor_set.table)
+    expected = [reference(value, "", False, 1, None, factor_set.factors) for value in km.tolist()]
+    for label in ALTERNATIVES:
+        assert same_bits(values[label], [item[label] for item in expected]), label
+
+
+def test_index_is_sorted_from_the_cleanest(factor_set):
+    index = comparison_index(factor_set.table)
+    assert sorted(index.labels) == sorted(ALTERNATIVES)
+    assert np.all(np.diff(index.per_km) >= 0)
+    assert [index.labels[position] for position in index.positions] == list(ALTERNATIVES)
+    assert comparison_index(factor_set.table) is index
+
+
+def _private_choices():
+    for vehicle_type, key in options.VEHICLE_TYPES.items():
+        if key == "two_wheeler":
+            categories = options.TWO_WHEELER_CATEGORIES
+        elif key == "four_wheeler":
+            categories = options.CAR_TYPES
+        else:
+            categories = [None]
+        for category in categories:
+            fuels = options.FUEL_OPTIONS["hybrid" if category == "hybrid" else key]
+            for fuel, people in itertools.product(fuels, range(1, options.MAX_PEOPLE[key] + 1)):
+                for rideshare in (False, True) if people == 1 else (True,):
+                    yield {"vehicle_type": vehicle_type, "vehicle_category": category, "fuel_type": fuel, "people_count": people}, rideshare
+
+
+def _public_choices():
+    for taxi_type, fuel, people in itertools.product(options.TAXI_TYPES, options.FUEL_OPTIONS["taxi"], range(1, options.MAX_PEOPLE["taxi"] + 1)):
+        yield {"public_mode": "Taxi", "taxi_type": taxi_type, "public_fuel_type": fuel, "public_people_count": people}
+    for fuel in options.FUEL_OPTIONS["bus"]:
+        yield {"public_mode": "Bus", "public_fuel_type": fuel}
+    yield {"public_mode": "Metro"}
+
+
+def commutes():
+    """Every combination of choices the app's form offers, with the original app's labels."""
+    distance = {"distance": 12.5, "days_per_week": 5, "weeks_per_month": 4}
+    for private, rideshare in _private_choices():
+        yield dict(distance, transport_category="Private Transport", **private), private["vehicle_type"], rideshare
+    for public in _public_choices():
+        yield dict(distance, transport_category="Public Transport", **public), "Public Transport", False
+    for (private, rideshare), public, private_trips in itertools.product(_private_choices(), _public_choices(), (0, 2, 4)):
+        inputs = dict(distance, transport_category="Both Private and Public", private_trips=private_trips, total_trips=4, **private, **public)
+        # The original app only relabels a commute split between both
+        vehicle_type = "Combined Transport" if 0 < private_trips < 4 else private["vehicle_type"]
+        yield inputs, vehicle_type, rideshare
+
+
+def test_comparisons_match_formulas_across_the_form(factor_set):
+    grid = list(commutes())
+    results = calculate_many([inputs for inputs, _, _ in grid], factor_set)
+    mismatched = []
+    for (inputs, vehicle_type, rideshare), result in zip(grid, results):
+        assert "error" not in result, (inputs, result)
+        comparison = result["comparison"]
+        # As in the app, the commute comes first, and an alternative with its label replaces it;
+        # electric alternatives are left out by the private vehicle's fuel, not the taxi's
+        expected = {result["vehicle_name"]: result["emissions_kg"]}
+        expected.update(reference(
+            result["monthly_km"], vehicle_type, rideshare, inputs.get("people_count", 1), inputs.get("fuel_type"), factor_set.factors,
+        ))
+        if list(comparison) != list(expected) or not same_bits(list(comparison.values()), list(expected.values())):
+            mismatched.append(inputs)
+    assert not mismatched, f"{len(mismatched)} of {len(grid)} commutes differ, e.g. {mismatched[0]}"
+
+
+def test_rank_counts_cleaner_options(factor_set):
+    km = np.array([400.0, 400.0, 10.0])
+    values = np.stack(list(alternatives(km, np.array([FOUR_WHEELER] * 3), np.array([3, 0, 0]), np.array([1, 4, 1]), np.array([True, True, False]), factor_set.table).values()), axis=-1)
+    own = np.array([0.0, 1e9, values[2].min()])
+    n, m = rank(own, values)
+    assert n.tolist() == [1, len(ALTERNATIVES), 1]
+    assert m.tolist() == [len(ALTERNATIVES), len(ALTERNATIVES), len(ALTERNATIVES) + 1]
@@ -0,0 +1,95 @@
+"""Commute distances from coordinates, with the route cache."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from carbon_footprint.distances import DistanceResolver, RoutingGraph, circuity, fill_distances, haversine
+
+HOMES = np.array([[18.5204, 73.8567], [18.5310, 73.8446], [18.5204, 73.8567], [19.0760, 72.8777]])
+WORK = np.array([[18.5590, 73.7868], [18.5590, 73.7868], [18.5590, 73.7868], [18.5204, 73.8567]])
+
+
+def resolve(resolver, homes=HOMES, work=WORK):
+    return resolver.resolve(homes[:, 0], homes[:, 1], work[:, 0], work[:, 1])
+
+
+def counting(resolver):
+    """Count the coordinate pairs ``resolver`` computes rather than finds in its cache."""
+    computed = []
+    compute = resolver._compute
+
+    def wrapper(*coordinates):
+        computed.append(len(coordinates[0]))
+        return compute(*coordinates)
+
+    resolver._compute = wrapper
+    return computed
+
+
+def test_without_a_graph_distances_are_great_circle_times_circuity():
+    assert haversine(0, 0, 1, 0) == pytest.approx(111.195, abs=1e-3)
+    assert circuity(np.array([2.0, 10.0, 50.0]), [(5, 1.5), (20, 1.3), (float("inf"), 1.2)]).tolist() == pytest.approx([3.0, 13.0, 60.0])
+
+    with DistanceResolver(circuity=1.3) as resolver:
+        km = resolve(resolver)
+    expected = 1.3 * haversine(HOMES[:, 0], HOMES[:, 1], WORK[:, 0], WORK[:, 1])
+    assert km == pytest.approx(expected, rel=1e-4)
+    assert km[0] == km[2]
+
+
+def test_cache_hits_skip_the_computation(tmp_path):
+    cache = str(tmp_path / "routes.db")
+    with DistanceResolver(cache=cache) as resolver:
+        computed = counting(resolver)
+        first = resolve(resolver)
+        # Rows with the same rounded coordinates are computed once
+        assert computed == [3]
+        assert resolve(resolver).tolist() == first.tolist()
+        assert computed == [3]
+
+        moved = HOMES.copy()
+        moved[0, 0] += 0.01
+        resolve(resolver, moved)
+        assert computed == [3, 1]
+
+    # The cache outlives the resolver, and is shared by later ones with the same method
+    with DistanceResolver(cache=cache) as resolver:
+        computed = counting(resolver)
+        assert resolve(resolver).tolist() == first.tolist()
+        assert computed == []
+    with DistanceResolver(cache=cache, circuity=1.5) as resolver:
+        computed = counting(resolver)
+        assert resolve(resolver) == pytest.approx(first / 1.3 * 1.5)
+        assert computed == [3]
+
+
+def test_invalid_coordinates_give_nan_and_typed_distances_stay():
+    chunk = pd.DataFrame({
+        "distance": [7.0, 8.0, 9.0],
+        "home_lat": [18.5204, 123.0, None],
+        "home_lon": [73.8567, 73.8567, None],
+        "work_lat": [18.5590, 18.5590, None],
+        "work_lon": [73.7868, 73.7868, None],
+    })
+    with DistanceResolver() as resolver:
+        filled = fill_distances(chunk, resolver)["distance"].tolist()
+    assert filled[0] == pytest.approx(resolve(DistanceResolver())[0])
+    assert np.isnan(filled[1])
+    assert filled[2] == 9.0
+
+
+def test_graph_routes_follow_the_roads():
+    # Two roads from (0, 0) to (0, 0.02): a direct one-way street away from it, and a detour
+    graph = RoutingGraph(
+        from_lat=np.array([0.0, 0.0, 0.01]),
+        from_lon=np.array([0.02, 0.0, 0.01]),
+        to_lat=np.array([0.0, 0.01, 0.0]),
+        to_lon=np.array([0.0, 0.01, 0.02]),
+        km=np.array([2.0, 1.5, 1.5]),
+        oneway=np.array([True, False, False]),
+    )
+    with DistanceResolver(graph) as resolver:
+        there = resolver.resolve([0.0], [0.0], [0.0], [0.02])
+        back = resolver.resolve([0.0], [0.02], [0.0], [0.0])
+    assert there.tolist() == pytest.approx([3.0])
+    assert back.tolist() == pytest.approx([2.0])
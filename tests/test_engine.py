@@ -0,0 +1,173 @@
+"""Parity of the vectorized engine and the dense factor table with the app's original formulas.
+
+The reference functions below have the app's original formulas, on the
+nested factor dict, one leg or commute at a time. The engine must give the
+same numbers, to the last bit, for every vehicle, size and fuel the form
+offers, at every engine size its widgets allow.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from carbon_footprint import options
+from carbon_footprint.engine import BOTH, PRIVATE, PUBLIC, emission_factor, factors, monthly_km, score
+from carbon_footprint.factors import FUEL_CODES, SIZE_CODES, VEHICLE_CODES
+from carbon_footprint.trips import from_profiles, summarize
+
+
+def reference_factor(vehicle, size, fuel, engine_cc, emission_factors):
+    """A leg's per-km factor as the app's original formulas give it."""
+    if vehicle == "two_wheeler":
+        if engine_cc <= 150:
+            return emission_factors["two_wheeler"][size][fuel]["min"]
+        min_ef = emission_factors["two_wheeler"][size][fuel]["min"]
+        max_ef = emission_factors["two_wheeler"][size][fuel]["max"]
+        ratio = min(1.0, (engine_cc - 150) / 1350)
+        return min_ef + ratio * (max_ef - min_ef)
+    if vehicle == "three_wheeler":
+        min_ef = emission_factors["three_wheeler"][fuel]["min"]
+        max_ef = emission_factors["three_wheeler"][fuel]["max"]
+        ratio = min(1.0, (engine_cc - 50) / 950)
+        return min_ef + ratio * (max_ef - min_ef)
+    if vehicle == "four_wheeler":
+        base_ef = emission_factors["four_wheeler"][size][fuel]["base"]
+        uplift = emission_factors["four_wheeler"][size][fuel]["uplift"]
+        if fuel != "electric":
+            engine_factor = 1.0 + min(1.0, (engine_cc - 600) / 3400) * 0.5
+        else:
+            engine_factor = 1.0
+        return base_ef * uplift * engine_factor
+    if vehicle == "taxi":
+        return emission_factors["public_transport"]["taxi"][size][fuel]["base"] * emission_factors["public_transport"]["taxi"][size][fuel]["uplift"]
+    if vehicle == "bus":
+        return emission_factors["public_transport"]["bus"][fuel]
+    return emission_factors["public_transport"]["metro"]
+
+
+def reference_emissions(distance, days_per_week, weeks_per_month, category, private, people_count, public, public_people,
+                        private_trips, total_trips, emission_factors):
+    """Monthly kg CO₂e of a commute as the original app computes it; legs are ``(vehicle, size, fuel, engine_cc)``."""
+    total_monthly_km = distance * 2 * days_per_week * weeks_per_month
+    if category == "Public Transport":
+        return total_monthly_km * reference_factor(*public, emission_factors)
+    emission_factor = reference_factor(*private, emission_factors)
+    if category == "Both Private and Public":
+        private_ratio = private_trips / total_trips
+        public_ratio = 1 - private_ratio
+        if private_ratio > 0 and public_ratio > 0:
+            public_emission_factor = reference_factor(*public, emission_factors)
+            emission_factor = (emission_factor / people_count) * private_ratio + (public_emission_factor / public_people) * public_ratio
+    return total_monthly_km * emission_factor
+
+
+def private_legs():
+    for size in options.TWO_WHEELER_CATEGORIES:
+        for fuel in options.FUEL_OPTIONS["two_wheeler"]:
+            yield "two_wheeler", size, fuel, options.ENGINE_CC["two_wheeler"]
+    for fuel in options.FUEL_OPTIONS["three_wheeler"]:
+        yield "three_wheeler", "", fuel, options.ENGINE_CC["three_wheeler"]
+    for size in options.CAR_TYPES:
+        for fuel in options.FUEL_OPTIONS["hybrid" if size == "hybrid" else "four_wheeler"]:
+            yield "four_wheeler", size, fuel, options.ENGINE_CC["four_wheeler"]
+
+
+def public_legs():
+    for size in options.TAXI_TYPES:
+        for fuel in options.FUEL_OPTIONS["taxi"]:
+            yield "taxi", size, fuel, 0
+    for fuel in options.FUEL_OPTIONS["bus"]:
+        yield "bus", "", fuel, 0
+    yield "metro", "", "", 0
+
+
+def legs():
+    """Every leg the form offers, at every whole engine size its widgets allow."""
+    for vehicle, size, fuel, (low, high, _) in private_legs():
+        for engine_cc in range(low, high + 1):
+            yield vehicle, size, fuel, engine_cc
+    yield from public_legs()
+
+
+def codes(grid):
+    vehicle, size, fuel, engine_cc = zip(*grid)
+    return (
+        np.array([VEHICLE_CODES[name] for name in vehicle]),
+        np.array([SIZE_CODES[name] for name in size]),
+        np.array([FUEL_CODES.get(name, 0) for name in fuel]),
+        np.array(engine_cc, dtype=np.float64),
+    )
+
+
+def same_bits(a, b):
+    return np.asarray(a, dtype=np.float64).tobytes() == np.asarray(b, dtype=np.float64).tobytes()
+
+
+@pytest.fixture(scope="module")
+def commutes(factor_set):
+    """Random commutes of every category, as engine profiles and as the original app's inputs."""
+    rng = random.Random(0)
+    private = [(vehicle, size, fuel, low, high) for vehicle, size, fuel, (low, high, _) in private_legs()]
+    public = list(public_legs())
+    rows = []
+    for _ in range(5000):
+        vehicle, size, fuel, low, high = rng.choice(private)
+        leg = rng.choice(public)
+        total_trips = rng.randint(*options.TOTAL_TRIPS)
+        rows.append(dict(
+            distance=round(rng.uniform(options.MIN_DISTANCE, 80), 1),
+            days_per_week=rng.randint(*options.DAYS_PER_WEEK),
+            weeks_per_month=rng.randint(*options.WEEKS_PER_MONTH),
+            category=rng.choice(["Private Transport", "Public Transport", "Both Private and Public"]),
+            private=(vehicle, size, fuel, rng.randint(low, high)),
+            people_count=rng.randint(1, options.MAX_PEOPLE[vehicle]),
+            public=leg,
+            # As in the app, bus and metro legs aren't shared
+            public_people=rng.randint(1, options.MAX_PEOPLE["taxi"]) if leg[0] == "taxi" else 1,
+            private_trips=rng.randint(0, total_trips),
+            total_trips=total_trips,
+        ))
+    vehicle, size, fuel, engine_cc = codes([row["private"] for row in rows])
+    public_mode, public_size, public_fuel, _ = codes([row["public"] for row in rows])
+    category = {"Private Transport": PRIVATE, "Public Transport": PUBLIC, "Both Private and Public": BOTH}
+    profiles = {
+        "distance": np.array([row["distance"] for row in rows]),
+        "days_per_week": np.array([row["days_per_week"] for row in rows]),
+        "weeks_per_month": np.array([row["weeks_per_month"] for row in rows]),
+        "category": np.array([category[row["category"]] for row in rows]),
+        "vehicle": vehicle,
+        "size": size,
+        "fuel": fuel,
+        "engine_cc": engine_cc,
+        "people_count": np.array([row["people_count"] for row in rows]),
+        "public_mode": public_mode,
+        "public_size": public_size,
+        "public_fuel": public_fuel,
+        "public_people": np.array([row["public_people"] for row in rows]),
+        "private_ratio": np.array([row["private_trips"] / row["total_trips"] for row in rows]),
+    }
+    return rows, profiles
+
+
+def test_factors_match_formulas_bit_for_bit(factor_set):
+    grid = list(legs())
+    expected = [reference_factor(*leg, factor_set.factors) for leg in grid]
+    assert same_bits(factors(*codes(grid), factor_set.table), expected)
+
+    # The app's scalar lookups go through the same table
+    for i in range(0, len(grid), 97):
+        vehicle, size, fuel, engine_cc = grid[i]
+        assert same_bits([emission_factor(vehicle, size, fuel or None, engine_cc, table=factor_set.table)], [expected[i]]), grid[i]
+
+
+def test_scores_match_formulas_bit_for_bit(factor_set, commutes):
+    rows, profiles = commutes
+    expected = [reference_emissions(emission_factors=factor_set.factors, **row) for row in rows]
+    assert same_bits(score(profiles, factor_set.table), expected)
+
+
+def test_trips_from_profiles_agree_with_score(factor_set, commutes):
+    _, profiles = commutes
+    one_way = summarize(from_profiles(profiles), factor_set.table)["emissions_kg"]
+    km_factor = monthly_km(1, profiles["days_per_week"], profiles["weeks_per_month"])
+    assert one_way * km_factor == pytest.approx(score(profiles, factor_set.table), rel=1e-12)
@@ -0,0 +1,55 @@
+"""Factor sets: the compiled table cache and hot reloading."""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from carbon_footprint import factorsets
+
+
+def factor_set_file(content, version, scale=1.0):
+    content = json.loads(json.dumps(content))
+    content["version"] = version
+    content["factors"]["public_transport"]["metro"] *= scale
+    return json.dumps(content).encode("utf-8")
+
+
+def test_cache_file_is_named_after_the_layout(tmp_path, monkeypatch, bundled):
+    monkeypatch.setenv("CARBON_FACTOR_CACHE", str(tmp_path))
+    factor_set = factorsets.from_bytes(factor_set_file(bundled, "layout-test"))
+
+    path = tmp_path / f"factors-{factor_set.digest}-v{factorsets.LAYOUT}.bin"
+    assert os.listdir(tmp_path) == [path.name]
+    assert isinstance(factor_set.table.params, np.memmap)
+    # A file of another layout is not read as this one
+    path.write_bytes(b"CFTABLE1" + path.read_bytes()[len(factorsets.MAGIC):])
+    with pytest.raises(ValueError):
+        factorsets.read_cache(str(path))
+
+
+def test_only_recent_sets_stay_loaded(tmp_path, monkeypatch, bundled):
+    monkeypatch.setenv("CARBON_FACTOR_CACHE", str(tmp_path))
+    active = factorsets.active()
+    loaded = [factorsets.from_bytes(factor_set_file(bundled, f"prune-{i}", 1 + i / 10)) for i in range(10)]
+
+    assert len(factorsets._loaded) <= factorsets.KEEP_LOADED + 1
+    assert factorsets._loaded[active.digest] is active
+    assert [factor_set.digest in factorsets._loaded for factor_set in loaded[-factorsets.KEEP_LOADED:]] == [True] * factorsets.KEEP_LOADED
+    assert loaded[0].digest not in factorsets._loaded
+
+
+def test_source_keeps_its_set_while_the_file_is_missing(tmp_path, monkeypatch, bundled):
+    monkeypatch.setenv("CARBON_FACTOR_CACHE", str(tmp_path))
+    path = tmp_path / "factors.json"
+    path.write_bytes(factor_set_file(bundled, "replaced"))
+    source = factorsets.FactorSource(str(path))
+    factor_set = source.get()
+
+    path.unlink()
+    assert source.get() is factor_set
+    with pytest.raises(OSError):
+        factorsets.FactorSource(str(path)).get()
+
+    path.write_bytes(factor_set_file(bundled, "replacement", 2.0))
+    assert source.get().version == "replacement"
@@ -0,0 +1,70 @@
+"""Fleet rollups of a survey, against exact figures."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from carbon_footprint.calculator import calculate_many
+from carbon_footprint.fleet import DEFAULT_ALPHA, QUANTILES, FleetSummary, quantile_name, summarize_file
+
+def within(approximate, exact, alpha=DEFAULT_ALPHA):
+    return abs(approximate - exact) <= alpha * exact + 1e-12
+
+
+@pytest.fixture(scope="module")
+def rows(survey_rows):
+    return survey_rows
+
+
+@pytest.fixture(scope="module")
+def exact(rows, factor_set):
+    results = calculate_many([{k: v for k, v in row.items() if k not in ("employee_id", "site")} for row in rows], factor_set)
+    kg = np.array([result.get("emissions_kg", np.nan) for result in results])
+    km = np.array([result.get("monthly_km", np.nan) for result in results])
+    return kg, km
+
+
+def test_summary_of_a_survey_matches_a_full_rescore(tmp_path, rows, exact):
+    path = tmp_path / "survey.csv"
+    pd.DataFrame(rows).to_csv(path, index=False)
+    summary = summarize_file(str(path), by=["site"], id_column="employee_id", top=5, chunksize=250).to_dict()
+
+    kg, km = exact
+    scored = ~np.isnan(kg)
+    assert summary["rows"] == scored.sum()
+    assert summary["rejected"] == (~scored).sum()
+    assert summary["emissions_kg"] == pytest.approx(kg[scored].sum())
+    assert summary["monthly_km"] == pytest.approx(km[scored].sum())
+    for q in QUANTILES:
+        assert within(summary[quantile_name(q)], np.quantile(kg[scored], q, method="lower")) or within(
+            summary[quantile_name(q)], np.quantile(kg[scored], q, method="higher")
+        )
+
+    sites = np.array([row["site"] for row in rows])
+    assert [group["site"] for group in summary["groups"]] == sorted(set(sites))
+    for group in summary["groups"]:
+        rows_in_site = scored & (sites == group["site"])
+        assert group["rows"] == rows_in_site.sum()
+        assert group["emissions_kg"] == pytest.approx(kg[rows_in_site].sum())
+
+    top = np.argsort(-np.where(scored, kg, -np.inf), kind="stable")[:5]
+    assert [item["id"] for item in summary["top"]] == [rows[i]["employee_id"] for i in top]
+    assert [item["emissions_kg"] for item in summary["top"]] == pytest.approx(kg[top].tolist())
+
+
+def test_merged_chunks_equal_one_pass(exact):
+    kg, km = exact
+    keys = {"site": np.array([("Pune", "Delhi", "Chennai")[i % 3] for i in range(len(kg))], dtype=object)}
+    whole = FleetSummary(by=["site"])
+    whole.update(kg, km, keys)
+    merged = FleetSummary(by=["site"])
+    for start in range(0, len(kg), 100):
+        part = FleetSummary(by=["site"])
+        part.update(kg[start:start + 100], km[start:start + 100], {"site": keys["site"][start:start + 100]}, np.arange(start, start + 100))
+        merged.merge(part)
+
+    a, b = whole.to_dict(), merged.to_dict()
+    assert a["emissions_kg"] == pytest.approx(b["emissions_kg"])
+    for key in ("rows", "rejected", "top") + tuple(map(quantile_name, QUANTILES)):
+        assert a[key] == b[key], key
+    assert [group["rows"] for group in a["groups"]] == [group["rows"] for group in b["groups"]]
+
@@ -0,0 +1,71 @@
+"""Footprint history: running totals against the recorded footprints."""
+import random
+
+import numpy as np
+import pytest
+
+from carbon_footprint.history import HistoryStore, partition
+
+MONTHS = ["2025-11", "2025-12", "2026-01", "2026-02"]
+USERS = [f"e{i}" for i in range(12)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    with HistoryStore(str(tmp_path / "history.db")) as store:
+        yield store
+
+
+def recomputed(store):
+    """Per-month fleet totals and per-user means, from the month partitions."""
+    fleet, users = {}, {}
+    for month in MONTHS:
+        rows = store._query(
+            f"SELECT user, COUNT(*), AVG(emissions_kg), AVG(monthly_km) FROM {partition(month)} GROUP BY user"
+        )
+        for user, records, kg, km in rows:
+            users[user, month] = (records, kg, km)
+        fleet[month] = (
+            len(rows), sum(row[1] for row in rows), sum(row[2] for row in rows), sum(row[3] for row in rows)
+        )
+    return fleet, users
+
+
+def test_running_totals_match_the_partitions(store):
+    rng = random.Random(0)
+    recorded = 0
+    for _ in range(6):
+        n = rng.randint(1, 80)
+        users = [rng.choice(USERS + [None, ""]) for _ in range(n)]
+        # Rows without a user or with NaN emissions are skipped
+        kg = [float("nan") if rng.random() < 0.1 else rng.uniform(0, 300) for _ in range(n)]
+        km = [rng.uniform(0, 2000) for _ in range(n)]
+        months = [rng.choice(MONTHS) for _ in range(n)]
+        recorded += store.append(users, kg, km, months)
+    store.record("e0", 42.0, 400.0, "Metro", month="2026-02")
+    recorded += 1
+
+    fleet, users = recomputed(store)
+    assert sum(records for _, records, _, _ in fleet.values()) == recorded
+    for item in store.trend():
+        users_count, records, kg, km = fleet[item["month"]]
+        assert (item["users"], item["records"]) == (users_count, records)
+        assert item["emissions_kg"] == pytest.approx(kg)
+        assert item["monthly_km"] == pytest.approx(km)
+    for user in USERS:
+        for item in store.trend(user):
+            records, kg, km = users[user, item["month"]]
+            assert item["records"] == records
+            assert item["emissions_kg"] == pytest.approx(kg)
+            assert item["monthly_km"] == pytest.approx(km)
+
+
+def test_projection_uses_the_most_recent_months(store):
+    for month, kg in zip(MONTHS, [100.0, 200.0, 300.0, 500.0]):
+        store.append(["a", "a"], [kg - 10, kg + 10], [800.0, 800.0], month)
+
+    assert [item["emissions_kg"] for item in store.trend("a")] == pytest.approx([100.0, 200.0, 300.0, 500.0])
+    projection = store.projection("a", months=2)
+    assert projection["months"] == 2
+    assert projection["yearly_kg"] == pytest.approx(np.mean([300.0, 500.0]) * 12)
+    assert store.projection("nobody") == {"months": 0, "monthly_kg": None, "yearly_kg": None}
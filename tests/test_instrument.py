@@ -0,0 +1,93 @@
+"""Stage timing: per-task runs and the Prometheus text format."""
+import asyncio
+import re
+
+import pytest
+
+from carbon_footprint import instrument
+
+SAMPLE = re.compile(r'^[a-z_]+\{kind="[^"]*"(,stage="(?:[^"\\]|\\.)*")?\} [0-9.e+-]+$')
+
+
+@pytest.fixture
+def profiling(monkeypatch):
+    monkeypatch.setattr(instrument, "_enabled", True)
+    monkeypatch.setattr(instrument, "_log_path", None)
+    monkeypatch.setattr(instrument, "_totals", {})
+    monkeypatch.setattr(instrument, "_current", instrument.contextvars.ContextVar("test_run", default=None))
+
+
+def test_stages_of_concurrent_tasks_stay_in_their_own_runs(profiling):
+    async def upload(name, stages):
+        with instrument.job("batch", name=name) as run:
+            for stage in stages:
+                with instrument.stage(stage):
+                    # Let the other tasks run inside this stage
+                    await asyncio.sleep(0)
+                    # A nested job joins the open run
+                    assert instrument.job("batch") is instrument._NOOP
+        return run
+
+    async def main():
+        return await asyncio.gather(
+            upload("a", ["read", "score"]),
+            upload("b", ["read"]),
+            upload("c", ["score", "write", "write"]),
+        )
+
+    runs = asyncio.run(main())
+    assert [(run.labels["name"], [name for name, _, _ in run.stages]) for run in runs] == [
+        ("a", ["read", "score"]),
+        ("b", ["read"]),
+        ("c", ["score", "write", "write"]),
+    ]
+    assert all(run.seconds is not None for run in runs)
+    assert instrument.current() is None
+
+    # Outside any run, a stage counts as a run of kind "other"
+    with instrument.stage("lookup"):
+        pass
+    assert {key: entry[0] for key, entry in instrument._totals.items()} == {
+        ("batch", ""): 3, ("batch", "read"): 2, ("batch", "score"): 2, ("batch", "write"): 2, ("other", "lookup"): 1,
+    }
+
+
+def test_prometheus_text_format(profiling):
+    with instrument.job("batch"):
+        with instrument.stage("read"):
+            pass
+        with instrument.stage('say "hi"\\\n'):
+            pass
+    run = instrument.start("rerun", page="calculator")
+    run.finish()
+
+    text = instrument.prometheus_text()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    families = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+    assert families == [
+        "carbon_runs_total", "carbon_run_seconds_total", "carbon_stage_calls_total",
+        "carbon_stage_seconds_total", "carbon_stage_alloc_blocks_total",
+    ]
+    assert all(line.endswith(" counter") for line in lines if line.startswith("# TYPE"))
+    samples = [line for line in lines if not line.startswith("#")]
+    assert all(SAMPLE.match(line) for line in samples), samples
+
+    assert 'carbon_runs_total{kind="batch"} 1' in samples
+    assert 'carbon_runs_total{kind="rerun"} 1' in samples
+    assert 'carbon_stage_calls_total{kind="batch",stage="read"} 1' in samples
+    assert 'carbon_stage_calls_total{kind="batch",stage="say \\"hi\\"\\\\\\n"} 1' in samples
+    # Whole runs and stages are separate families
+    assert not any(line.startswith("carbon_runs_total") and "stage=" in line for line in samples)
+    assert not any(line.startswith("carbon_stage_") and "stage=" not in line for line in samples)
+
+
+def test_nothing_is_counted_while_off(monkeypatch):
+    monkeypatch.setattr(instrument, "_enabled", False)
+    monkeypatch.setattr(instrument, "_totals", {})
+    assert instrument.stage("read") is instrument._NOOP
+    assert instrument.job("batch") is instrument._NOOP
+    assert instrument.start("rerun") is None
+    items = [1, 2]
+    assert instrument.timed(items, "read") is items
+    assert instrument.prometheus_text().count("\n") == 10
@@ -0,0 +1,41 @@
+"""Saved commute profiles and their cached results."""
+import json
+
+import pytest
+
+from carbon_footprint.calculator import calculate_many
+from carbon_footprint.profiles import ProfileStore, canonical, inputs_key
+
+COMMUTE = {"distance": 12.5, "vehicle_type": "Four Wheeler", "vehicle_category": "sedan", "fuel_type": "petrol"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    with ProfileStore(str(tmp_path / "profiles.db")) as store:
+        yield store
+
+
+def test_results_follow_the_given_factor_set(store, doubled, factor_set):
+    store.save("ana", "office", COMMUTE, doubled)
+    [item] = store.compare("ana", factor_set=doubled)
+    assert item["result"] == calculate_many([COMMUTE], doubled)[0]
+    assert item["result"]["factor_version"] == doubled.label
+
+    [item] = store.compare("ana")
+    assert item["result"] == calculate_many([COMMUTE], factor_set)[0]
+
+
+def test_profiles_that_no_longer_calculate_give_an_error(store):
+    store.save("ana", "office", COMMUTE)
+    # A profile saved before the calculator stopped accepting its inputs
+    row = canonical(dict(COMMUTE, fuel_type="hydrogen"))
+    with store.pool.transaction() as db:
+        db.execute(
+            "INSERT INTO profiles VALUES (?, ?, ?, ?, ?)",
+            ("ana", "old car", json.dumps(row), inputs_key(row), "2020-01-01T00:00:00"),
+        )
+
+    office, old = store.compare("ana")
+    assert (office["name"], old["name"]) == ("office", "old car")
+    assert "error" not in office["result"]
+    assert "fuel_type" in old["result"]["error"]
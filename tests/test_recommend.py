@@ -0,0 +1,70 @@
+"""Recommendations from the rule table, against the original app's if/else chain."""
+import itertools
+
+import pytest
+
+from carbon_footprint.factors import FUELS
+from carbon_footprint.recommend import KINDS, NO_FUEL, evaluate, messages, rating, recommendations, rule_columns, rule_ids
+
+EMISSIONS = [0.0, 12.0, 50.0, 50.01, 75.0, 100.0, 100.5, 250.0]
+KMS = [100.0, 400.0, 1600.0]
+
+
+def reference(total_emissions, total_monthly_km, vehicle_type, people_count, fuel_type, emission_factors):
+    """The recommendations as the original app wrote them."""
+    recommendations = []
+    if total_emissions > 100:
+        recommendations.append("Your carbon footprint from commuting is quite high. Consider switching to more sustainable transport options.")
+    elif total_emissions > 50:
+        recommendations.append("Your carbon footprint is moderate. There's room for improvement by considering more sustainable options.")
+    else:
+        recommendations.append("Your carbon footprint is relatively low, but you can still make improvements.")
+    if vehicle_type == "Four Wheeler" and people_count == 1:
+        recommendations.append("Consider carpooling to reduce emissions. Sharing your ride with 3 other people could reduce your emissions by up to 75%.")
+    if fuel_type in ["petrol", "diesel"] and vehicle_type != "Public Transport":
+        recommendations.append("Consider switching to an electric vehicle to significantly reduce your carbon footprint.")
+    if vehicle_type in ["Four Wheeler", "Two Wheeler"]:
+        bus_emissions = total_monthly_km * emission_factors["public_transport"]["bus"]["electric"]
+        metro_emissions = total_monthly_km * emission_factors["public_transport"]["metro"]
+        if total_emissions > 2 * bus_emissions:
+            recommendations.append(f"Using an electric bus could reduce your emissions by approximately {(total_emissions - bus_emissions) / total_emissions * 100:.1f}%.")
+        if total_emissions > 2 * metro_emissions:
+            recommendations.append(f"Using metro could reduce your emissions by approximately {(total_emissions - metro_emissions) / total_emissions * 100:.1f}%.")
+    return recommendations
+
+
+def test_rules_match_the_original_recommendations(factor_set):
+    grid = list(itertools.product(EMISSIONS, KMS, KINDS, (1, 2), (None,) + FUELS))
+    kg, km, kind, people, fuel = zip(*grid)
+    results = evaluate(rule_columns(
+        kg, km, [KINDS.index(value) for value in kind], people,
+        [FUELS.index(value) if value is not None else NO_FUEL for value in fuel], factor_set.table,
+    ))
+    for i, commute in enumerate(grid):
+        expected = reference(*commute, factor_set.factors)
+        assert messages(results, i) == expected, commute
+        assert recommendations(*commute, table=factor_set.table) == expected, commute
+
+
+def test_rule_ids_of_known_commutes(factor_set):
+    # 400 km a month is 10 kg by electric bus and 6 kg by metro
+    columns = rule_columns(
+        [120.0, 30.0, 60.0, 15.0, 75.0],
+        [400.0] * 5,
+        [KINDS.index(kind) for kind in ("Four Wheeler", "Public Transport", "Combined Transport", "Two Wheeler", "Four Wheeler")],
+        [1, 1, 1, 1, 3],
+        [FUELS.index("petrol"), NO_FUEL, FUELS.index("diesel"), FUELS.index("electric"), FUELS.index("cng")],
+        factor_set.table,
+    )
+    results = evaluate(columns)
+    assert rule_ids(results).tolist() == [
+        "high;carpool;electric_vehicle;electric_bus;metro",
+        "low",
+        "moderate;electric_vehicle",
+        "low;metro",
+        "moderate;electric_bus;metro",
+    ]
+    assert results["carpool"][1][0] == 75.0
+    assert results["metro"][1][3] == pytest.approx(60.0)
+    # As the original app rated them, a band starts at its threshold
+    assert [rating(kg) for kg in (0, 49.9, 50, 100, 250)] == ["Low", "Low", "Moderate", "High", "High"]
@@ -0,0 +1,116 @@
+"""Report archives, and resuming a run that failed part way."""
+import csv
+import io
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+from carbon_footprint import reports
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Checkpoint after every chunk, and die without cleaning up just before the fifth checkpoint
+KILLED = """
+import os, sys
+from carbon_footprint import reports
+
+reports.CHECKPOINT_SECONDS = 0
+checkpoint = reports._ReportWriter.checkpoint
+calls = []
+
+def killed(self):
+    calls.append(1)
+    if len(calls) == 5:
+        os._exit(1)
+    checkpoint(self)
+
+reports._ReportWriter.checkpoint = killed
+reports.build_reports(sys.argv[1], sys.argv[2], chunksize=40)
+"""
+
+
+def contents(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def test_archive_has_a_report_per_accepted_row(tmp_path, survey):
+    archive = str(tmp_path / "reports.zip")
+    result = reports.build_reports(survey, archive, chunksize=40)
+
+    assert (result["rows"], result["rejected"]) == (300, 6)
+    files = contents(archive)
+    assert len([name for name in files if name.endswith("/report.html")]) == result["reports"] == 294
+    summary = list(csv.DictReader(io.StringIO(files["summary.csv"].decode("utf-8"))))
+    assert [row["id"] for row in summary] == [f"e{i}" for i in range(300)]
+    assert summary[7]["error"] and not summary[7]["report"]
+    assert f"{summary[0]['report']}report.csv" in files
+    assert not os.path.exists(archive + ".progress.json")
+
+
+def test_resumed_run_matches_an_uninterrupted_one(tmp_path, survey, monkeypatch):
+    full = str(tmp_path / "full.zip")
+    reports.build_reports(survey, full, chunksize=40)
+
+    # Checkpoint after every chunk, then fail on the fourth
+    monkeypatch.setattr(reports, "CHECKPOINT_SECONDS", 0)
+    render = reports._render_chunk
+    calls = []
+
+    def flaky(*args):
+        calls.append(1)
+        if len(calls) == 4:
+            raise RuntimeError("render failed")
+        return render(*args)
+
+    monkeypatch.setattr(reports, "_render_chunk", flaky)
+    archive = str(tmp_path / "resumed.zip")
+    with pytest.raises(RuntimeError):
+        reports.build_reports(survey, archive, chunksize=40)
+    assert os.path.exists(archive + ".progress.json")
+
+    # Whatever was written after the checkpoint is dropped on resume
+    with open(archive, "ab") as handle:
+        handle.write(b"\0" * 4096)
+    resumed = []
+    monkeypatch.setattr(reports, "_render_chunk", lambda *args: resumed.append(1) or render(*args))
+    result = reports.build_reports(survey, archive, chunksize=40)
+
+    # The three chunks checkpointed before the failure aren't rendered again
+    assert len(resumed) == 300 // 40 + 1 - 3
+
+    assert (result["rows"], result["reports"], result["rejected"]) == (300, 294, 6)
+    assert contents(archive) == contents(full)
+    assert not os.path.exists(archive + ".progress.json")
+
+
+def test_run_killed_between_checkpoints_resumes(tmp_path, survey):
+    full = str(tmp_path / "full.zip")
+    reports.build_reports(survey, full, chunksize=40)
+
+    archive = str(tmp_path / "killed.zip")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    killed = subprocess.run([sys.executable, "-c", KILLED, survey, archive], env=env)
+    assert killed.returncode == 1
+    # Four chunks were checkpointed, and the fifth written over the last checkpoint's directory
+    with open(archive + ".progress.json", encoding="utf-8") as handle:
+        assert json.load(handle)["rows"] == 160
+
+    # A checkpointed entry that changed since isn't resumed from
+    with open(archive, "rb") as handle:
+        original = handle.read()
+    with open(archive, "r+b") as handle:
+        handle.seek(200)
+        handle.write(bytes([original[200] ^ 0xFF]))
+    with pytest.raises(ValueError, match="restart"):
+        reports.build_reports(survey, archive, chunksize=40)
+    with open(archive, "wb") as handle:
+        handle.write(original)
+
+    result = reports.build_reports(survey, archive, chunksize=40)
+    assert (result["rows"], result["reports"], result["rejected"]) == (300, 294, 6)
+    assert contents(archive) == contents(full)
@@ -0,0 +1,105 @@
+"""The scenario optimizer against a brute-force search of the same choices."""
+import itertools
+from functools import lru_cache
+
+import numpy as np
+import pytest
+
+from carbon_footprint import options
+from carbon_footprint.calculator import calculate_many, encode_commutes
+from carbon_footprint.engine import score
+from carbon_footprint.scenarios import CC_BUCKETS, optimize
+
+RATIOS = (0.5,)
+DISTANCE = {"distance": 14.0, "days_per_week": 5, "weeks_per_month": 4}
+FLEET = [
+    dict(DISTANCE, transport_category="Private Transport", vehicle_type="Four Wheeler", vehicle_category="suv",
+         fuel_type="diesel", engine_cc=2000, people_count=1),
+    dict(DISTANCE, transport_category="Private Transport", vehicle_type="Two Wheeler", vehicle_category="Motorcycle",
+         fuel_type="petrol", engine_cc=350, people_count=2),
+    dict(DISTANCE, transport_category="Public Transport", public_mode="Taxi", taxi_type="sedan", public_fuel_type="petrol"),
+    dict(DISTANCE, transport_category="Both Private and Public", vehicle_type="Three Wheeler", fuel_type="cng",
+         engine_cc=200, public_mode="Bus", public_fuel_type="diesel", private_trips=1, total_trips=2),
+]
+CONSTRAINTS = [
+    {},
+    {"max_public_legs": 0},
+    {"max_rideshare": 1},
+    {"exclude": ("metro", "bus", "two_wheeler")},
+    {"no_new_vehicle": True},
+    {"no_new_vehicle": True, "max_public_legs": 0, "max_rideshare": 2},
+]
+
+
+def private_choices(own=None):
+    """``(vehicle key, calculate inputs)`` of every private vehicle, or only ``own`` shared by any number of people."""
+    for vehicle_type, key in options.VEHICLE_TYPES.items():
+        sizes = {"two_wheeler": options.TWO_WHEELER_CATEGORIES, "four_wheeler": options.CAR_TYPES}.get(key, [None])
+        for size in sizes:
+            for fuel in options.FUEL_OPTIONS["hybrid" if size == "hybrid" else key]:
+                vehicle = {"vehicle_type": vehicle_type, "vehicle_category": size, "fuel_type": fuel}
+                if own is not None and vehicle != {name: own[name] for name in vehicle}:
+                    continue
+                for engine_cc in CC_BUCKETS[key] if own is None else [own["engine_cc"]]:
+                    for people in range(1, options.MAX_PEOPLE[key] + 1):
+                        yield key, dict(vehicle, engine_cc=engine_cc, people_count=people)
+
+
+def public_choices():
+    for taxi_type, fuel in itertools.product(options.TAXI_TYPES, options.FUEL_OPTIONS["taxi"]):
+        for people in range(1, options.MAX_PEOPLE["taxi"] + 1):
+            yield "taxi", {"public_mode": "Taxi", "taxi_type": taxi_type, "public_fuel_type": fuel, "public_people_count": people}
+    for fuel in options.FUEL_OPTIONS["bus"]:
+        yield "bus", {"public_mode": "Bus", "public_fuel_type": fuel}
+    yield "metro", {"public_mode": "Metro"}
+
+
+def own_vehicle(inputs):
+    if inputs["transport_category"] != "Public Transport":
+        return tuple((name, inputs.get(name)) for name in ("vehicle_type", "vehicle_category", "fuel_type", "engine_cc"))
+    return None
+
+
+@lru_cache(maxsize=None)
+def brute_force(own, factor_set, max_public_legs=None, no_new_vehicle=False, max_rideshare=None, exclude=()):
+    """Lowest monthly kg CO₂e over every allowed choice, one candidate at a time.
+
+    ``own`` is the commuter's vehicle from ``own_vehicle``; it only matters with ``no_new_vehicle``.
+    """
+    if not no_new_vehicle:
+        private = list(private_choices())
+    else:
+        private = list(private_choices(dict(own))) if own is not None else []
+    public = [] if max_public_legs is not None and max_public_legs < 1 else list(public_choices())
+
+    def allowed(key, leg, people):
+        return key not in exclude and (max_rideshare is None or leg.get(people, 1) <= max_rideshare)
+
+    private = [leg for key, leg in private if allowed(key, leg, "people_count")]
+    public = [leg for key, leg in public if allowed(key, leg, "public_people_count")]
+    candidates = [dict(DISTANCE, transport_category="Private Transport", **leg) for leg in private]
+    candidates += [dict(DISTANCE, transport_category="Public Transport", **leg) for leg in public]
+    candidates += [
+        dict(DISTANCE, transport_category="Both Private and Public", private_trips=1, total_trips=2, **a, **b)
+        for a, b in itertools.product(private, public)
+    ]
+    if not candidates:
+        return None
+    profiles, errors = encode_commutes(candidates)
+    assert not any(errors)
+    return float(np.min(score(profiles, factor_set.table)))
+
+
+@pytest.mark.parametrize("constraints", CONSTRAINTS)
+def test_optimum_matches_a_brute_force_search(factor_set, constraints):
+    for inputs in FLEET:
+        result = optimize(inputs, RATIOS, factor_set=factor_set, **constraints)
+        expected = brute_force(own_vehicle(inputs) if constraints.get("no_new_vehicle") else None, factor_set, **constraints)
+        assert result["current_kg"] == pytest.approx(calculate_many([inputs], factor_set)[0]["emissions_kg"])
+        if expected is None:
+            assert result["best"] is None
+            continue
+        assert result["best_kg"] == pytest.approx(expected), inputs
+        # The best scenario, calculated like any commute, gives the emissions found
+        [best] = calculate_many([result["best"]], factor_set)
+        assert best["emissions_kg"] == pytest.approx(result["best_kg"])
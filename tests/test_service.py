@@ -0,0 +1,79 @@
+"""The scoring service over real connections, on a local ephemeral port."""
+import asyncio
+import json
+
+from carbon_footprint.calculator import calculate_many
+from carbon_footprint.service import MicroBatcher, Service
+
+COMMUTE = {"distance": 12.5, "vehicle_type": "Four Wheeler", "vehicle_category": "sedan", "fuel_type": "petrol"}
+
+
+async def post(port, path, payload):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+def serve_and(service, requests):
+    """Start ``service``, run ``requests(port)`` against it and return what it gives."""
+    async def main():
+        server = await asyncio.start_server(service.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await requests(port)
+
+    return asyncio.run(main())
+
+
+def test_bad_item_does_not_fail_its_batch():
+    bad = {"vehicle_type": ["x"]}
+    # A long wait, so the three requests are coalesced into one batch
+    service = Service(max_wait=0.2)
+    responses = serve_and(service, lambda port: asyncio.gather(*(post(port, "/calculate", item) for item in (COMMUTE, bad, COMMUTE))))
+
+    assert [status for status, _ in responses] == [200, 400, 200]
+    assert responses[0][1] == responses[2][1] == calculate_many([COMMUTE])[0]
+    assert "vehicle_type" in responses[1][1]["error"]
+
+
+def test_batch_endpoint_keeps_order():
+    items = [COMMUTE, {"distance": -1}, dict(COMMUTE, fuel_type="diesel")]
+    status, results = serve_and(Service(), lambda port: post(port, "/calculate/batch", items))
+
+    assert status == 200
+    assert results == calculate_many(items)
+    assert "error" in results[1] and "error" not in results[0] and "error" not in results[2]
+
+
+def test_unexpected_error_answers_500():
+    def handler(items):
+        raise RuntimeError("boom")
+
+    service = Service()
+    service.batcher = MicroBatcher(handler)
+    status, payload = serve_and(service, lambda port: post(port, "/calculate", COMMUTE))
+
+    assert status == 500
+    assert "boom" in payload["error"]
+
+
+def test_batcher_retries_items_alone_when_the_batch_fails():
+    def handler(items):
+        if any(item == "bad" for item in items):
+            raise RuntimeError("bad item")
+        return [item.upper() for item in items]
+
+    async def main():
+        batcher = MicroBatcher(handler, max_wait=0.05)
+        return await asyncio.gather(*(batcher.submit(item) for item in ("a", "bad", "c")), return_exceptions=True)
+
+    first, failed, last = asyncio.run(main())
+    assert (first, last) == ("A", "C")
+    assert isinstance(failed, RuntimeError)
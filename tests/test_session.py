@@ -0,0 +1,96 @@
+"""Per-session commute results, recomputed only where inputs changed."""
+import gc
+import os
+import random
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from carbon_footprint import session
+from carbon_footprint.calculator import with_defaults
+from carbon_footprint.ingest import process_file
+from carbon_footprint.recommend import KINDS
+from carbon_footprint.session import Commute, score_survey
+
+CHOICES = {
+    "distance": lambda rng: round(rng.uniform(0.1, 80), 1),
+    "days_per_week": lambda rng: rng.randint(1, 7),
+    "weeks_per_month": lambda rng: rng.randint(1, 5),
+    "emission_factor": lambda rng: rng.choice([0.0, 0.05, 0.12, 0.21]),
+    "vehicle_type": lambda rng: rng.choice(KINDS),
+    "vehicle_name": lambda rng: rng.choice(["Sedan (petrol, 1200cc)", "Metro", "Scooter (electric, 150cc)"]),
+    "people_count": lambda rng: rng.randint(1, 4),
+    "fuel_type": lambda rng: rng.choice([None, "petrol", "diesel", "cng", "electric"]),
+}
+
+
+def results(commute):
+    return commute.monthly_km, commute.emissions_kg, commute.comparison(), commute.rank(), commute.recommendations()
+
+
+def test_changing_one_input_at_a_time_matches_a_fresh_commute(factor_set):
+    rng = random.Random(0)
+    inputs = {name: choose(rng) for name, choose in CHOICES.items()}
+    commute = Commute()
+    commute.set(factor_set=factor_set, **inputs)
+    for _ in range(500):
+        name = rng.choice(list(CHOICES))
+        inputs[name] = CHOICES[name](rng)
+        commute.set(factor_set=factor_set, **inputs)
+        fresh = Commute()
+        fresh.set(factor_set=factor_set, **inputs)
+        assert results(commute) == results(fresh), inputs
+
+
+def test_only_dependent_results_are_recomputed(factor_set, monkeypatch):
+    calls = Counter()
+
+    def counted(name, function):
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(session, "alternatives", counted("alternatives", session.alternatives))
+    monkeypatch.setattr(session, "advice", counted("advice", session.advice))
+    inputs = dict(
+        distance=12.5, days_per_week=5, weeks_per_month=4, emission_factor=0.12, vehicle_type="Four Wheeler",
+        vehicle_name="Sedan (petrol, 1200cc)", people_count=1, fuel_type="petrol", factor_set=factor_set,
+    )
+    commute = Commute()
+    assert commute.set(**inputs)
+    assert not commute.set(**inputs)
+    assert calls == {"alternatives": 1, "advice": 1}
+
+    # Only the emissions, and the advice that depends on them
+    assert commute.set(**dict(inputs, vehicle_name="My car", emission_factor=0.2))
+    assert commute.emissions_kg == pytest.approx(0.2 * commute.monthly_km)
+    assert calls == {"alternatives": 1, "advice": 2}
+
+    # The same monthly distance, so nothing after it
+    assert commute.set(**dict(inputs, vehicle_name="My car", emission_factor=0.2, days_per_week=4, weeks_per_month=5))
+    assert calls == {"alternatives": 1, "advice": 2}
+
+    commute.set(**dict(inputs, fuel_type="electric"))
+    assert calls == {"alternatives": 2, "advice": 3}
+    assert np.isnan(commute.alternatives).any()
+
+
+def test_scored_survey_is_kept_in_a_file_until_dropped(tmp_path):
+    survey = tmp_path / "survey.csv"
+    pd.DataFrame([with_defaults({"distance": km}) for km in (5.0, -1.0, 12.5)]).to_csv(survey, index=False)
+    expected = tmp_path / "expected.csv"
+    summary = process_file(str(survey), str(expected))
+
+    results = score_survey(str(survey))
+    assert results.summary == summary
+    with open(results.path, "rb") as scored, open(expected, "rb") as handle:
+        assert scored.read() == handle.read()
+
+    path = results.path
+    del results
+    gc.collect()
+    assert not os.path.exists(path)
+
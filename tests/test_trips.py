@@ -0,0 +1,87 @@
+"""Multi-leg trips scored from a legs table."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from carbon_footprint import options
+from carbon_footprint.engine import emission_factor
+from carbon_footprint.trips import Trips, leg_emissions, summarize, score_trips
+
+LEGS = pd.DataFrame(
+    [
+        ("a", "four_wheeler", "sedan", "petrol", 1800, 12.0, 2),
+        ("a", "metro", "", "", None, 20.0, 1),
+        ("b", "two_wheeler", "Scooter", "electric", None, 5.5, 1),
+        ("b", "taxi", "small", "cng", None, 3.0, 3),
+        ("b", "bus", "", "diesel", None, 8.0, 1),
+        ("c", "three_wheeler", "", "cng", 200, 4.0, 1),
+    ],
+    columns=["trip_id", "mode", "size", "fuel", "engine_cc", "km", "people"],
+)
+
+
+def test_trip_emissions_are_the_sum_of_their_legs(factor_set):
+    out = score_trips(LEGS, factor_set=factor_set)
+
+    expected = {}
+    for row in LEGS.itertuples():
+        cc = row.engine_cc if not np.isnan(row.engine_cc) else options.ENGINE_CC.get(row.mode, (0, 0, 0))[2]
+        factor = emission_factor(row.mode, row.size, row.fuel or None, cc, table=factor_set.table)
+        expected[row.trip_id] = expected.get(row.trip_id, 0.0) + row.km * factor / row.people
+    assert out["trip_id"].tolist() == ["a", "b", "c"]
+    assert out["legs"].tolist() == [2, 3, 1]
+    assert out["km"].tolist() == pytest.approx([32.0, 16.5, 4.0])
+    assert out["emissions_kg"].tolist() == pytest.approx([expected[trip] for trip in "abc"])
+    assert out["main_mode"].tolist() == ["metro", "bus", "three_wheeler"]
+    assert (out["error"] == "").all()
+
+
+@pytest.mark.parametrize("engine_cc", [-9000, 0, 5000])
+def test_engine_size_out_of_range_rejects_the_trip(factor_set, engine_cc):
+    legs = LEGS.copy()
+    legs.loc[0, "engine_cc"] = engine_cc
+    out = score_trips(legs, factor_set=factor_set)
+
+    assert np.isnan(out["emissions_kg"][0])
+    assert out["error"][0] == "engine_cc must be from 600 to 4000 for four_wheeler"
+    assert (out["error"][1:] == "").all()
+
+
+def test_bad_leg_rejects_only_its_trip(factor_set):
+    legs = LEGS.copy()
+    legs.loc[2, "fuel"] = "hydrogen"
+    out = score_trips(legs, factor_set=factor_set)
+
+    assert out["error"].tolist()[1].startswith("fuel must be one of")
+    assert out["error"].tolist()[0] == out["error"].tolist()[2] == ""
+    assert np.isnan(out["emissions_kg"][1]) and not np.isnan(out["emissions_kg"][[0, 2]]).any()
+
+
+@pytest.mark.parametrize("lengths", [[0, 3, 1], [2, 0, 0, 3], [1, 2, 0], [0, 0], [3]])
+def test_trips_without_legs_anywhere(factor_set, lengths):
+    rng = np.random.default_rng(len(lengths))
+    n = sum(lengths)
+    legs = {
+        "vehicle": rng.choice([1, 2, 4, 5], n),
+        "fuel": rng.choice([1, 2], n),
+        "engine_cc": np.full(n, 1500.0),
+        "km": rng.uniform(1, 20, n).round(1),
+    }
+    trips = Trips.from_lengths(legs, lengths)
+    mask = rng.random(n) < 0.5
+    summary = summarize(trips, factor_set.table)
+    kg_per_leg = leg_emissions(trips, factor_set.table)
+
+    km, kg, first, longest = [], [], [], []
+    for start, end in zip(trips.offsets[:-1], trips.offsets[1:]):
+        km.append(sum(legs["km"][start:end]))
+        kg.append(sum(kg_per_leg[start:end]))
+        first.append(next((i for i in range(start, end) if mask[i]), -1))
+        longest.append(legs["vehicle"][start + int(np.argmax(legs["km"][start:end]))] if end > start else -1)
+    assert trips.sum(legs["km"]).tolist() == pytest.approx(km)
+    assert trips.first(mask).tolist() == first
+    assert summary["legs"].tolist() == lengths
+    assert summary["km"].tolist() == pytest.approx(km)
+    assert summary["emissions_kg"].tolist() == pytest.approx(kg, nan_ok=True)
+    assert summary["main_vehicle"].tolist() == longest
+
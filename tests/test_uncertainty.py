@@ -0,0 +1,64 @@
+"""Monte Carlo bands: reproducible for a seed, whatever the number of workers."""
+import random
+
+import numpy as np
+import pytest
+
+from carbon_footprint import options, uncertainty
+from carbon_footprint.calculator import encode_commutes, with_defaults
+from carbon_footprint.engine import score
+from carbon_footprint.factorsets import active
+from carbon_footprint.uncertainty import fleet_bands, simulate
+
+DRAWS = 400
+
+
+@pytest.fixture(scope="module")
+def profiles():
+    rng = random.Random(0)
+    rows = []
+    for _ in range(300):
+        vehicle_type = rng.choice(list(options.VEHICLE_TYPES))
+        key = options.VEHICLE_TYPES[vehicle_type]
+        inputs = {"distance": round(rng.uniform(1, 40), 1), "vehicle_type": vehicle_type, "fuel_type": rng.choice(options.FUEL_OPTIONS[key])}
+        if key == "two_wheeler":
+            inputs["vehicle_category"] = rng.choice(options.TWO_WHEELER_CATEGORIES)
+        elif key == "four_wheeler":
+            inputs["vehicle_category"] = rng.choice([car for car in options.CAR_TYPES if car != "hybrid"])
+        low, high, _ = options.ENGINE_CC[key]
+        inputs["engine_cc"] = rng.randint(low, high)
+        rows.append(with_defaults(inputs))
+    profiles, errors = encode_commutes(rows)
+    assert not any(errors)
+    return profiles
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_results_do_not_depend_on_the_workers(profiles, monkeypatch, workers):
+    # Blocks of 40 commuters, so the work is split
+    monkeypatch.setattr(uncertainty, "SAMPLE_BUDGET", DRAWS * 40)
+    bands, totals = simulate(profiles, DRAWS, seed=7, workers=1)
+    spread, spread_totals = simulate(profiles, DRAWS, seed=7, workers=workers)
+
+    assert list(bands) == ["p5_kg", "p50_kg", "p95_kg"]
+    for name in bands:
+        assert np.array_equal(bands[name], spread[name])
+    assert np.array_equal(totals, spread_totals)
+
+    other, _ = simulate(profiles, DRAWS, seed=8, workers=1)
+    assert not np.array_equal(bands["p50_kg"], other["p50_kg"])
+
+
+def test_fleet_totals_add_up_across_calls(profiles):
+    bands, totals = simulate(profiles, DRAWS, seed=0)
+    point = score(profiles, active().table)
+    assert np.all(bands["p5_kg"] <= bands["p50_kg"]) and np.all(bands["p50_kg"] <= bands["p95_kg"])
+
+    # Totals of separate calls add up to those of one call
+    half = len(point) // 2
+    first = {name: values[:half] for name, values in profiles.items()}
+    second = {name: values[half:] for name, values in profiles.items()}
+    parts = simulate(first, DRAWS, seed=0)[1] + simulate(second, DRAWS, seed=0)[1]
+    assert parts == pytest.approx(totals)
+    fleet = fleet_bands(totals)
+    assert fleet["p5_kg"] <= point.sum() <= fleet["p95_kg"]